@@ -1,22 +1,77 @@
 # -*- coding: utf-8 -*-
 import os
-from datetime import datetime, date, time
+import atexit
+import bisect
+import gzip
+import hashlib
+import multiprocessing
+import posixpath
+import queue
+import random
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, time, timedelta
+from time import perf_counter, sleep
 from functools import wraps
-from sqlalchemy import or_, func
-
-
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from collections import defaultdict, OrderedDict
+from types import SimpleNamespace
+from itertools import islice
+from sqlalchemy import or_, func, case, insert, update, exists, event, inspect as sa_inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateTable
+
+
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, send_file,
+                   jsonify, Response, stream_with_context, g, abort, has_request_context, send_from_directory)
+import json
+import re
+import shutil
+import sqlite3
+import click
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
 from openpyxl import Workbook, load_workbook
+from markupsafe import Markup
+try:
+    import brotli  # optional: Brotli response compression when installed
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+# DATABASE_URL points the app (or a maintenance command) at another SQLite file, e.g. a restored copy
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Ward-access scope -> blocks and/or ward names the palata login works with.
+# Override with WARD_ACCESS_SCOPES="palata1=A;palata2=B;palata3=C,D,R" (an empty value disables scoping).
+app.config['WARD_ACCESS_SCOPES'] = {
+    scope.strip(): [x.strip() for x in targets.split(',') if x.strip()]
+    for scope, _, targets in (item.partition('=') for item in
+                              os.environ.get('WARD_ACCESS_SCOPES', 'palata1=A;palata2=B;palata3=C,D,R').split(';'))
+    if scope.strip()
+}
+
+# Patients discharged more than this many days ago are moved to patient_archive (flask archive / Settings)
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Audit log entries older than this many days are removed by `flask purge-audit`
+app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 730))
+
+# Snapshots taken by `flask backup` / Settings -> Backups and by the in-app schedule (0 hours disables it)
+app.config['BACKUP_FOLDER'] = os.environ.get('BACKUP_FOLDER') or os.path.join(app.instance_path, 'backups')
+app.config['BACKUP_KEEP'] = int(os.environ.get('BACKUP_KEEP', 14))
+app.config['BACKUP_INTERVAL_HOURS'] = float(os.environ.get('BACKUP_INTERVAL_HOURS', 24))
+
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)  # ensure folder exists for Excel exports
+# Files in uploads/ older than this many days are removed by `flask data purge-uploads`
+app.config['UPLOAD_RETENTION_DAYS'] = int(os.environ.get('UPLOAD_RETENTION_DAYS', 30))
+# Worker processes that parse uploaded workbooks in parallel (one file per worker)
+app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS') or os.cpu_count() or 1)
 
 db = SQLAlchemy(app)
 
@@ -38,6 +93,7 @@ class Ward(db.Model):
     name = db.Column(db.String(64), nullable=False)  # e.g., 'A-101'
     sort_order = db.Column(db.Integer, nullable=False, default=0)
     block = db.Column(db.String(1), nullable=False, default='A')  # 'A' or 'B'
+    capacity = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # beds; 0 = not set
 
 
 class Doctor(db.Model):
@@ -46,8 +102,28 @@ class Doctor(db.Model):
     sort_order = db.Column(db.Integer, nullable=False, default=0)
 
 
+class Person(db.Model):
+    """A person across admissions; every Patient row is one admission (stay) of a Person."""
+    # AUTOINCREMENT: archived admissions keep their person_id, so an id must never point at someone else
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    match_key = db.Column(db.String(255), nullable=False, unique=True)  # see person_match_key()
+    phonetic_key = db.Column(db.String(255), nullable=True, index=True)  # see person_phonetic_key()
+    last_name = db.Column(db.String(64), nullable=False)
+    first_name = db.Column(db.String(64), nullable=False)
+    patronymic = db.Column(db.String(64), nullable=False)
+    birth_date = db.Column(db.String(10), nullable=False)    # dd.mm.yyyy (text)
+    # contact details as of the latest admission
+    phone = db.Column(db.String(32), nullable=True)
+    address = db.Column(db.String(128), nullable=True)
+    occupation = db.Column(db.String(64), nullable=True)
+
+
 class Patient(db.Model):
+    # AUTOINCREMENT: ids are never handed out again, since archived and audited rows keep them
+    __table_args__ = {'sqlite_autoincrement': True}
     id = db.Column(db.Integer, primary_key=True)
+    person_id = db.Column(db.Integer, db.ForeignKey('person.id'), nullable=True, index=True)
     hist_number = db.Column(db.String(64), nullable=False)   # Ист номер
     last_name = db.Column(db.String(64), nullable=False)     # Фамилия
     first_name = db.Column(db.String(64), nullable=False)    # Имя
@@ -59,270 +135,233 @@ class Patient(db.Model):
 
     arrival_date = db.Column(db.String(10), nullable=False)  # dd.mm.yyyy
     arrival_time = db.Column(db.String(5), nullable=False)   # HH:MM
-    ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=False)
+    ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=False, index=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
 
     caregiver_exists = db.Column(db.Boolean, nullable=False, default=False)
     caregiver_fullname = db.Column(db.String(128), nullable=True)
-    caregiver_ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=True)
+    caregiver_ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=True, index=True)
     caregiver_arrival_date = db.Column(db.String(10), nullable=True)
     caregiver_departure_date = db.Column(db.String(10), nullable=True)
 
     discharge_datetime = db.Column(db.String(16), nullable=True)  # dd.mm.yyyy HH:MM
+    # Optimistic lock: every UPDATE of the patient's own fields bumps it, and edit_patient()
+    # only writes WHERE version = the version its form was loaded with
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     ward = db.relationship('Ward', foreign_keys=[ward_id])
     caregiver_ward = db.relationship('Ward', foreign_keys=[caregiver_ward_id])
     doctor = db.relationship('Doctor')
+    person = db.relationship('Person', backref=db.backref('admissions', lazy='dynamic'))
+
+
+class PatientArchive(db.Model):
+    """Cold storage for patients discharged long ago (see archive_discharged()).
+
+    Same columns and ids as Patient, without foreign keys, plus archived_at.
+    """
+    __tablename__ = 'patient_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    person_id = db.Column(db.Integer, nullable=True, index=True)
+    hist_number = db.Column(db.String(64), nullable=False)
+    last_name = db.Column(db.String(64), nullable=False)
+    first_name = db.Column(db.String(64), nullable=False)
+    patronymic = db.Column(db.String(64), nullable=False)
+    birth_date = db.Column(db.String(10), nullable=False)
+    phone = db.Column(db.String(32), nullable=False)
+    address = db.Column(db.String(128), nullable=False)
+    occupation = db.Column(db.String(64), nullable=False)
+
+    arrival_date = db.Column(db.String(10), nullable=False)
+    arrival_time = db.Column(db.String(5), nullable=False)
+    ward_id = db.Column(db.Integer, nullable=False, index=True)
+    doctor_id = db.Column(db.Integer, nullable=False)
+
+    caregiver_exists = db.Column(db.Boolean, nullable=False, default=False)
+    caregiver_fullname = db.Column(db.String(128), nullable=True)
+    caregiver_ward_id = db.Column(db.Integer, nullable=True)
+    caregiver_arrival_date = db.Column(db.String(10), nullable=True)
+    caregiver_departure_date = db.Column(db.String(10), nullable=True)
+
+    discharge_datetime = db.Column(db.String(16), nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+class Stay(db.Model):
+    """Occupancy index: one row per bed use (a patient, or their caregiver), derived from Patient.
+
+    Rebuilt by _patients_changed() on every patient write; never edited directly.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
+    ward_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=True)
+    kind = db.Column(db.String(1), nullable=False)       # 'P' patient, 'C' caregiver
+    start_at = db.Column(db.DateTime, nullable=False)
+    end_at = db.Column(db.DateTime, nullable=True)       # None = still there
+
+    __table_args__ = (
+        db.Index('ix_stay_ward_start', 'ward_id', 'start_at'),
+        db.Index('ix_stay_end_start', 'end_at', 'start_at'),
+    )
+
+
+class AppState(db.Model):
+    """Small named counters, e.g. data_version (bumped on every write that changes rendered data)."""
+    __tablename__ = 'app_state'
+    key = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyStat(db.Model):
+    """Daily rollup per ward and doctor: admissions counted on the arrival day, discharges (with their
+    length of stay) on the discharge day. Kept in step by _patients_changed(), archived patients included;
+    rebuild_daily_stats() recomputes it from scratch.
+    """
+    __tablename__ = 'daily_stat'
+    day = db.Column(db.Date, primary_key=True)
+    ward_id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    admissions = db.Column(db.Integer, nullable=False, default=0)
+    caregivers = db.Column(db.Integer, nullable=False, default=0)     # admissions with a caregiver
+    discharges = db.Column(db.Integer, nullable=False, default=0)
+    stay_minutes = db.Column(db.Integer, nullable=False, default=0)   # summed length of stay of the discharges
+
+
+class AuditLog(db.Model):
+    """Append-only trail of patient writes; one row per patient per action, with field-level changes.
+
+    patient_id has no foreign key so entries outlive deleted and archived patients.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    at = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    username = db.Column(db.String(64), nullable=True)   # as of the change; None = CLI / system
+    patient_id = db.Column(db.Integer, nullable=True)
+    action = db.Column(db.String(16), nullable=False)    # create, update, discharge, transfer, delete, archive
+    changes = db.Column(db.Text, nullable=True)          # JSON {field: [old, new]}
+
+    __table_args__ = (
+        db.Index('ix_audit_patient', 'patient_id', 'id'),
+    )
 
 # -------------------- Internationalization --------------------
 
+# One flat JSON file of messages per language; uz is the reference every other language must match
+TRANSLATIONS_FOLDER = os.path.join(os.path.dirname(__file__), 'translations')
+DEFAULT_LANG = 'uz'
+
+
+class Catalog(dict):
+    """One language's compiled messages. t(key) and t[key] are a single dict lookup;
+    a missing key comes back as the key itself."""
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return key
+
+    __call__ = dict.__getitem__
+
+
+def _no_duplicate_keys(pairs):
+    keys = [k for k, _ in pairs]
+    duplicates = sorted({k for k in keys if keys.count(k) > 1})
+    if duplicates:
+        raise ValueError('duplicate keys: ' + ', '.join(duplicates))
+    return dict(pairs)
+
+def load_translations(folder=TRANSLATIONS_FOLDER):
+    """{lang: {key: message}} from <folder>/<lang>.json; ValueError on duplicate keys or non-string values."""
+    catalogs = {}
+    for name in sorted(os.listdir(folder)):
+        lang, ext = os.path.splitext(name)
+        if ext != '.json':
+            continue
+        with open(os.path.join(folder, name), encoding='utf-8') as f:
+            try:
+                messages = json.load(f, object_pairs_hook=_no_duplicate_keys)
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}') from None
+        bad = [k for k, v in messages.items() if not isinstance(v, str)]
+        if bad:
+            raise ValueError(f'{name}: values must be strings: ' + ', '.join(bad))
+        catalogs[lang] = messages
+    if DEFAULT_LANG not in catalogs:
+        raise ValueError(f'{folder} has no {DEFAULT_LANG}.json')
+    return catalogs
+
+def translation_problems(catalogs):
+    """Human-readable differences against the reference language: missing / unknown keys and
+    mismatched {} placeholders. Empty when every catalog is complete."""
+    problems = []
+    reference = catalogs[DEFAULT_LANG]
+    for lang, messages in catalogs.items():
+        if lang == DEFAULT_LANG:
+            continue
+        problems += [f'{lang}: missing {k}' for k in reference if k not in messages]
+        problems += [f'{lang}: unknown {k}' for k in messages if k not in reference]
+        problems += [f'{lang}: placeholders differ in {k}' for k, v in messages.items()
+                     if k in reference and v.count('{}') != reference[k].count('{}')]
+    return problems
+
+# t() / t[] with a quoted literal key; keys built at runtime (t('dup_' ~ reason)) are not seen
+_T_CALL = re.compile(r"""\bt(?:\(|\[)\s*(['"])(\w+)\1\s*[)\]]""")
+TRANSLATION_SOURCES = [os.path.join(os.path.dirname(__file__), 'app.py'),
+                       os.path.join(os.path.dirname(__file__), 'templates')]
+
+def used_translation_keys(sources=TRANSLATION_SOURCES):
+    """{key: [file:line, ...]} for every quoted literal key passed to t() in the given .py/.html files and folders."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths += sorted(os.path.join(root, name) for root, _, names in os.walk(source)
+                            for name in names if name.endswith(('.html', '.py')))
+        else:
+            paths.append(source)
+    used = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for lineno, line in enumerate(f, 1):
+                for m in _T_CALL.finditer(line):
+                    used.setdefault(m.group(2), []).append(f'{os.path.relpath(path)}:{lineno}')
+    return used
+
+def untranslated_keys(catalogs, used):
+    """Problems for keys used in the code that the reference language (uz) does not define."""
+    return [f'{DEFAULT_LANG}: no message for {k} (used at {", ".join(where)})'
+            for k, where in sorted(used.items()) if k not in catalogs[DEFAULT_LANG]]
+
+I18N = load_translations()
+CATALOGS = {lang: Catalog(messages) for lang, messages in I18N.items()}
+
 def get_lang():
-    return session.get('lang', 'uz')
-
-I18N = {
-    # Uzbek — Latin
-    'uz': {
-        'app_title': 'Klinika Palata Boshqaruvi',
-        'login': 'Kirish',
-        'username': 'Login',
-        'password': 'Parol',
-        'logout': 'Chiqish',
-        'registration': 'Ro‘yxatdan o‘tkazish',
-        'patients': 'Bemorlar',
-        'inpatient': 'Statsionardagi bemorlar',
-        'settings': 'Sozlamalar',
-        'wards_list': 'Palatalar ro‘yxati',
-        'doctors_list': 'Shifokorlar ro‘yxati',
-        'import': 'Import',
-        'lang': 'Til',
-        'save': 'Saqlash',
-        'add_new': 'Yangi qo‘shish',
-        'delete_selected': 'Belgilanganlarni o‘chirish',
-        'name': 'Nomi',
-        'sort_order': 'Tartib raqami',
-        'block': 'Blok',
-        'A_block': 'A blok',
-        'B_block': 'B blok',
-        'hist_number': 'Istoriya raqami',
-        'patient_full_name': 'Bemor F.I.O',
-        'last_name': 'Familiyasi',
-        'first_name': 'Ismi',
-        'patronymic': 'Otasining ismi',
-        'birth_date': 'Tug‘ilgan sana',
-        'phone': 'Telefon',
-        'address': 'Yashash manzili',
-        'occupation': 'Kasbi',
-        'arrival_date': 'Kelgan sana',
-        'arrival_time': 'Kelgan vaqti ',
-        'arrival_datetime': 'Kelgan payt',
-        'ward': 'Palata',
-        'doctor': 'Shifokor',
-        'caregiver': 'Qarovchi',
-        'yes': 'Ha',
-        'no': 'Yo‘q',
-        'caregiver_fullname': 'Qarovchi F.I.O',
-        'caregiver_ward': 'Palata (qarovchi)',
-        'caregiver_arrival_date': 'Kelgan sana (qarovchi)',
-        'caregiver_departure_date': 'Ketgan sana (qarovchi)',
-        'discharge': 'Ketgan payt ',
-        'discharge_datetime': 'Ketgan payt ',
-        'search': 'Qidirish',
-        'cancel': 'Bekor qilish',
-        'export': 'Eksport (Excel)',
-        'edit_profile': 'Profilni tahrirlash',
-        'caregiver_details': 'Qarovchi ma’lumotlari',
-        'submit': 'Yuborish',
-        'patients_per_page': 'Har sahifada 500 ta bemor',
-        'only_superadmin': 'Bu sahifaga faqat superadmin kira oladi.',
-        'patient_fullname': 'Bemor F.I.O',
-        'as_of': 'Qaysi payt bo‘yicha',
-        'show': 'Ko‘rsatish',
-        'instructions_title': 'Ko‘rsatmalar',
-        'import_instr_xlsx_only': 'Faqat .xlsx faylini yuklang (Excel 2007+). Eski .xls qo‘llab-quvvatlanmaydi.',
-        'import_instr_headers': 'Quyidagi shablondagi sarlavhalardan yoki UZ/RU/EN ekvivalentlaridan foydalaning.',
-        'import_instr_required_cols': 'Majburiy ustunlar: Istoriya raqami, Familiyasi, Ismi, Otasining ismi, Tug‘ilgan sana.',
-        'download_template': 'Shablonni yuklab olish (.xlsx)',
-        'excel_file_label': 'Excel fayli (.xlsx)',
-        'import_btn': 'Import',
-        'C_block': 'C blok',
-        'D_block': 'Diagnostika',
-        'R_block': 'Reanimatsiya',
-        'as_of': "Vaqtga ko'ra",
-        'show': "Ko'rsatish",
-        'patients_col': "Bemor(lar)",
-        'cleanup_invalid': "Majburiy maydonlari yoʻq bemorlar",
-        'cleanup_intro': "Quyidagi bemorlar majburiy maydonlarni toʻliq toʻldirmagan. Pastdagi tugma orqali ularning barchasini oʻchirishingiz mumkin.",
-        'missing_fields': "Yetishmayotgan maydonlar",
-        'delete_all_listed': "Koʻrsatilganlarning barchasini oʻchirish",
-        'back': "Ortga",
-        'deleted_n_patients': "{} ta bemor oʻchirildi",
-        'no_invalid_records': "Majburiy maydonsiz bemor topilmadi.",
-
-
-    },
-    # Russian
-    'ru': {
-        'app_title': 'Управление палатами клиники',
-        'login': 'Вход',
-        'username': 'Логин',
-        'password': 'Пароль',
-        'logout': 'Выход',
-        'registration': 'Регистрация',
-        'patients': 'Пациенты',
-        'inpatient': 'Пациенты в стационаре',
-        'settings': 'Настройки',
-        'wards_list': 'Палата лист',
-        'doctors_list': 'Врач лист',
-        'import': 'Импорт',
-        'lang': 'Язык',
-        'save': 'Сохранить',
-        'add_new': 'Добавить новый',
-        'delete_selected': 'Удалить выбранные',
-        'name': 'Название',
-        'sort_order': 'Порядок',
-        'block': 'Блок',
-        'A_block': 'A блок',
-        'B_block': 'B блок',
-        'hist_number': 'Ист номер',
-        'patient_full_name': 'Ф.И.О пациента',
-        'last_name': 'Фамилия',
-        'first_name': 'Имя',
-        'patronymic': 'Отчество',
-        'birth_date': 'Дата рождения ',
-        'phone': 'Тел. номер',
-        'address': 'Адрес проживания',
-        'occupation': 'Профессия',
-        'arrival_date': 'Дата поступления ',
-        'arrival_time': 'Время поступления ',
-        'arrival_datetime': 'Время поступления',
-        'ward': 'Палата',
-        'doctor': 'Врач',
-        'caregiver': 'Ухажёр',
-        'yes': 'Да',
-        'no': 'Нет',
-        'caregiver_fullname': 'Ухажёр Ф.И.О',
-        'caregiver_ward': 'Палата (ухажёр)',
-        'caregiver_arrival_date': 'Дата поступления (ухажёр)',
-        'caregiver_departure_date': 'Дата выписки (ухажёр)',
-        'discharge': 'Дата выписки (дд.мм.гггг ЧЧ:MM)',
-        'discharge_datetime': 'Дата выписки',
-        'search': 'Поиск',
-        'cancel': 'Отменить',
-        'export': 'Экспорт (Excel)',
-        'edit_profile': 'Редактировать профиль',
-        'caregiver_details': 'Данные ухажёр',
-        'submit': 'Отправить',
-        'patients_per_page': 'По 500 пациентов на странице',
-        'only_superadmin': 'Доступ только для супер-админа.',
-        'patient_fullname': 'Ф.И.О пациента',
-        'as_of': 'На момент',
-        'show': 'Показать',
-        'instructions_title': 'Инструкции',
-        'import_instr_xlsx_only': 'Загрузите файл .xlsx (Excel 2007+). Старый .xls не поддерживается.',
-        'import_instr_headers': 'Используйте заголовки из шаблона ниже или их UZ/RU/EN эквиваленты.',
-        'import_instr_required_cols': 'Обязательные столбцы: Ист номер, Фамилия, Имя, Отчество, Дата рождения.',
-        'download_template': 'Скачать шаблон (.xlsx)',
-        'excel_file_label': 'Файл Excel (.xlsx)',
-        'import_btn': 'Импорт',
-        'C_block': 'C блок',
-        'D_block': 'Диагностика',
-        'R_block': 'Реанимация',
-        'as_of': "На дату/время",
-        'show': "Показать",
-        'patients_col': "Пациент(ы)",
-        'cleanup_invalid': "Пациенты с пустыми обязательными полями",
-        'cleanup_intro': "У следующих пациентов не заполнены обязательные поля. Вы можете удалить их все кнопкой ниже.",
-        'missing_fields': "Отсутствующие поля",
-        'delete_all_listed': "Удалить всех в списке",
-        'back': "Назад",
-        'deleted_n_patients': "Удалено {} пациентов",
-        'no_invalid_records': "Пациенты без обязательных полей не найдены.",
-
-
-    },
-    # English
-    'en': {
-        'app_title': 'Clinic Ward Management',
-        'login': 'Login',
-        'username': 'Username',
-        'password': 'Password',
-        'logout': 'Logout',
-        'registration': 'Registration',
-        'patients': 'Patients',
-        'inpatient': 'Inpatients (By Ward)',
-        'settings': 'Settings',
-        'wards_list': 'Ward List',
-        'doctors_list': 'Doctor List',
-        'import': 'Import',
-        'lang': 'Language',
-        'save': 'Save',
-        'add_new': 'Add New',
-        'delete_selected': 'Delete Selected',
-        'name': 'Name',
-        'sort_order': 'Sort Order',
-        'block': 'Block',
-        'A_block': 'Block A',
-        'B_block': 'Block B',
-        'hist_number': 'History No.',
-        'patient_full_name': 'Patient Full Name',
-        'last_name': 'Last Name',
-        'first_name': 'First Name',
-        'patronymic': 'Patronymic',
-        'birth_date': 'Date of Birth (dd.mm.yyyy)',
-        'phone': 'Phone',
-        'address': 'Address',
-        'occupation': 'Occupation',
-        'arrival_date': 'Arrival Date (dd.mm.yyyy)',
-        'arrival_time': 'Arrival Time (HH:MM)',
-        'arrival_datetime': 'Arrival DateTime',
-        'ward': 'Ward',
-        'doctor': 'Doctor',
-        'caregiver': 'Caregiver',
-        'yes': 'Yes',
-        'no': 'No',
-        'caregiver_fullname': 'Caregiver Full Name',
-        'caregiver_ward': 'Ward (Caregiver)',
-        'caregiver_arrival_date': 'Arrival Date (Caregiver)',
-        'caregiver_departure_date': 'Departure Date (Caregiver)',
-        'discharge': 'Discharge (dd.mm.yyyy HH:MM)',
-        'discharge_datetime': 'Discharge time',
-        'search': 'Search',
-        'cancel': 'Cancel',
-        'export': 'Export (Excel)',
-        'edit_profile': 'Edit Profile',
-        'caregiver_details': 'Caregiver Details',
-        'submit': 'Submit',
-        'patients_per_page': '500 patients per page',
-        'only_superadmin': 'Only superadmin can access this page.',
-        'patient_fullname': 'Patient Full Name',
-        'as_of': 'As of',
-        'show': 'Show',
-        'instructions_title': 'Instructions',
-        'import_instr_xlsx_only': 'Upload an .xlsx file (Excel 2007+). Old .xls is not supported.',
-        'import_instr_headers': 'Use the header names from the template below, or equivalent Uzbek/Russian/English variants.',
-        'import_instr_required_cols': 'Minimum required columns: History No., Last Name, First Name, Patronymic, Date of Birth.',
-        'download_template': 'Download template (.xlsx)',
-        'excel_file_label': 'Excel file (.xlsx)',
-        'import_btn': 'Import',
-        'C_block': 'Block C',
-        'D_block': 'Diagnostics',
-        'R_block': 'Reanimation',
-        'as_of': "As of",
-        'show': "Show",
-        'patients_col': "Patient(s)",
-        'cleanup_invalid': "Patients with missing required fields",
-        'cleanup_intro': "The patients below are missing required fields. You can delete them all using the button below.",
-        'missing_fields': "Missing fields",
-        'delete_all_listed': "Delete all listed",
-        'back': "Back",
-        'deleted_n_patients': "Deleted {} patients",
-        'no_invalid_records': "No patients with missing required fields.",
-    }
-}
+    return session.get('lang', DEFAULT_LANG)
+
+def translator():
+    """The current language's Catalog, looked up once per request (the default language outside one)."""
+    if not has_request_context():
+        return CATALOGS[DEFAULT_LANG]
+    if 'translator' not in g:
+        g.translator = CATALOGS.get(get_lang(), CATALOGS[DEFAULT_LANG])
+    return g.translator
 
 def t(key):
-    lang = get_lang()
-    return I18N.get(lang, I18N['uz']).get(key, key)
+    return translator()[key]
+
+@app.cli.command('i18n-check')
+def i18n_check_command():
+    """Fail if a language misses keys of the reference language (uz) or has unknown ones,
+    or if app.py / templates use a literal key that uz does not define."""
+    problems = translation_problems(I18N) + untranslated_keys(I18N, used_translation_keys())
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f"{len(I18N)} languages, {len(I18N[DEFAULT_LANG])} keys each: OK.")
+
+for _problem in translation_problems(I18N):
+    app.logger.warning('translations: %s', _problem)
+
 
 # -------------------- Helpers --------------------
 
@@ -334,20 +373,117 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrapper
 
+def current_user():
+    """Logged-in User (loaded once per request) or None."""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = db.session.get(User, user_id) if user_id is not None else None
+    return g.current_user
+
+def scope_ward_ids():
+    """Ward ids the current user is limited to by User.ward_access, or None for the whole clinic
+    (also outside a request: CLI commands and background work)."""
+    if not has_request_context():
+        return None
+    if 'scope_ward_ids' not in g:
+        user = current_user()
+        targets = app.config['WARD_ACCESS_SCOPES'].get(user.ward_access) \
+            if user and user.role != 'superadmin' and user.ward_access else None
+        if not targets:
+            g.scope_ward_ids = None
+        else:
+            blocks = [x for x in targets if x in BLOCKS_ORDER]
+            names = [x for x in targets if x not in BLOCKS_ORDER]
+            g.scope_ward_ids = [wid for (wid,) in db.session.query(Ward.id)
+                                .filter(or_(Ward.block.in_(blocks), Ward.name.in_(names)))]
+    return g.scope_ward_ids
+
+def _scope_patients(query, model=None):
+    """Limit a Patient (or PatientArchive) query to the current user's wards (indexed ward_id IN (...))."""
+    ids = scope_ward_ids()
+    return query if ids is None else query.filter((model or Patient).ward_id.in_(ids))
+
+def _scope_persons(query):
+    """Limit a Person query to persons with at least one admission, current or archived, in the user's wards."""
+    ids = scope_ward_ids()
+    if ids is None:
+        return query
+    return query.filter(or_(exists().where(Patient.person_id == Person.id, Patient.ward_id.in_(ids)),
+                            exists().where(PatientArchive.person_id == Person.id, PatientArchive.ward_id.in_(ids))))
+
+def _scope_wards(query):
+    ids = scope_ward_ids()
+    return query if ids is None else query.filter(Ward.id.in_(ids))
+
+def _wards_allowed(*ids):
+    """True if every given ward id (None skipped) exists and is within the current user's scope.
+
+    SQLite does not check the ward foreign keys, and a patient moved outside the scope would
+    vanish from the user's own lists.
+    """
+    wanted = set(ids) - {None}
+    return len(wanted) == _scope_wards(db.session.query(Ward.id)).filter(Ward.id.in_(wanted)).count()
+
 def superadmin_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
+        user = current_user()
         if not user or user.role != 'superadmin':
             flash(t('only_superadmin'), 'danger')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return wrapper
 
+def _add_missing_columns():
+    """create_all() never alters existing tables; add columns introduced since the DB was created."""
+    insp = sa_inspect(db.engine)
+    existing = set(insp.get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            have = {c['name'] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(db.engine.dialect)}"
+                if col.server_default is not None:
+                    ddl += f" DEFAULT '{col.server_default.arg}'"
+                conn.exec_driver_sql(ddl)
+
+def _rebuild_with_autoincrement(model, floor_columns=()):
+    """Recreate a table created without AUTOINCREMENT (SQLite cannot ALTER it in place) and start
+    its id sequence above every value of `floor_columns` ((table, column) pairs), so ids kept
+    elsewhere are not handed out again."""
+    table = model.__table__
+    with db.engine.begin() as conn:
+        sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                   (table.name,)).scalar()
+        if sql is None or 'AUTOINCREMENT' in sql.upper():
+            return
+        tmp = f'{table.name}__rebuild'
+        ddl = str(CreateTable(table).compile(db.engine)).strip()
+        conn.exec_driver_sql(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {tmp} ', 1))
+        cols = ', '.join(c.name for c in table.columns)
+        conn.exec_driver_sql(f'INSERT INTO {tmp} ({cols}) SELECT {cols} FROM {table.name}')
+        conn.exec_driver_sql(f'DROP TABLE {table.name}')   # its indexes go too; init_db() recreates them
+        conn.exec_driver_sql(f'ALTER TABLE {tmp} RENAME TO {table.name}')
+        floor = max(conn.exec_driver_sql(f'SELECT COALESCE(MAX({column}), 0) FROM {name}').scalar()
+                    for name, column in ((table.name, 'id'),) + tuple(floor_columns))
+        conn.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (table.name,))
+        conn.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table.name, floor))
+
 def init_db():
     db.create_all()
+    _add_missing_columns()
+    _rebuild_with_autoincrement(Patient, floor_columns=(('patient_archive', 'id'), ('audit_log', 'patient_id')))
+    _rebuild_with_autoincrement(Person, floor_columns=(('patient', 'person_id'), ('patient_archive', 'person_id')))
+    # create_all() only adds indexes together with new tables; add new ones to existing tables too
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
     # Seed users if not exist
     if User.query.count() == 0:
         users = [
@@ -370,13 +506,37 @@ def init_db():
         for i in range(1, 6):
             db.session.add(Doctor(full_name=f"Dr. Example {i}", sort_order=i))
         db.session.commit()
+    if db.session.get(AppState, 'data_version') is None:
+        db.session.add(AppState(key='data_version', value=0))
+        db.session.commit()
+    while True:
+        people = Person.query.filter(Person.phonetic_key.is_(None)).limit(1000).all()
+        if not people:
+            break
+        for person in people:
+            person.phonetic_key = person_phonetic_key(person.last_name, person.first_name, person.birth_date)
+        db.session.commit()
+    # Derived data (occupancy index, persons, rollups) for a DB created before they existed
+    if Patient.query.filter(Patient.person_id.is_(None)).first() is not None or \
+            (Stay.query.first() is None and Patient.query.first() is not None) or \
+            Stay.query.filter(Stay.doctor_id.is_(None)).first() is not None:
+        _patients_changed()
+        db.session.commit()
+    elif DailyStat.query.first() is None and PatientArchive.query.first() is not None:
+        rebuild_daily_stats()
+        db.session.commit()
+
+_db_ready = False
 
 @app.before_request
 def ensure_init():
-    # Create DB on first run
-    if not os.path.exists(os.path.join(os.path.dirname(__file__), 'database.db')):
-        with app.app_context():
-            init_db()
+    # Create / upgrade the DB once per process
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
+        _start_autocomplete_build()
+        _start_backup_scheduler()
 
 # -------- Snapshot helpers (for historical occupancy on /inpatient) --------
 
@@ -387,54 +547,708 @@ def _parse_ddmmyyyy(s):
     except Exception:
         return None
 
-def _parse_hhmm(s):
+# -------------------- Occupancy index (Stay) --------------------
+
+STAY_SOURCE_COLUMNS = (
+    Patient.id, Patient.ward_id, Patient.doctor_id, Patient.arrival_date, Patient.arrival_time, Patient.discharge_datetime,
+    Patient.caregiver_exists, Patient.caregiver_ward_id,
+    Patient.caregiver_arrival_date, Patient.caregiver_departure_date,
+)
+STAY_CHUNK = 500
+STAY_STAT_COLUMNS = (Stay.patient_id, Stay.ward_id, Stay.doctor_id, Stay.kind, Stay.start_at, Stay.end_at)
+
+def _stays_for(rows):
+    """Stay dicts for STAY_SOURCE_COLUMNS rows, with the same rules as the inpatient board."""
+    for r in rows:
+        arrive = _parse_dt(r.arrival_date, r.arrival_time)
+        if not arrive:
+            continue
+        yield dict(patient_id=r.id, ward_id=r.ward_id, doctor_id=r.doctor_id, kind='P',
+                   start_at=arrive, end_at=_parse_discharge_dt(r.discharge_datetime))
+        if r.caregiver_exists:
+            cg_arrive = _parse_dt(r.caregiver_arrival_date)
+            yield dict(patient_id=r.id, ward_id=r.caregiver_ward_id or r.ward_id, doctor_id=r.doctor_id, kind='C',
+                       start_at=max(arrive, cg_arrive) if cg_arrive else arrive,
+                       end_at=_parse_dt(r.caregiver_departure_date))
+
+def _norm_name(s):
+    return ' '.join((s or '').lower().replace('ʻ', "'").replace('‘', "'").replace('’', "'").split())
+
+def person_match_key(last_name, first_name, patronymic, birth_date):
+    """Identity of a person across admissions: normalized full name + birth date."""
+    return '|'.join([_norm_name(last_name), _norm_name(first_name), _norm_name(patronymic),
+                     (birth_date or '').strip()])
+
+# Uzbek/Russian Cyrillic -> Uzbek Latin
+_CYR_TO_LAT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+}
+# Spelling variants that differ between Cyrillic and Latin writing of the same name, applied in order
+_PHONETIC_RULES = (('dzh', 'j'), ('dj', 'j'), ('zh', 'j'), ('kh', 'h'), ('x', 'h'), ('q', 'k'), ('ts', 's'),
+                   ('c', 's'), ('w', 'v'), ('ye', 'e'), ('yo', 'o'), ('yu', 'u'), ('ya', 'a'), ('iy', 'i'), ('y', 'i'))
+_VOWELS = set('aeiou')
+
+def _phonetic(s):
+    """Rough sound skeleton of a name, equal for its Cyrillic and Latin spellings."""
+    s = ''.join(_CYR_TO_LAT.get(ch, ch) for ch in _norm_name(s))
+    s = ''.join(ch for ch in s if 'a' <= ch <= 'z')
+    for src, dst in _PHONETIC_RULES:
+        s = s.replace(src, dst)
+    out = []
+    for i, ch in enumerate(s):
+        if i and ch in _VOWELS:
+            continue  # keep consonants only after the first letter
+        if out and out[-1] == ch:
+            continue
+        out.append(ch)
+    return ''.join(out)
+
+def person_phonetic_key(last_name, first_name, birth_date):
+    """Looser identity for spotting likely duplicates across Cyrillic/Latin spellings.
+    The patronymic is left out: its ending varies too much (-ovich / o'g'li / -evna / qizi)."""
+    return '|'.join([_phonetic(last_name), _phonetic(first_name), (birth_date or '').strip()])
+
+def find_duplicate_candidates(last_name, first_name, patronymic, birth_date):
+    """Persons a new admission probably duplicates: the same person while still admitted, or a
+    differently spelled person with the same phonetic key, among the persons the user may see.
+    Two indexed lookups."""
+    key = person_match_key(last_name, first_name, patronymic, birth_date)
+    pkey = person_phonetic_key(last_name, first_name, birth_date)
+    still_admitted = exists().where(Patient.person_id == Person.id,
+                                    or_(Patient.discharge_datetime.is_(None), Patient.discharge_datetime == ''))
+    q = _scope_persons(Person.query).filter(or_(Person.match_key == key, Person.phonetic_key == pkey)) \
+                    .add_columns(still_admitted.label('admitted'))
+    out = []
+    for person, admitted in q.limit(20):
+        if person.match_key != key:
+            out.append({'person': person, 'reason': 'similar'})
+        elif admitted:
+            out.append({'person': person, 'reason': 'admitted'})
+    return out
+
+def count_duplicate_candidates(people):
+    """How many of the (last, first, patronymic, birth_date) tuples find_duplicate_candidates()
+    would flag, using chunked IN lookups instead of one query per row."""
+    keys = [(person_match_key(*p), person_phonetic_key(p[0], p[1], p[3])) for p in people]
+    by_match, by_phonetic = {}, {}
+    for i in range(0, len(keys), STAY_CHUNK):
+        chunk = keys[i:i + STAY_CHUNK]
+        admitted = exists().where(Patient.person_id == Person.id,
+                                  or_(Patient.discharge_datetime.is_(None), Patient.discharge_datetime == ''))
+        for mk, pk, adm in db.session.query(Person.match_key, Person.phonetic_key, admitted) \
+                .filter(or_(Person.match_key.in_({k for k, _ in chunk}),
+                            Person.phonetic_key.in_({p for _, p in chunk}))):
+            by_match[mk] = adm
+            by_phonetic.setdefault(pk, set()).add(mk)
+    return sum(1 for mk, pk in keys if by_match.get(mk) or (by_phonetic.get(pk, set()) - {mk}))
+
+PERSON_SOURCE_COLUMNS = (
+    Patient.id, Patient.person_id, Patient.last_name, Patient.first_name, Patient.patronymic,
+    Patient.birth_date, Patient.phone, Patient.address, Patient.occupation,
+)
+
+def _drop_orphan_persons(person_ids):
+    """Delete the given persons that no longer have an admission, current or archived."""
+    person_ids = set(person_ids) - {None}
+    if person_ids:
+        Person.query.filter(Person.id.in_(person_ids),
+                            ~exists().where(Patient.person_id == Person.id),
+                            ~exists().where(PatientArchive.person_id == Person.id)) \
+                    .delete(synchronize_session=False)
+
+def _refresh_person_contacts(person_ids):
+    """Copy phone, address and occupation from each person's newest admission (by arrival)."""
+    newest = {}
+    for r in db.session.query(Patient.id, Patient.person_id, Patient.arrival_date, Patient.arrival_time,
+                              Patient.phone, Patient.address, Patient.occupation) \
+                       .filter(Patient.person_id.in_(person_ids)):
+        key = (_parse_dt(r.arrival_date, r.arrival_time) or datetime.min, r.id)
+        if r.person_id not in newest or key > newest[r.person_id][0]:
+            newest[r.person_id] = (key, r)
+    refresh = [dict(id=pid, phone=r.phone, address=r.address, occupation=r.occupation)
+               for pid, (_, r) in newest.items()]
+    if refresh:
+        db.session.execute(update(Person), refresh)
+
+def _link_persons(ids):
+    """Point each given patient (admission) at its Person, creating persons as needed, and drop
+    persons left without admissions (e.g. after a name correction)."""
+    rows = db.session.query(*PERSON_SOURCE_COLUMNS).filter(Patient.id.in_(ids)).order_by(Patient.id).all()
+    if not rows:
+        return
+    keys = {r.id: person_match_key(r.last_name, r.first_name, r.patronymic, r.birth_date) for r in rows}
+    person_by_key = dict(db.session.query(Person.match_key, Person.id)
+                         .filter(Person.match_key.in_(set(keys.values()))))
+    latest = {}  # match_key -> newest row, details of a new person
+    for r in rows:
+        latest[keys[r.id]] = r
+    new = [dict(match_key=k, phonetic_key=person_phonetic_key(r.last_name, r.first_name, r.birth_date),
+                last_name=r.last_name, first_name=r.first_name, patronymic=r.patronymic,
+                birth_date=r.birth_date, phone=r.phone, address=r.address, occupation=r.occupation)
+           for k, r in latest.items() if k not in person_by_key]
+    if new:
+        db.session.execute(insert(Person), new)
+        person_by_key.update(db.session.query(Person.match_key, Person.id)
+                             .filter(Person.match_key.in_([n['match_key'] for n in new])))
+    relink = [dict(id=r.id, person_id=person_by_key[keys[r.id]]) for r in rows
+              if r.person_id != person_by_key[keys[r.id]]]
+    if relink:
+        db.session.execute(update(Patient), relink)
+    # an edit of an older admission must not overwrite the contact details of the newest one
+    _refresh_person_contacts({person_by_key[k] for k in latest})
+    _drop_orphan_persons(r.person_id for r in rows if r.person_id != person_by_key[keys[r.id]])
+
+def _patients_changed(ids=None, archived=False):
+    """Keep data derived from patient rows in step with a write to them:
+    the person each admission belongs to, the occupancy index and the daily rollups.
+
+    ids: patient ids that were inserted, updated or deleted (None = all patients).
+    archived: the ids were moved to patient_archive, so their rollup counts stay.
+    Call inside the writing transaction, after flush and before commit.
+    """
+    bump_data_version()
+    if ids is None:
+        Stay.query.delete(synchronize_session=False)
+        ids = [pid for (pid,) in db.session.query(Patient.id).order_by(Patient.id)]
+        full = True
+    else:
+        ids = list(ids)
+        full = False
+
+    for i in range(0, len(ids), STAY_CHUNK):
+        chunk = ids[i:i + STAY_CHUNK]
+        _link_persons(chunk)
+        old = []
+        if not full:
+            if not archived:
+                old = [r._asdict() for r in db.session.query(*STAY_STAT_COLUMNS).filter(Stay.patient_id.in_(chunk))]
+            Stay.query.filter(Stay.patient_id.in_(chunk)).delete(synchronize_session=False)
+        stays = list(_stays_for(db.session.query(*STAY_SOURCE_COLUMNS).filter(Patient.id.in_(chunk))))
+        if stays:
+            db.session.execute(insert(Stay), stays)
+        if not full and not archived:
+            _apply_daily_stats(_daily_contributions(stays), _daily_contributions(old))
+        if not full:
+            _autocomplete_pending(db.session.query(*AUTOCOMPLETE_SOURCE_COLUMNS).filter(Patient.id.in_(chunk)))
+
+    if full:
+        Person.query.filter(~exists().where(Patient.person_id == Person.id),
+                            ~exists().where(PatientArchive.person_id == Person.id)) \
+                    .delete(synchronize_session=False)
+        rebuild_daily_stats()
+        db.session.info['autocomplete_rebuild'] = True
+
+# -------------------- Daily rollups --------------------
+
+DAILY_STAT_FIELDS = ('admissions', 'caregivers', 'discharges', 'stay_minutes')
+
+def _daily_contributions(stays):
+    """{(day, ward_id, doctor_id): [admissions, caregivers, discharges, stay_minutes]} for Stay dicts."""
+    with_caregiver = {s['patient_id'] for s in stays if s['kind'] == 'C'}
+    out = defaultdict(lambda: [0, 0, 0, 0])
+    for s in stays:
+        if s['kind'] != 'P':
+            continue
+        row = out[(s['start_at'].date(), s['ward_id'], s['doctor_id'] or 0)]
+        row[0] += 1
+        row[1] += s['patient_id'] in with_caregiver
+        if s['end_at']:
+            row = out[(s['end_at'].date(), s['ward_id'], s['doctor_id'] or 0)]
+            row[2] += 1
+            row[3] += int((s['end_at'] - s['start_at']).total_seconds() // 60)
+    return out
+
+def _apply_daily_stats(added, removed=None):
+    """Add `added` minus `removed` contributions to daily_stat with one upsert per key."""
+    delta = defaultdict(lambda: [0, 0, 0, 0])
+    for sign, contrib in ((1, added), (-1, removed or {})):
+        for key, vals in contrib.items():
+            row = delta[key]
+            for j, v in enumerate(vals):
+                row[j] += sign * v
+    rows = [dict(day=k[0], ward_id=k[1], doctor_id=k[2], **dict(zip(DAILY_STAT_FIELDS, v)))
+            for k, v in delta.items() if any(v)]
+    if not rows:
+        return
+    stmt = sqlite_insert(DailyStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'ward_id', 'doctor_id'],
+        set_={f: getattr(DailyStat, f) + getattr(stmt.excluded, f) for f in DAILY_STAT_FIELDS})
+    db.session.execute(stmt, rows)
+
+def rebuild_daily_stats():
+    """Recompute daily_stat from the occupancy index and the archive (inside the caller's transaction)."""
+    DailyStat.query.delete(synchronize_session=False)
+    last_id = 0
+    while True:
+        pids = [pid for (pid,) in db.session.query(Stay.patient_id).filter(Stay.patient_id > last_id)
+                                             .distinct().order_by(Stay.patient_id).limit(STAY_CHUNK)]
+        if not pids:
+            break
+        last_id = pids[-1]
+        stays = [r._asdict() for r in db.session.query(*STAY_STAT_COLUMNS).filter(Stay.patient_id.in_(pids))]
+        _apply_daily_stats(_daily_contributions(stays))
+    archive_columns = [getattr(PatientArchive, c.key).label(c.key) for c in STAY_SOURCE_COLUMNS]
+    last_id = 0
+    while True:
+        rows = db.session.query(*archive_columns).filter(PatientArchive.id > last_id) \
+                         .order_by(PatientArchive.id).limit(STAY_CHUNK * 4).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        _apply_daily_stats(_daily_contributions(list(_stays_for(rows))))
+
+# -------------------- Audit log (write-behind) --------------------
+
+AUDIT_FIELDS = (
+    'hist_number', 'last_name', 'first_name', 'patronymic', 'birth_date', 'phone', 'address', 'occupation',
+    'arrival_date', 'arrival_time', 'ward_id', 'doctor_id', 'caregiver_exists', 'caregiver_fullname',
+    'caregiver_ward_id', 'caregiver_arrival_date', 'caregiver_departure_date', 'discharge_datetime',
+)
+AUDIT_BATCH = 500
+AUDIT_FLUSH_SECONDS = 2.0
+
+_audit_queue = queue.Queue()
+_audit_writer = None
+_audit_writer_lock = threading.Lock()
+
+def audit_snapshot(ids):
+    """{patient id: {field: value}} for AUDIT_FIELDS, read in chunks. Take it before and after a write."""
+    ids = list(ids)
+    out = {}
+    columns = [Patient.id] + [getattr(Patient, f) for f in AUDIT_FIELDS]
+    for i in range(0, len(ids), STAY_CHUNK):
+        for row in db.session.query(*columns).filter(Patient.id.in_(ids[i:i + STAY_CHUNK])):
+            out[row[0]] = dict(zip(AUDIT_FIELDS, row[1:]))
+    return out
+
+def audit_patients(action, before, after):
+    """Record field-level diffs between two audit_snapshot()s for the current transaction.
+
+    Entries wait in session.info and reach the writer queue only if the transaction commits;
+    patients whose fields did not change are skipped (except for deletes and archiving).
+    """
+    user = current_user() if has_request_context() else None
+    now = datetime.now()
+    pending = db.session.info.setdefault('audit', [])
+    for pid in sorted(set(before) | set(after)):
+        old, new = before.get(pid, {}), after.get(pid, {})
+        changes = {f: [old.get(f), new.get(f)] for f in AUDIT_FIELDS if old.get(f) != new.get(f)}
+        if not changes and action not in ('delete', 'archive'):
+            continue
+        pending.append(dict(at=now, user_id=user.id if user else None, username=user.username if user else None,
+                            patient_id=pid, action=action,
+                            changes=json.dumps(changes, ensure_ascii=False) if changes else None))
+
+@event.listens_for(db.session, 'after_commit')
+def _audit_after_commit(session):
+    pending = session.info.pop('audit', None)
+    if pending:
+        for entry in pending:
+            _audit_queue.put(entry)
+        _start_audit_writer()
+
+@event.listens_for(db.session, 'after_rollback')
+def _audit_after_rollback(session):
+    session.info.pop('audit', None)
+
+def _write_audit_batch(block=False):
+    """Insert up to AUDIT_BATCH queued entries in one statement; returns how many were written."""
+    batch = []
     try:
-        h, m = s.strip().split(':')
-        return int(h), int(m)
-    except Exception:
-        return 0, 0
+        batch.append(_audit_queue.get(timeout=AUDIT_FLUSH_SECONDS) if block else _audit_queue.get_nowait())
+        while len(batch) < AUDIT_BATCH:
+            batch.append(_audit_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if not batch:
+        return 0
+    with app.app_context():
+        try:
+            db.session.execute(insert(AuditLog), batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('audit log write failed; %d entries requeued', len(batch))
+            for entry in batch:
+                _audit_queue.put(entry)
+            raise
+    return len(batch)
+
+def _audit_writer_loop():
+    while True:
+        try:
+            _write_audit_batch(block=True)
+        except Exception:
+            threading.Event().wait(AUDIT_FLUSH_SECONDS)  # DB busy; retry the requeued batch later
+
+def _start_audit_writer():
+    global _audit_writer
+    if _audit_writer is None:
+        with _audit_writer_lock:
+            if _audit_writer is None:
+                _audit_writer = threading.Thread(target=_audit_writer_loop, name='audit-writer', daemon=True)
+                _audit_writer.start()
+
+@atexit.register
+def flush_audit():
+    """Write everything still queued (history view, CLI commands, shutdown)."""
+    while _write_audit_batch():
+        pass
+
+def purge_audit_log(days=None, batch=AUDIT_BATCH * 10):
+    """Delete audit entries older than `days` (AUDIT_RETENTION_DAYS) in committed batches. Returns the count."""
+    days = app.config['AUDIT_RETENTION_DAYS'] if days is None else days
+    cutoff = datetime.now() - timedelta(days=days)
+    total = 0
+    while True:
+        ids = [aid for (aid,) in db.session.query(AuditLog.id).filter(AuditLog.at < cutoff).limit(batch)]
+        if not ids:
+            return total
+        AuditLog.query.filter(AuditLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(ids)
+
+# -------------------- Autocomplete (in-memory prefix index) --------------------
+
+AUTOCOMPLETE_FIELDS = ('last_name', 'first_name', 'hist_number')
+AUTOCOMPLETE_MAX_KEYS = 100000        # per field; values beyond this are not suggested
+AUTOCOMPLETE_REBUILD_SECONDS = 3600   # rebuilt in the background to drop values no longer in use
+AUTOCOMPLETE_SOURCE_COLUMNS = (Patient.ward_id, Patient.last_name, Patient.first_name, Patient.hist_number)
+
+
+class PrefixIndex:
+    """Sorted normalized values of one field, each with its display form and a bitmask of the wards
+    it occurs in (for ward scoping). Values are added on writes and only dropped by a rebuild."""
+
+    def __init__(self, max_keys=AUTOCOMPLETE_MAX_KEYS):
+        self.max_keys = max_keys
+        self.keys = []      # sorted normalized values
+        self.entries = {}   # normalized value -> [display value, ward bitmask]
+
+    def add(self, value, ward_id):
+        key = _norm_name(value)
+        if not key:
+            return
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.keys) >= self.max_keys:
+                return
+            entry = self.entries[key] = [value.strip(), 0]
+            bisect.insort(self.keys, key)
+        entry[1] |= 1 << (ward_id or 0)
+
+    def search(self, prefix, ward_mask=None, limit=10):
+        prefix = _norm_name(prefix)
+        out = []
+        if not prefix:
+            return out
+        i = bisect.bisect_left(self.keys, prefix)
+        scanned = 0
+        while i < len(self.keys) and len(out) < limit and scanned < limit * 50:
+            key = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            display, wards = self.entries[key]
+            if ward_mask is None or wards & ward_mask:
+                out.append(display)
+            i += 1
+            scanned += 1
+        return out
+
+
+_autocomplete = None               # {field: PrefixIndex}, None until built
+_autocomplete_built_at = 0.0
+_autocomplete_lock = threading.Lock()
+_autocomplete_building = threading.Event()
+_autocomplete_backlog = []         # rows committed while a build runs, replayed into the new index
+
+def _autocomplete_add(index, rows):
+    for ward_id, *values in rows:
+        for field, value in zip(AUTOCOMPLETE_FIELDS, values):
+            if value:
+                index[field].add(value, ward_id)
+
+def build_autocomplete():
+    """Read every patient and archived patient into a fresh index (background thread)."""
+    global _autocomplete, _autocomplete_built_at
+    started = datetime.now().timestamp()
+    index = {f: PrefixIndex() for f in AUTOCOMPLETE_FIELDS}
+    try:
+        with app.app_context():
+            archive_columns = [getattr(PatientArchive, c.key) for c in AUTOCOMPLETE_SOURCE_COLUMNS]
+            for columns in (AUTOCOMPLETE_SOURCE_COLUMNS, archive_columns):
+                _autocomplete_add(index, db.session.query(*columns).yield_per(STAY_CHUNK * 4))
+        with _autocomplete_lock:
+            _autocomplete_add(index, _autocomplete_backlog)
+            _autocomplete = index
+            _autocomplete_built_at = started
+    finally:
+        with _autocomplete_lock:
+            _autocomplete_backlog.clear()
+            _autocomplete_building.clear()
+
+def _start_autocomplete_build():
+    with _autocomplete_lock:
+        if _autocomplete_building.is_set():
+            return
+        _autocomplete_building.set()
+        _autocomplete_backlog.clear()
+    threading.Thread(target=build_autocomplete, name='autocomplete-build', daemon=True).start()
+
+def _autocomplete_pending(rows):
+    """Queue written (ward_id, last, first, hist) rows; they enter the index if the transaction commits."""
+    db.session.info.setdefault('autocomplete', []).extend(tuple(r) for r in rows)
+
+@event.listens_for(db.session, 'after_commit')
+def _autocomplete_after_commit(session):
+    rows = session.info.pop('autocomplete', None)
+    if session.info.pop('autocomplete_rebuild', False):
+        _start_autocomplete_build()
+    elif rows:
+        with _autocomplete_lock:
+            if _autocomplete is not None:
+                _autocomplete_add(_autocomplete, rows)
+            if _autocomplete_building.is_set():
+                _autocomplete_backlog.extend(rows)
+
+@event.listens_for(db.session, 'after_rollback')
+def _autocomplete_after_rollback(session):
+    session.info.pop('autocomplete', None)
+    session.info.pop('autocomplete_rebuild', None)
+
+def autocomplete(field, prefix, limit=10):
+    """Up to `limit` known values of `field` starting with `prefix`, limited to the user's wards."""
+    if _autocomplete is None or datetime.now().timestamp() - _autocomplete_built_at > AUTOCOMPLETE_REBUILD_SECONDS:
+        _start_autocomplete_build()
+    if _autocomplete is None:
+        return []
+    ids = scope_ward_ids()
+    mask = None if ids is None else sum(1 << wid for wid in ids)
+    with _autocomplete_lock:
+        return _autocomplete[field].search(prefix, mask, limit)
+
+ARCHIVE_BATCH = 500
+
+def archive_discharged(days=None, batch=ARCHIVE_BATCH):
+    """Move patients discharged more than `days` ago into patient_archive, one committed batch
+    at a time. Candidates come from the occupancy index (ix_stay_end_start). Returns the count."""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    cutoff = datetime.now() - timedelta(days=days)
+    columns = [c.name for c in PatientArchive.__table__.columns if c.name in Patient.__table__.c]
+    total = 0
+    while True:
+        ids = [pid for (pid,) in db.session.query(Stay.patient_id)
+                                 .filter(Stay.kind == 'P', Stay.end_at < cutoff)
+                                 .order_by(Stay.patient_id).limit(batch)]
+        if not ids:
+            return total
+        src = db.select(*[Patient.__table__.c[n] for n in columns], db.literal(datetime.now())) \
+                .where(Patient.id.in_(ids))
+        db.session.execute(insert(PatientArchive).from_select(columns + ['archived_at'], src))
+        audit_patients('archive', {pid: {} for pid in ids}, {})
+        Patient.query.filter(Patient.id.in_(ids)).delete(synchronize_session=False)
+        _patients_changed(ids, archived=True)
+        db.session.commit()
+        total += len(ids)
+
+def _free_beds(start_dt, end_dt=None):
+    """Wards with capacity left over [start_dt, end_dt], by block, from the occupancy index.
+
+    Any stay overlapping the window counts against the ward (conservative), and
+    only stays still open at start_dt are read, via ix_stay_end_start.
+    """
+    end_dt = end_dt or start_dt
+    used = dict(db.session.query(Stay.ward_id, func.count(Stay.id))
+                .filter(or_(Stay.end_at.is_(None), Stay.end_at >= start_dt), Stay.start_at <= end_dt)
+                .group_by(Stay.ward_id).all())
+    blocks = {b: [] for b in BLOCKS_ORDER}
+    for w in _scope_wards(Ward.query).filter(Ward.capacity > 0).order_by(Ward.block, Ward.sort_order):
+        occupied = used.get(w.id, 0)
+        if occupied < w.capacity and w.block in blocks:
+            blocks[w.block].append({'id': w.id, 'name': w.name, 'capacity': w.capacity,
+                                    'occupied': occupied, 'free': w.capacity - occupied})
+    return blocks
+
+# -------------------- Backups (SQLite online backup) --------------------
+
+BACKUP_PAGES = 256            # pages copied per backup step; a writer waits for at most one step
+BACKUP_STEP_SLEEP = 0.01      # pause between steps, leaving the database to other connections
+BACKUP_PREFIX, BACKUP_SUFFIX = 'database-', '.db.gz'
+BACKUP_SCHEDULER_POLL = 300   # seconds between checks whether a scheduled backup is due
+
+_backup_lock = threading.Lock()
+_backup_scheduler = None
+
+def _database_path():
+    return db.engine.url.database  # Flask-SQLAlchemy resolves the relative path into the instance folder
+
+def _backup_path(name):
+    name = os.path.basename(name)
+    if not (name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)):
+        raise FileNotFoundError(name)
+    return os.path.join(app.config['BACKUP_FOLDER'], name)
+
+def _remove_quietly(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-def _to_dt(date_str, time_str=None):
-    """date_str = 'dd.mm.yyyy', time_str = 'HH:MM' or None"""
-    if not date_str:
-        return None
-    ymd = _parse_ddmmyyyy(date_str)
-    if not ymd:
-        return None
-    Y, M, D = ymd
-    H, Mi = _parse_hhmm(time_str or '00:00')
+def list_backups():
+    """Snapshots, newest first: name, path, size and the timings recorded when they were taken."""
     try:
-        return datetime(Y, M, D, H, Mi)
-    except Exception:
-        return None
+        names = os.listdir(app.config['BACKUP_FOLDER'])
+    except FileNotFoundError:
+        return []
+    backups = []
+    for name in sorted((n for n in names if n.startswith(BACKUP_PREFIX) and n.endswith(BACKUP_SUFFIX)), reverse=True):
+        path = _backup_path(name)
+        try:
+            with open(path + '.json') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            info = {}
+        info.update(name=name, path=path, size=os.path.getsize(path))
+        backups.append(info)
+    return backups
+
+def rotate_backups(keep=None):
+    """Delete all but the newest `keep` (BACKUP_KEEP) snapshots. Returns how many were removed."""
+    keep = app.config['BACKUP_KEEP'] if keep is None else keep
+    old = list_backups()[max(keep, 1):]
+    for info in old:
+        _remove_quietly(info['path'], info['path'] + '.json')
+    return len(old)
+
+def create_backup(progress=None):
+    """Snapshot the live database through the online backup API, gzip it and rotate old snapshots.
+
+    The copy runs BACKUP_PAGES pages at a time, so writers are never held up for longer than one
+    step; progress(copied_pages, total_pages) is called after each step. Returns the snapshot info.
+    """
+    folder = app.config['BACKUP_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    started = datetime.now()
+    name = f"{BACKUP_PREFIX}{started:%Y%m%d-%H%M%S-%f}{BACKUP_SUFFIX}"
+    path = os.path.join(folder, name)
+    tmp = path[:-len('.gz')] + '.tmp'
+    steps, written = 0, None
+
+    def on_step(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if progress:
+            progress(total - remaining, total)
+        if remaining:
+            sleep(BACKUP_STEP_SLEEP)  # backup() itself only sleeps when the database is busy
+
+    with _backup_lock:
+        t0 = perf_counter()
+        try:
+            src, dst = sqlite3.connect(_database_path()), sqlite3.connect(tmp)
+            try:
+                src.backup(dst, pages=BACKUP_PAGES, progress=on_step)
+                pages = dst.execute('PRAGMA page_count').fetchone()[0]
+            finally:
+                dst.close()
+                src.close()
+            copied = perf_counter()
+            with open(tmp, 'rb') as f_in, open(path, 'xb') as raw:
+                written = path
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f_out:
+                    shutil.copyfileobj(f_in, f_out, 1 << 20)
+            info = {'created': started.isoformat(timespec='seconds'), 'pages': pages, 'steps': steps,
+                    'raw_size': os.path.getsize(tmp), 'copy_seconds': round(copied - t0, 3),
+                    'compress_seconds': round(perf_counter() - copied, 3)}
+            with open(path + '.json', 'w') as f:
+                json.dump(info, f)
+        except BaseException:
+            if written:
+                _remove_quietly(written, written + '.json')
+            raise
+        finally:
+            _remove_quietly(tmp)
+    app.logger.info('backup %s: %d pages in %d steps, copy %.3fs, compress %.3fs',
+                    name, pages, steps, info['copy_seconds'], info['compress_seconds'])
+    rotate_backups()
+    info.update(name=name, path=path, size=os.path.getsize(path))
+    return info
+
+def restore_backup(name):
+    """Replace the live database contents with a snapshot, copied in through the backup API.
+
+    The copy runs as a single step so other connections see either the old or the restored data,
+    never a mix. Cached fragments are invalidated; schema upgrades are re-applied by init_db().
+    """
+    path = _backup_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    tmp = path[:-len('.gz')] + '.restore'
+    live_version = db.session.query(AppState.value).filter(AppState.key == 'data_version').scalar() or 0
+    db.session.remove()
+    with _backup_lock:
+        try:
+            with gzip.open(path, 'rb') as f_in, open(tmp, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            src, dst = sqlite3.connect(tmp), sqlite3.connect(_database_path())
+            try:
+                if src.execute('PRAGMA integrity_check').fetchone()[0] != 'ok':
+                    raise ValueError(f'{name} failed the integrity check')
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+        finally:
+            _remove_quietly(tmp)
+    db.engine.dispose()  # pooled connections still hold the old schema
+    init_db()
+    # Restored counters may repeat a version another process has already cached fragments for
+    restored_version = db.session.query(AppState.value).filter(AppState.key == 'data_version').scalar() or 0
+    db.session.execute(update(AppState).where(AppState.key == 'data_version')
+                       .values(value=max(live_version, restored_version) + 1))
+    db.session.commit()
 
-def _parse_discharge(discharge_str):
-    """Accepts 'dd.mm.yyyy HH:MM' OR 'dd.mm.yyyy'."""
-    if not discharge_str:
-        return None
-    parts = discharge_str.strip().split()
-    if len(parts) == 1:
-        return _to_dt(parts[0], '00:00')
-    if len(parts) >= 2:
-        return _to_dt(parts[0], parts[1])
-    return None
+def _claim_scheduled_backup(interval):
+    """True for the one process (of several workers) that takes a due backup: a conditional UPDATE."""
+    now = int(datetime.now().timestamp())
+    db.session.execute(sqlite_insert(AppState).values(key='backup_claimed_at', value=0)
+                       .on_conflict_do_nothing())
+    claimed = db.session.execute(update(AppState)
+                                 .where(AppState.key == 'backup_claimed_at', AppState.value <= now - interval)
+                                 .values(value=now)).rowcount
+    db.session.commit()
+    return bool(claimed)
 
-def _is_active_at(patient, ref_dt):
-    """True if patient was in ward at ref_dt (arrival <= ref_dt < discharge OR no discharge)."""
-    arr = _to_dt(patient.arrival_date, patient.arrival_time)
-    if not arr or arr > ref_dt:
-        return False
-    dis = _parse_discharge(patient.discharge_datetime)
-    if dis and dis <= ref_dt:
-        return False
-    return True
+def _backup_scheduler_loop(interval):
+    while True:
+        try:
+            with app.app_context():
+                if _claim_scheduled_backup(interval):
+                    create_backup()
+        except Exception:
+            app.logger.exception('scheduled backup failed')
+        threading.Event().wait(min(interval, BACKUP_SCHEDULER_POLL))
+
+def _start_backup_scheduler():
+    global _backup_scheduler
+    interval = int(app.config['BACKUP_INTERVAL_HOURS'] * 3600)
+    if interval > 0 and _backup_scheduler is None:
+        _backup_scheduler = threading.Thread(target=_backup_scheduler_loop, args=(interval,),
+                                             name='backup-scheduler', daemon=True)
+        _backup_scheduler.start()
 
 # -------------------- Routes --------------------
 
 @app.route('/set_lang/<lang>')
 def set_lang(lang):
-    if lang in I18N:
+    if lang in CATALOGS:
         session['lang'] = lang
+        g.pop('translator', None)
     next_url = request.args.get('next')  # stay on the same page & keep query (?at=...)
     return redirect(next_url or request.referrer or url_for('index'))
 
@@ -453,136 +1267,226 @@ def login():
             session['user_id'] = user.id
             return redirect(url_for('index'))
         flash('Invalid credentials', 'danger')
-    return render_template('login.html', t=t)
+    return render_template('login.html')
 
 @app.route('/logout')
 def logout():
     session.clear()
     return redirect(url_for('login'))
 
-def _invalid_required_conditions():
-    """SQLAlchemy conditions to find patients missing any required field."""
+def _missing_field_checks():
+    """(i18n key, SQL condition) per required field; the list index is the bit in the missing-field mask."""
     def is_blank(col):
         return or_(col.is_(None), func.length(func.trim(col)) == 0)
 
     return [
-        is_blank(Patient.hist_number),
-        is_blank(Patient.last_name),
-        is_blank(Patient.first_name),
-        is_blank(Patient.patronymic),
-        is_blank(Patient.birth_date),
-        is_blank(Patient.phone),
-        is_blank(Patient.address),
-        is_blank(Patient.occupation),
-        is_blank(Patient.arrival_date),
-        is_blank(Patient.arrival_time),
-        Patient.ward_id.is_(None),
-        Patient.doctor_id.is_(None),
+        ('hist_number', is_blank(Patient.hist_number)),
+        ('last_name', is_blank(Patient.last_name)),
+        ('first_name', is_blank(Patient.first_name)),
+        ('patronymic', is_blank(Patient.patronymic)),
+        ('birth_date', is_blank(Patient.birth_date)),
+        ('phone', is_blank(Patient.phone)),
+        ('address', is_blank(Patient.address)),
+        ('occupation', is_blank(Patient.occupation)),
+        ('arrival_date', is_blank(Patient.arrival_date)),
+        ('arrival_time', is_blank(Patient.arrival_time)),
+        ('ward', Patient.ward_id.is_(None)),
+        ('doctor', Patient.doctor_id.is_(None)),
     ]
 
 # -------------------- Registration --------------------
 
+PATIENT_REQUIRED_FIELDS = [
+    'hist_number', 'last_name', 'first_name', 'patronymic', 'birth_date',
+    'phone', 'address', 'occupation', 'arrival_date', 'arrival_time', 'ward_id', 'doctor_id'
+]
+
+def _patient_fields(data):
+    """Patient column values from a form/JSON mapping. Assumes required fields are present."""
+    def s(key):
+        val = data.get(key)
+        return '' if val is None else str(val).strip()
+
+    caregiver_exists = data.get('caregiver_exists') in ('yes', True)
+    return dict(
+        hist_number=s('hist_number'),
+        last_name=s('last_name'),
+        first_name=s('first_name'),
+        patronymic=s('patronymic'),
+        birth_date=s('birth_date'),
+        phone=s('phone'),
+        address=s('address'),
+        occupation=s('occupation'),
+        arrival_date=s('arrival_date'),
+        arrival_time=s('arrival_time'),
+        ward_id=int(data.get('ward_id')),
+        doctor_id=int(data.get('doctor_id')),
+        caregiver_exists=caregiver_exists,
+        caregiver_fullname=s('caregiver_fullname') if caregiver_exists else None,
+        caregiver_ward_id=int(data.get('caregiver_ward_id')) if caregiver_exists and data.get('caregiver_ward_id') else None,
+        caregiver_arrival_date=s('caregiver_arrival_date') if caregiver_exists else None,
+        caregiver_departure_date=s('caregiver_departure_date') if caregiver_exists else None,
+        discharge_datetime=s('discharge_datetime') or None
+    )
+
+def _patient_from_data(data):
+    """Build a Patient from a form/JSON mapping. Assumes required fields are present."""
+    return Patient(**_patient_fields(data))
+
 @app.route('/register', methods=['GET', 'POST'])
 @login_required
 def register():
-    wards = Ward.query.order_by(Ward.sort_order).all()
+    wards = _scope_wards(Ward.query).order_by(Ward.sort_order).all()
     doctors = Doctor.query.order_by(Doctor.sort_order).all()
     if request.method == 'POST':
         data = request.form
-        required_fields = [
-            'hist_number', 'last_name', 'first_name', 'patronymic', 'birth_date',
-            'phone', 'address', 'occupation', 'arrival_date', 'arrival_time', 'ward_id', 'doctor_id'
-        ]
-        for f in required_fields:
+        for f in PATIENT_REQUIRED_FIELDS:
             if not data.get(f):
                 flash(f"Missing field: {f}", 'danger')
                 return redirect(url_for('register'))
-        caregiver_exists = (data.get('caregiver_exists') == 'yes')
-        p = Patient(
-            hist_number=data.get('hist_number').strip(),
-            last_name=data.get('last_name').strip(),
-            first_name=data.get('first_name').strip(),
-            patronymic=data.get('patronymic').strip(),
-            birth_date=data.get('birth_date').strip(),
-            phone=data.get('phone').strip(),
-            address=data.get('address').strip(),
-            occupation=data.get('occupation').strip(),
-            arrival_date=data.get('arrival_date').strip(),
-            arrival_time=data.get('arrival_time').strip(),
-            ward_id=int(data.get('ward_id')),
-            doctor_id=int(data.get('doctor_id')),
-            caregiver_exists=caregiver_exists,
-            caregiver_fullname=(data.get('caregiver_fullname') or '').strip() if caregiver_exists else None,
-            caregiver_ward_id=int(data.get('caregiver_ward_id')) if caregiver_exists and data.get('caregiver_ward_id') else None,
-            caregiver_arrival_date=(data.get('caregiver_arrival_date') or '').strip() if caregiver_exists else None,
-            caregiver_departure_date=(data.get('caregiver_departure_date') or '').strip() if caregiver_exists else None,
-            discharge_datetime=(data.get('discharge_datetime') or '').strip() or None
-        )
+        try:
+            fields = _patient_fields(data)
+        except (TypeError, ValueError):
+            fields = None
+        if fields is None or not _wards_allowed(fields['ward_id'], fields['caregiver_ward_id']):
+            flash(t('select_ward'), 'danger')
+            return redirect(url_for('register'))
+        if not data.get('confirm_duplicate'):
+            duplicates = find_duplicate_candidates(data.get('last_name'), data.get('first_name'),
+                                                   data.get('patronymic'), data.get('birth_date'))
+            if duplicates:
+                return render_template('register.html', wards=wards, doctors=doctors,
+                                       free_beds=_free_beds(datetime.now()), prefill=data.to_dict(),
+                                       duplicates=duplicates)
+        p = Patient(**fields)
         db.session.add(p)
+        db.session.flush()
+        audit_patients('create', {}, audit_snapshot([p.id]))
+        _patients_changed([p.id])
         db.session.commit()
         flash('Saved', 'success')
         return redirect(url_for('patients'))
-    return render_template('register.html', t=t, wards=wards, doctors=doctors)
+    # Readmission: start from the person's details instead of retyping them
+    prefill = {}
+    person = _scope_persons(Person.query).filter(Person.id == request.args.get('person_id', type=int)).first()
+    if person:
+        prefill = {f: getattr(person, f) or '' for f in
+                   ('last_name', 'first_name', 'patronymic', 'birth_date', 'phone', 'address', 'occupation')}
+    return render_template('register.html', wards=wards, doctors=doctors,
+                           free_beds=_free_beds(datetime.now()), prefill=prefill)
+
+@app.route('/persons/duplicates')
+@login_required
+def person_duplicates():
+    """Likely duplicates for ?last_name&first_name&patronymic&birth_date (used while registering)."""
+    a = request.args
+    found = find_duplicate_candidates(a.get('last_name'), a.get('first_name'), a.get('patronymic'), a.get('birth_date'))
+    return jsonify(items=[{'id': d['person'].id, 'reason': d['reason'],
+                           'name': f"{d['person'].last_name} {d['person'].first_name} {d['person'].patronymic}".strip(),
+                           'birth_date': d['person'].birth_date,
+                           'url': url_for('person_history', person_id=d['person'].id)} for d in found])
+
+@app.route('/persons/<int:person_id>')
+@login_required
+def person_history(person_id):
+    """All admissions of one person, newest first (index lookup on patient.person_id)."""
+    # persons without an admission in the user's wards are not shown (name, birth date, contacts)
+    person = _scope_persons(Person.query).filter(Person.id == person_id).first_or_404()
+    admissions = (_scope_patients(Patient.query).filter(Patient.person_id == person.id)
+                  .outerjoin(Stay, (Stay.patient_id == Patient.id) & (Stay.kind == 'P'))
+                  .order_by(Stay.start_at.desc(), Patient.id.desc()).all())
+    archived = (_scope_patients(PatientArchive.query, PatientArchive)
+                .filter(PatientArchive.person_id == person.id).order_by(PatientArchive.id.desc()).all())
+    wards = {w.id: w for w in Ward.query.all()}
+    doctors = {d.id: d for d in Doctor.query.all()}
+    return render_template('person_history.html', person=person, admissions=admissions,
+                           archived=archived, wards=wards, doctors=doctors)
+
+@app.route('/autocomplete/<field>')
+@login_required
+def autocomplete_suggest(field):
+    """?q=prefix -> known values of last_name / first_name / hist_number (in-memory index, no SQL)."""
+    if field not in AUTOCOMPLETE_FIELDS:
+        abort(404)
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify(items=autocomplete(field, request.args.get('q', ''), limit))
+
+@app.route('/wards/free')
+@login_required
+def wards_free():
+    """Free-bed finder: ?arrival_date=dd.mm.yyyy&arrival_time=HH:MM[&stay_days=N] -> wards by block."""
+    start = _parse_dt(request.args.get('arrival_date'), request.args.get('arrival_time')) or datetime.now()
+    stay_days = request.args.get('stay_days', type=int)
+    end = start + timedelta(days=stay_days) if stay_days and stay_days > 0 else None
+    return jsonify(blocks=_free_beds(start, end))
 
 # -------------------- Patients List --------------------
 
+def _patient_search_args(args):
+    """Read the starts-with search fields (q_hist, q_last, q_first, q_pat) from request args."""
+    return {k: (args.get(k) or '').strip() for k in ('q_hist', 'q_last', 'q_first', 'q_pat')}
+
+def _filter_patients(query, filters, model=Patient):
+    """Apply the /patients starts-with filters to a Patient (or PatientArchive) query."""
+    if filters.get('q_hist'):
+        query = query.filter(model.hist_number.ilike(f"{filters['q_hist']}%"))
+    if filters.get('q_last'):
+        query = query.filter(model.last_name.ilike(f"{filters['q_last']}%"))
+    if filters.get('q_first'):
+        query = query.filter(model.first_name.ilike(f"{filters['q_first']}%"))
+    if filters.get('q_pat'):
+        query = query.filter(model.patronymic.ilike(f"{filters['q_pat']}%"))
+    return query
+
+def _patients_source():
+    """Hot Patient table, or the archive when ?archive=1 (searched on demand only)."""
+    return PatientArchive if request.args.get('archive') == '1' else Patient
+
+PATIENT_ROWS_LIMIT = 200
+PATIENT_ROWS_MAX = 1000
+
 @app.route('/patients')
 @login_required
 def patients():
-    q_hist = request.args.get('q_hist', '').strip()
-    q_last = request.args.get('q_last', '').strip()
-    q_first = request.args.get('q_first', '').strip()
-    q_pat = request.args.get('q_pat', '').strip()
-
-    query = Patient.query
-
-    if q_hist:
-        query = query.filter(Patient.hist_number.ilike(f"{q_hist}%"))
-    if q_last:
-        query = query.filter(Patient.last_name.ilike(f"{q_last}%"))
-    if q_first:
-        query = query.filter(Patient.first_name.ilike(f"{q_first}%"))
-    if q_pat:
-        query = query.filter(Patient.patronymic.ilike(f"{q_pat}%"))
-
-    page = int(request.args.get('page', 1))
-    per_page = 500
-    pagination = query.order_by(Patient.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    rows = pagination.items
-
-    wards = {w.id: w for w in Ward.query.all()}
-    doctors = {d.id: d for d in Doctor.query.all()}
-
-    return render_template('patients.html', t=t, rows=rows, wards=wards, doctors=doctors, pagination=pagination,
-                           q_hist=q_hist, q_last=q_last, q_first=q_first, q_pat=q_pat)
+    """Search form and an empty table; rows are loaded by static/js/app.js from patients_rows()."""
+    filters = _patient_search_args(request.args)
+    wards = {w.id: w for w in _scope_wards(Ward.query)}
+    return render_template('patients.html', wards=wards, archive=_patients_source() is PatientArchive,
+                           limit=PATIENT_ROWS_LIMIT, **filters)
 
-@app.route('/patients/export')
+@app.route('/patients/rows')
 @login_required
-def patients_export():
-    from sqlalchemy import func
-
-    # current filters
-    q_hist = (request.args.get('q_hist') or '').strip()
-    q_last = (request.args.get('q_last') or '').strip()
-    q_first = (request.args.get('q_first') or '').strip()
-    q_pat = (request.args.get('q_pat') or '').strip()
-
-    query = Patient.query
-    if q_hist:
-        query = query.filter(func.lower(Patient.hist_number).like(f"{q_hist.lower()}%"))
-    if q_last:
-        query = query.filter(func.lower(Patient.last_name).like(f"{q_last.lower()}%"))
-    if q_first:
-        query = query.filter(func.lower(Patient.first_name).like(f"{q_first.lower()}%"))
-    if q_pat:
-        query = query.filter(func.lower(Patient.patronymic).like(f"{q_pat.lower()}%"))
+def patients_rows():
+    """Next slice of the patients list as rendered <tbody> items, newest first, same filters as /patients.
+
+    Keyset pagination: pass ?after=<next_after> from the previous slice.
+    """
+    model = _patients_source()
+    query = _filter_patients(_scope_patients(model.query, model), _patient_search_args(request.args), model)
+    after = request.args.get('after', type=int)
+    limit = max(1, min(request.args.get('limit', PATIENT_ROWS_LIMIT, type=int), PATIENT_ROWS_MAX))
+    if after:
+        query = query.filter(model.id < after)
+    rows = query.order_by(model.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     wards = {w.id: w for w in Ward.query.all()}
     doctors = {d.id: d for d in Doctor.query.all()}
+    html = render_template('_patient_rows.html', rows=rows, wards=wards, doctors=doctors,
+                           archive=model is PatientArchive)
+    return jsonify(html=html, count=len(rows), next_after=rows[-1].id if has_more else None)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = t('patients')  # sheet title localized
+EXPORT_BATCH = 1000
+
+def patients_export_workbook(query, model=Patient, progress=None):
+    """Write the rows of a Patient (or PatientArchive) query to a write-only workbook, labels in the
+    current language. progress(n) is called after every EXPORT_BATCH rows."""
+    ward_names = dict(db.session.query(Ward.id, Ward.name))
+    doctor_names = dict(db.session.query(Doctor.id, Doctor.full_name))
+
+    wb = Workbook(write_only=True)  # rows are streamed to disk, not kept as cell objects
+    ws = wb.create_sheet(t('patients'))  # sheet title localized
 
     # Localized headers
     headers = [
@@ -600,26 +1504,38 @@ def patients_export():
     ]
     ws.append(headers)
 
-    # Rows
-    for p in query.all():
-        ward = wards.get(p.ward_id)
-        doc = doctors.get(p.doctor_id)
-        fio = f"{p.last_name} {p.first_name} {p.patronymic}".strip()
-        arrive = f"{(p.arrival_date or '').strip()} {(p.arrival_time or '').strip()}".strip()
-        caregiver_txt = t('yes') if p.caregiver_exists else t('no')
+    # Rows: projected columns in batches, no ORM objects
+    yes, no = t('yes'), t('no')
+    rows = query.with_entities(model.hist_number, model.last_name, model.first_name, model.patronymic,
+                               model.birth_date, model.phone, model.address, model.occupation,
+                               model.arrival_date, model.arrival_time, model.discharge_datetime,
+                               model.ward_id, model.doctor_id, model.caregiver_exists)
+    for n, (hist, last, first, pat, dob, phone, addr, occ, arr_date, arr_time, discharge,
+            ward_id, doctor_id, caregiver) in enumerate(rows.yield_per(EXPORT_BATCH), start=1):
         ws.append([
-            p.hist_number,
-            fio,
-            p.birth_date,
-            p.phone,
-            p.address,
-            p.occupation,
-            arrive,
-            p.discharge_datetime or '',
-            ward.name if ward else '',
-            doc.full_name if doc else '',
-            caregiver_txt
+            hist,
+            f"{last} {first} {pat}".strip(),
+            dob,
+            phone,
+            addr,
+            occ,
+            f"{(arr_date or '').strip()} {(arr_time or '').strip()}".strip(),
+            discharge or '',
+            ward_names.get(ward_id, ''),
+            doctor_names.get(doctor_id, ''),
+            yes if caregiver else no
         ])
+        if progress and n % EXPORT_BATCH == 0:
+            progress(EXPORT_BATCH)
+    return wb
+
+@app.route('/patients/export')
+@login_required
+def patients_export():
+    # current filters
+    model = _patients_source()
+    query = _filter_patients(_scope_patients(model.query, model), _patient_search_args(request.args), model)
+    wb = patients_export_workbook(query, model)
 
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     out_path = os.path.join(
@@ -632,35 +1548,128 @@ def patients_export():
 @app.route('/patients/<int:pid>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_patient(pid):
-    p = Patient.query.get_or_404(pid)
-    wards = Ward.query.order_by(Ward.sort_order).all()
+    p = _scope_patients(Patient.query).filter(Patient.id == pid).first_or_404()
+    wards = _scope_wards(Ward.query).order_by(Ward.sort_order).all()
+    if p.caregiver_ward and p.caregiver_ward not in wards:
+        wards.append(p.caregiver_ward)  # a caregiver placed outside the scope before may stay there
     doctors = Doctor.query.order_by(Doctor.sort_order).all()
 
     if request.method == 'POST':
-        data = request.form
-        p.hist_number = data.get('hist_number').strip()
-        p.last_name = data.get('last_name').strip()
-        p.first_name = data.get('first_name').strip()
-        p.patronymic = data.get('patronymic').strip()
-        p.birth_date = data.get('birth_date').strip()
-        p.phone = data.get('phone').strip()
-        p.address = data.get('address').strip()
-        p.occupation = data.get('occupation').strip()
-        p.arrival_date = data.get('arrival_date').strip()
-        p.arrival_time = data.get('arrival_time').strip()
-        p.ward_id = int(data.get('ward_id'))
-        p.doctor_id = int(data.get('doctor_id'))
-        p.caregiver_exists = (data.get('caregiver_exists') == 'yes')
-        p.caregiver_fullname = (data.get('caregiver_fullname') or '').strip() if p.caregiver_exists else None
-        p.caregiver_ward_id = int(data.get('caregiver_ward_id')) if p.caregiver_exists and data.get('caregiver_ward_id') else None
-        p.caregiver_arrival_date = (data.get('caregiver_arrival_date') or '').strip() if p.caregiver_exists else None
-        p.caregiver_departure_date = (data.get('caregiver_departure_date') or '').strip() if p.caregiver_exists else None
-        p.discharge_datetime = (data.get('discharge_datetime') or '').strip() or None
-
+        version = request.form.get('version', type=int)
+        if version is None:
+            abort(400)  # without the version the form was loaded with, a stale edit cannot be told apart
+        try:
+            fields = _patient_fields(request.form)
+        except (TypeError, ValueError):
+            fields = None
+        if fields is None or not _wards_allowed(
+                fields['ward_id'],
+                None if fields['caregiver_ward_id'] == p.caregiver_ward_id else fields['caregiver_ward_id']):
+            flash(t('select_ward'), 'danger')
+            return redirect(url_for('edit_patient', pid=pid))
+        before = audit_snapshot([p.id])
+        # Only matches if nobody saved the patient since this form was loaded (version from the hidden input)
+        updated = db.session.execute(
+            update(Patient)
+            .where(Patient.id == p.id, Patient.version == version)
+            .values(**fields, version=Patient.version + 1)).rowcount
+        if not updated:
+            db.session.rollback()
+            return _edit_conflict(pid, fields, wards, doctors)
+        audit_patients('update', before, audit_snapshot([p.id]))
+        _patients_changed([p.id])
         db.session.commit()
         flash('Saved', 'success')
         return redirect(url_for('patients'))
-    return render_template('edit_patient.html', t=t, p=p, wards=wards, doctors=doctors)
+    return render_template('edit_patient.html', p=p, wards=wards, doctors=doctors)
+
+def _edit_conflict(pid, fields, wards, doctors):
+    """Conflict page for a stale edit form: the submitted values next to the ones saved meanwhile."""
+    saved = _scope_patients(Patient.query).filter(Patient.id == pid).first()
+    if saved is None:
+        flash(t('patient_gone'), 'warning')
+        return redirect(url_for('patients'))
+    flush_audit()
+    last_change = AuditLog.query.filter(AuditLog.patient_id == pid).order_by(AuditLog.id.desc()).first()
+    rows = [(f, fields[f], getattr(saved, f)) for f in AUDIT_FIELDS]
+    return render_template('patient_conflict.html', p=saved, rows=rows, last_change=last_change,
+                           mine=request.form.to_dict(), wards={w.id: w.name for w in wards},
+                           doctors={d.id: d.full_name for d in doctors}), 409
+
+@app.route('/patients/<int:pid>/history')
+@login_required
+def patient_audit(pid):
+    """Audit trail of one patient (admission), newest first, via ix_audit_patient."""
+    p = _scope_patients(Patient.query).filter(Patient.id == pid).first() or \
+        _scope_patients(PatientArchive.query, PatientArchive).filter(PatientArchive.id == pid).first()
+    user = current_user()
+    if p is None and not (user and user.role == 'superadmin'):
+        abort(404)  # deleted patients' trails are for superadmin only
+    flush_audit()
+    entries = AuditLog.query.filter(AuditLog.patient_id == pid).order_by(AuditLog.id.desc()).limit(500).all()
+    for e in entries:
+        e.diff = json.loads(e.changes) if e.changes else {}
+    wards = {w.id: w.name for w in Ward.query.all()}
+    doctors = {d.id: d.full_name for d in Doctor.query.all()}
+    return render_template('patient_audit.html', pid=pid, p=p, entries=entries, wards=wards, doctors=doctors)
+
+# -------------------- Bulk actions (patients / inpatient) --------------------
+
+def _selected_ids(form, name='sel'):
+    ids = []
+    for s in form.getlist(name):
+        try:
+            ids.append(int(s))
+        except Exception:
+            pass
+    return ids
+
+@app.route('/patients/bulk', methods=['POST'])
+@login_required
+def patients_bulk():
+    """Discharge or transfer many patients with one UPDATE in one transaction."""
+    back = request.form.get('next') or request.referrer or url_for('patients')
+    ids = _selected_ids(request.form)
+    if not ids:
+        flash(t('no_selection'), 'warning')
+        return redirect(back)
+
+    action = request.form.get('action')
+    # Only patients still admitted: an existing discharge time is never overwritten, and a past
+    # stay keeps its ward (and its place in the statistics)
+    selected = _scope_patients(Patient.query).filter(
+        Patient.id.in_(ids), or_(Patient.discharge_datetime.is_(None), Patient.discharge_datetime == ''))
+    before = audit_snapshot(pid for (pid,) in selected.with_entities(Patient.id))
+    if action == 'discharge':
+        when = (request.form.get('discharge_datetime') or '').strip() or datetime.now().strftime("%d.%m.%Y %H:%M")
+        if not _parse_discharge_dt(when):
+            flash(t('invalid_datetime'), 'danger')
+            return redirect(back)
+        count = selected.update({Patient.discharge_datetime: when, Patient.version: Patient.version + 1},
+                                synchronize_session=False)
+    elif action == 'transfer':
+        try:
+            ward_id = int(request.form.get('ward_id'))
+            cg_ward_id = int(request.form['caregiver_ward_id']) if request.form.get('caregiver_ward_id') else None
+        except (TypeError, ValueError):
+            flash(t('select_ward'), 'danger')
+            return redirect(back)
+        if not _wards_allowed(ward_id, cg_ward_id):
+            flash(t('select_ward'), 'danger')
+            return redirect(back)
+        values = {Patient.ward_id: ward_id, Patient.version: Patient.version + 1}
+        if cg_ward_id is not None:
+            values[Patient.caregiver_ward_id] = case((Patient.caregiver_exists, cg_ward_id),
+                                                     else_=Patient.caregiver_ward_id)
+        count = selected.update(values, synchronize_session=False)
+    else:
+        return redirect(back)
+
+    audit_patients(action, before, audit_snapshot(before))
+    _patients_changed(before.keys())
+    db.session.commit()
+    flash(t('updated_n_patients').format(count), 'success')
+    return redirect(back)
 
 # -------------------- Inpatient by Ward (with historical snapshot) --------------------
 
@@ -682,133 +1691,132 @@ def _parse_dt(date_str, time_str=None):
         t = time.min
     return datetime.combine(d.date(), t)
 
-@app.route('/inpatient')
-@login_required
-def inpatient():
-    at_str = (request.args.get('at') or '').strip()  # "dd.mm.yyyy HH:MM"
-    at_dt = None
-    if at_str:
+def _parse_discharge_dt(discharge_str):
+    """'dd.mm.yyyy HH:MM' or 'dd.mm.yyyy' -> datetime, None if empty/unparseable."""
+    if not discharge_str:
+        return None
+    s = discharge_str.strip()
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y"):
         try:
-            at_dt = datetime.strptime(at_str, "%d.%m.%Y %H:%M")
+            return datetime.strptime(s, fmt)
         except Exception:
-            try:
-                at_dt = datetime.strptime(at_str, "%d.%m.%Y")
-            except Exception:
-                at_dt = None
-    if not at_dt:
-        at_dt = datetime.now()
-        at_str = at_dt.strftime("%d.%m.%Y %H:%M")
+            pass
+    return None
+
+def _parse_at(at_str):
+    """Parse the ?at= snapshot moment ('dd.mm.yyyy HH:MM' or 'dd.mm.yyyy'); None if invalid."""
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(at_str, fmt)
+        except Exception:
+            pass
+    return None
 
-    wards = Ward.query.order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
+BLOCKS_ORDER = ['A', 'B', 'C', 'D', 'R']
 
-    # Build ward -> occupants at at_dt
-    ward_patients = {w.id: [] for w in wards}
+def _group_wards_by_block(wards):
+    blocks = {b: [] for b in BLOCKS_ORDER}
+    for w in wards:
+        if w.block in blocks:
+            blocks[w.block].append(w)
+    return blocks
 
-    for p in Patient.query.all():
-        arrive_dt = _parse_dt(p.arrival_date, p.arrival_time)
-        if not arrive_dt or arrive_dt > at_dt:
-            continue
+OCCUPANCY_BATCH = 1000
 
-        # discharge parsing
-        disc_dt = None
-        if p.discharge_datetime:
-            s = p.discharge_datetime.strip()
-            for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y"):
-                try:
-                    disc_dt = datetime.strptime(s, fmt)
-                    break
-                except Exception:
-                    pass
-
-        if not disc_dt or disc_dt >= at_dt:
-            ward_patients.setdefault(p.ward_id, []).append({
-                "name": f"{p.last_name} {p.first_name} {p.patronymic}".strip(),
-                "hist": p.hist_number,
+def _ward_occupancy(at_dt, wards):
+    """ward_id -> list of occupants ({id, name, hist, type}) present at at_dt.
+
+    A patient counts from arrival until discharge (inclusive); a caregiver
+    occupies a bed too, in their own ward or the patient's. Read from the
+    occupancy index as projected rows: no Patient objects are built.
+    """
+    ward_patients = {w.id: [] for w in wards}
+
+    query = db.session.query(Stay.ward_id, Stay.kind, Patient.id, Patient.hist_number, Patient.last_name,
+                             Patient.first_name, Patient.patronymic, Patient.caregiver_fullname) \
+        .join(Patient, Patient.id == Stay.patient_id) \
+        .filter(Stay.start_at <= at_dt, or_(Stay.end_at.is_(None), Stay.end_at >= at_dt))
+    # only the given wards (already scoped): a station also sees caregivers staying in its wards
+    query = query.filter(Stay.ward_id.in_(list(ward_patients)))
+    # patient before their caregiver ('P' > 'C'), patients in id order
+    for ward_id, kind, pid, hist, last, first, pat, cg_name in \
+            query.order_by(Patient.id, Stay.kind.desc()).yield_per(OCCUPANCY_BATCH):
+        if kind == 'P':
+            ward_patients[ward_id].append({
+                "id": pid,
+                "name": f"{last} {first} {pat}".strip(),
+                "hist": hist,
                 "type": "patient"
             })
+        elif ward_id in ward_patients:
+            ward_patients[ward_id].append({
+                "id": pid,
+                "name": (cg_name or "").strip(),  # may be empty
+                "hist": "",
+                "type": "caregiver"
+            })
+    return ward_patients
+
+# block -> (i18n title key, row class)
+BLOCK_STYLES = {
+    'A': ('A_block', 'table-primary'),
+    'B': ('B_block', 'table-success'),
+    'C': ('C_block', 'table-warning'),
+    'D': ('D_block', 'table-info'),
+    'R': ('R_block', 'table-danger'),
+}
 
-        # Caregiver occupies a bed too
-        if p.caregiver_exists:
-            cg_ward_id = p.caregiver_ward_id or p.ward_id
-            cg_arrive = _parse_dt(p.caregiver_arrival_date, None)
-            cg_depart = _parse_dt(p.caregiver_departure_date, None)
-            in_time = True
-            if cg_arrive and cg_arrive > at_dt:
-                in_time = False
-            if cg_depart and cg_depart < at_dt:
-                in_time = False
-            if in_time and cg_ward_id in ward_patients:
-                cg_name = (p.caregiver_fullname or "").strip()  # may be empty
-                ward_patients[cg_ward_id].append({
-                    "name": cg_name,
-                    "hist": "",
-                    "type": "caregiver"
-                })
-
-    # 5 blocks
-    blocks_order = ['A', 'B', 'C', 'D', 'R']
-    blocks = {b: [] for b in blocks_order}
-    for w in wards:
-        if w.block in blocks:
-            blocks[w.block].append(w)
+def _inpatient_moment():
+    """(at_dt, at_str) from ?at=, defaulting to the current minute."""
+    at_str = (request.args.get('at') or '').strip()  # "dd.mm.yyyy HH:MM"
+    at_dt = _parse_at(at_str) if at_str else None
+    if not at_dt:
+        at_dt = datetime.now().replace(second=0, microsecond=0)  # same moment as at_str, the fragment key
+        at_str = at_dt.strftime("%d.%m.%Y %H:%M")
+    return at_dt, at_str
 
-    return render_template('inpatient.html', t=t, wards=wards,
-                           ward_patients=ward_patients, blocks=blocks, at_str=at_str)
+@app.route('/inpatient')
+@login_required
+def inpatient():
+    """Board shell; every block is loaded from inpatient_block() by static/js/app.js.
+    ?block=C (repeatable) limits the board to those blocks, e.g. for a block's own station."""
+    at_dt, at_str = _inpatient_moment()
+    wards = _scope_wards(Ward.query).order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
+    codes = [b for b in BLOCKS_ORDER if b in request.args.getlist('block')] or BLOCKS_ORDER
+    return render_template('inpatient.html', wards=wards, codes=codes, block_styles=BLOCK_STYLES,
+                           at_str=at_str)
+
+@app.route('/inpatient/block/<code>')
+@login_required
+def inpatient_block(code):
+    """One block of the inpatient board at ?at= (HTML fragment). Only that block's wards are read,
+    the markup is cached per data version, and an unchanged block answers 304."""
+    if code not in BLOCK_STYLES:
+        abort(404)
+    at_dt, at_str = _inpatient_moment()
+    wards = _scope_wards(Ward.query).filter(Ward.block == code).order_by(Ward.sort_order.asc()).all()
+    key = ('inpatient_block', code, at_str, tuple(w.id for w in wards))
+
+    def render():
+        return render_template('_inpatient_block.html', wards=wards, row_class=BLOCK_STYLES[code][1],
+                               ward_patients=_ward_occupancy(at_dt, wards), at_str=at_str)
+
+    response = Response(cached_render(key, render), mimetype='text/html')
+    # weak: compress_response() sends the same tag with gzip, br or identity bodies
+    response.set_etag(hashlib.sha256(repr((key, data_version(), get_lang())).encode()).hexdigest()[:32], weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/inpatient/export')
 @login_required
 def inpatient_export():
     at_str = (request.args.get('at') or '').strip()
-    try:
-        at_dt = datetime.strptime(at_str, "%d.%m.%Y %H:%M") if at_str else datetime.now()
-    except Exception:
-        try:
-            at_dt = datetime.strptime(at_str, "%d.%m.%Y")
-        except Exception:
-            at_dt = datetime.now()
+    at_dt = (_parse_at(at_str) if at_str else None) or datetime.now()
     at_str = at_dt.strftime("%d.%m.%Y %H:%M")
 
-    wards = Ward.query.order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
-
-    ward_patients = {w.id: [] for w in wards}
-    for p in Patient.query.all():
-        arrive_dt = _parse_dt(p.arrival_date, p.arrival_time)
-        if not arrive_dt or arrive_dt > at_dt:
-            continue
+    wards = _scope_wards(Ward.query).order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
+    ward_patients = _ward_occupancy(at_dt, wards)
 
-        disc_dt = None
-        if p.discharge_datetime:
-            s = p.discharge_datetime.strip()
-            for fmt in ("%d.%m.%Y %H:%M", "%d.%m.%Y"):
-                try:
-                    disc_dt = datetime.strptime(s, fmt)
-                    break
-                except Exception:
-                    pass
-
-        if not disc_dt or disc_dt >= at_dt:
-            ward_patients.setdefault(p.ward_id, []).append({
-                "name": f"{p.last_name} {p.first_name} {p.patronymic}".strip(),
-                "hist": p.hist_number,
-                "type": "patient"
-            })
-
-        if p.caregiver_exists:
-            cg_ward_id = p.caregiver_ward_id or p.ward_id
-            cg_arrive = _parse_dt(p.caregiver_arrival_date, None)
-            cg_depart = _parse_dt(p.caregiver_departure_date, None)
-            in_time = True
-            if cg_arrive and cg_arrive > at_dt: in_time = False
-            if cg_depart and cg_depart < at_dt: in_time = False
-            if in_time and cg_ward_id in ward_patients:
-                cg_name = (p.caregiver_fullname or "").strip()
-                ward_patients[cg_ward_id].append({
-                    "name": cg_name,
-                    "hist": "",
-                    "type": "caregiver"
-                })
-
-    blocks_order = ['A', 'B', 'C', 'D', 'R']
     block_titles = {
         'A': t('A_block'),
         'B': t('B_block'),
@@ -816,19 +1824,15 @@ def inpatient_export():
         'D': t('D_block'),
         'R': t('R_block'),
     }
-    blocks = {b: [] for b in blocks_order}
-    for w in wards:
-        if w.block in blocks:
-            blocks[w.block].append(w)
+    blocks = _group_wards_by_block(wards)
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = t('inpatient')
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(t('inpatient'))
 
     ws.append([f"{t('inpatient')} — {at_str}"])
     ws.append([])
 
-    for b in blocks_order:
+    for b in BLOCKS_ORDER:
         ws.append([block_titles[b]])
         ws.append([t('ward'), t('patients_col')])
         for w in blocks[b]:
@@ -860,44 +1864,256 @@ def inpatient_export():
 @app.route('/settings')
 @superadmin_required
 def settings_home():
-    return render_template('settings.html', t=t)
+    return render_template('settings.html', archive_after_days=app.config['ARCHIVE_AFTER_DAYS'])
+
+def _stat_row(label, admissions, caregivers, discharges, stay_minutes):
+    admissions, caregivers, discharges, stay_minutes = (int(v or 0) for v in
+                                                         (admissions, caregivers, discharges, stay_minutes))
+    return {'label': label, 'admissions': admissions, 'discharges': discharges,
+            'avg_stay_days': round(stay_minutes / discharges / 1440, 1) if discharges else None,
+            'caregiver_ratio': round(100 * caregivers / admissions) if admissions else None}
+
+def _stats_period(value):
+    """'YYYY-MM' (by day) or 'YYYY' (by month) -> (start date, end date, bucket); default this month."""
+    try:
+        if len(value or '') == 4:
+            year = int(value)
+            return date(year, 1, 1), date(year + 1, 1, 1), 'month'
+        year, month = (int(x) for x in value.split('-'))
+        start = date(year, month, 1)
+    except (AttributeError, ValueError):
+        start = date.today().replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1), 'day'
+
+@app.route('/settings/stats')
+@superadmin_required
+def settings_stats():
+    """Admissions/discharges dashboard; every figure is a GROUP BY over the daily_stat rollup."""
+    period = request.args.get('period') or date.today().strftime('%Y-%m')
+    start, end, bucket = _stats_period(period)
+    sums = (func.sum(DailyStat.admissions), func.sum(DailyStat.caregivers),
+            func.sum(DailyStat.discharges), func.sum(DailyStat.stay_minutes))
+    q = db.session.query(DailyStat).filter(DailyStat.day >= start, DailyStat.day < end)
+    by_bucket = func.strftime('%Y-%m' if bucket == 'month' else '%Y-%m-%d', DailyStat.day)
+
+    wards = {w.id: w for w in Ward.query.all()}
+    doctors = {d.id: d.full_name for d in Doctor.query.all()}
+    totals = _stat_row('', *q.with_entities(*sums).one())
+    periods = [_stat_row(b, *v) for b, *v in q.with_entities(by_bucket, *sums).group_by(by_bucket).order_by(by_bucket)]
+    by_doctor = [_stat_row(doctors.get(did, f'#{did}'), *v)
+                 for did, *v in q.with_entities(DailyStat.doctor_id, *sums).group_by(DailyStat.doctor_id)]
+    by_ward = [_stat_row(wards[wid].name if wid in wards else f'#{wid}', *v)
+               for wid, *v in q.with_entities(DailyStat.ward_id, *sums).group_by(DailyStat.ward_id)]
+    by_block = [_stat_row(b or '?', *v) for b, *v in
+                q.outerjoin(Ward, Ward.id == DailyStat.ward_id).with_entities(Ward.block, *sums)
+                 .group_by(Ward.block).order_by(Ward.block)]
+    for rows in (by_doctor, by_ward):
+        rows.sort(key=lambda r: -r['admissions'])
+    return render_template('settings_stats.html', period=period, bucket=bucket, totals=totals,
+                           periods=periods, by_doctor=by_doctor, by_ward=by_ward, by_block=by_block)
+
+@app.route('/settings/stats/rebuild', methods=['POST'])
+@superadmin_required
+def settings_stats_rebuild():
+    rebuild_daily_stats()
+    db.session.commit()
+    flash(t('stats_rebuilt'), 'success')
+    return redirect(url_for('settings_stats', period=request.form.get('period')))
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the daily statistics rollup from patients and the archive."""
+    init_db()
+    rebuild_daily_stats()
+    db.session.commit()
+    click.echo(f"Rebuilt {DailyStat.query.count()} daily statistics rows.")
+
+def _ward_reference_counts(ids=None):
+    """ward_id -> number of patients placed in it (as patient or caregiver), current and archived;
+    one aggregate query per table."""
+    counts = defaultdict(int)
+    for model in (Patient, PatientArchive):
+        q = db.session.query(Ward.id, func.count(model.id)) \
+            .join(model, or_(model.ward_id == Ward.id, model.caregiver_ward_id == Ward.id))
+        if ids is not None:
+            q = q.filter(Ward.id.in_(ids))
+        for ward_id, n in q.group_by(Ward.id):
+            counts[ward_id] += n
+    return dict(counts)
+
+def _doctor_reference_counts(ids=None):
+    """doctor_id -> number of patients assigned to them, current and archived; one aggregate query per table."""
+    counts = defaultdict(int)
+    for model in (Patient, PatientArchive):
+        q = db.session.query(model.doctor_id, func.count(model.id))
+        if ids is not None:
+            q = q.filter(model.doctor_id.in_(ids))
+        for doctor_id, n in q.group_by(model.doctor_id):
+            counts[doctor_id] += n
+    return dict(counts)
+
+def _bulk_delete_unreferenced(model, ids, ref_counts, label):
+    """Delete ids in one statement, skipping rows still referenced by patients."""
+    in_use = [i for i in ids if ref_counts.get(i)]
+    free = [i for i in ids if i not in in_use]
+    if in_use:
+        names = dict(db.session.query(model.id, label).filter(model.id.in_(in_use)).all())
+        flash(t('still_referenced') + ': ' + ', '.join(f"{names.get(i, i)} ({ref_counts[i]})" for i in in_use), 'warning')
+    if free:
+        model.query.filter(model.id.in_(free)).delete(synchronize_session=False)
+        db.session.commit()
+
+def _bulk_set_sort_order(model, ids, orders):
+    """Reorder many rows with one UPDATE ... SET sort_order = CASE id ... END."""
+    mapping = {}
+    for id_, order in zip(ids, orders):
+        try:
+            mapping[int(id_)] = int(order or 0)
+        except ValueError:
+            pass
+    if mapping:
+        model.query.filter(model.id.in_(list(mapping))) \
+             .update({model.sort_order: case(mapping, value=model.id)}, synchronize_session=False)
+        db.session.commit()
+
+def _inline_row(form, id_name, fields):
+    """Values of one row of a multi-row form: the row whose hidden id matches the clicked button."""
+    ids = form.getlist(id_name)
+    try:
+        pos = ids.index(form.get('inline_save'))
+    except ValueError:
+        return None, {}
+    return int(ids[pos]), {f: form.getlist(f)[pos] for f in fields}
+
+def _form_int(value, minimum=None):
+    """A whole number typed into a form ('' = 0), or None if it is not one or is below minimum."""
+    try:
+        number = int((value or '0').strip())
+    except ValueError:
+        return None
+    return None if minimum is not None and number < minimum else number
 
 @app.route('/settings/wards', methods=['GET', 'POST'])
 @superadmin_required
 def settings_wards():
     if request.method == 'POST':
+        bump_data_version()  # names and blocks appear in cached fragments
         if 'add' in request.form:
             name = request.form.get('name', '').strip()
-            sort_order = int(request.form.get('sort_order') or 0)
+            sort_order = _form_int(request.form.get('sort_order'))
             block = request.form.get('block', 'A')
+            capacity = _form_int(request.form.get('capacity'), minimum=0)
+            if sort_order is None or capacity is None:
+                flash(t('invalid_ward_numbers'), 'danger')
+                return redirect(url_for('settings_wards'))
             if name:
-                w = Ward(name=name, sort_order=sort_order, block=block)
+                w = Ward(name=name, sort_order=sort_order, block=block, capacity=capacity)
                 db.session.add(w)
                 db.session.commit()
         elif 'delete_selected' in request.form:
-            ids = request.form.getlist('delete_id')
-            for id_ in ids:
-                w = Ward.query.get(int(id_))
-                if w:
-                    db.session.delete(w)
-            db.session.commit()
+            ids = _selected_ids(request.form, 'delete_id')
+            _bulk_delete_unreferenced(Ward, ids, _ward_reference_counts(ids), Ward.name)
+        elif 'save_order' in request.form:
+            _bulk_set_sort_order(Ward, request.form.getlist('wid'), request.form.getlist('sort_order'))
+        elif 'set_block' in request.form:
+            ids = _selected_ids(request.form, 'delete_id')
+            block = request.form.get('bulk_block')
+            if ids and block in BLOCKS_ORDER:
+                Ward.query.filter(Ward.id.in_(ids)).update({Ward.block: block}, synchronize_session=False)
+                db.session.commit()
         elif 'inline_save' in request.form:
-            wid = int(request.form.get('wid'))
-            w = Ward.query.get(wid)
+            wid, row = _inline_row(request.form, 'wid', ('name', 'sort_order', 'block', 'capacity'))
+            w = Ward.query.get(wid) if wid else None
             if w:
-                w.name = request.form.get('name').strip()
-                w.sort_order = int(request.form.get('sort_order') or 0)
-                w.block = request.form.get('block', 'A')
+                sort_order, capacity = _form_int(row['sort_order']), _form_int(row['capacity'], minimum=0)
+                if sort_order is None or capacity is None:
+                    flash(t('invalid_ward_numbers'), 'danger')
+                    return redirect(url_for('settings_wards'))
+                w.name = row['name'].strip()
+                w.sort_order = sort_order
+                w.block = row['block'] or 'A'
+                w.capacity = capacity
                 db.session.commit()
 
     wards = Ward.query.order_by(Ward.sort_order).all()
-    return render_template('settings_wards.html', t=t, wards=wards)
+    return render_template('settings_wards.html', wards=wards, ref_counts=_ward_reference_counts())
+
+@app.route('/settings/archive', methods=['POST'])
+@superadmin_required
+def settings_archive():
+    days = request.form.get('days', type=int)
+    count = archive_discharged(days if days is not None and days >= 0 else None)
+    flash(t('archived_n_patients').format(count), 'success')
+    return redirect(url_for('settings_home'))
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=None, help='Archive patients discharged more than N days ago.')
+def archive_command(days):
+    """Move long-discharged patients to the archive table."""
+    init_db()
+    click.echo(f"Archived {archive_discharged(days)} patients.")
+
+@app.cli.command('purge-audit')
+@click.option('--days', type=int, default=None, help='Delete audit entries older than N days.')
+def purge_audit_command(days):
+    """Apply the audit log retention policy."""
+    init_db()
+    click.echo(f"Deleted {purge_audit_log(days)} audit entries.")
+
+@app.route('/settings/backups', methods=['GET', 'POST'])
+@superadmin_required
+def settings_backups():
+    if request.method == 'POST':
+        info = create_backup()
+        flash(t('backup_created').format(info['name']), 'success')
+        return redirect(url_for('settings_backups'))
+    return render_template('settings_backups.html', backups=list_backups(),
+                           keep=app.config['BACKUP_KEEP'], interval=app.config['BACKUP_INTERVAL_HOURS'])
+
+@app.route('/settings/backups/<name>')
+@superadmin_required
+def settings_backup_download(name):
+    try:
+        path = _backup_path(name)
+    except FileNotFoundError:
+        abort(404)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@app.cli.command('backup')
+@click.option('--list', 'list_only', is_flag=True, help='Only list existing snapshots.')
+def backup_command(list_only):
+    """Take a compressed online snapshot of the database and rotate old ones."""
+    init_db()
+    if not list_only:
+        def progress(copied, total):
+            click.echo(f"\r  {copied}/{total} pages", nl=False)
+        info = create_backup(progress)
+        click.echo(f"\nCreated {info['name']} ({info['size']} bytes, copy {info['copy_seconds']}s, "
+                   f"compress {info['compress_seconds']}s).")
+        return
+    for info in list_backups():
+        click.echo(f"{info['name']}  {info['size']:>12}  copy {info.get('copy_seconds', '?')}s  "
+                   f"compress {info.get('compress_seconds', '?')}s")
+
+@app.cli.command('restore')
+@click.argument('name')
+@click.confirmation_option(prompt='Replace the current database with this snapshot?')
+def restore_command(name):
+    """Restore the database from a snapshot (see `flask backup --list`)."""
+    init_db()
+    try:
+        restore_backup(name)
+    except FileNotFoundError:
+        raise click.ClickException(f"No snapshot named {name} in {app.config['BACKUP_FOLDER']}")
+    click.echo(f"Restored {name}.")
 
 @app.route('/settings/clear_patients', methods=['POST'])
 @superadmin_required
 def settings_clear_patients():
-    deleted = db.session.query(Patient).delete()
-    db.session.commit()
+    # chunked so every patient gets its audit entry; stays and orphaned persons go with each chunk
+    deleted = _delete_patients_chunked([])
     flash(f'Deleted {deleted} patients', 'success')
     return redirect(url_for('settings_home'))
 
@@ -905,6 +2121,7 @@ def settings_clear_patients():
 @superadmin_required
 def settings_doctors():
     if request.method == 'POST':
+        bump_data_version()  # names and blocks appear in cached fragments
         if 'add' in request.form:
             full_name = request.form.get('full_name', '').strip()
             sort_order = int(request.form.get('sort_order') or 0)
@@ -913,321 +2130,608 @@ def settings_doctors():
                 db.session.add(d)
                 db.session.commit()
         elif 'delete_selected' in request.form:
-            ids = request.form.getlist('delete_id')
-            for id_ in ids:
-                d = Doctor.query.get(int(id_))
-                if d:
-                    db.session.delete(d)
-            db.session.commit()
+            ids = _selected_ids(request.form, 'delete_id')
+            _bulk_delete_unreferenced(Doctor, ids, _doctor_reference_counts(ids), Doctor.full_name)
+        elif 'save_order' in request.form:
+            _bulk_set_sort_order(Doctor, request.form.getlist('did'), request.form.getlist('sort_order'))
         elif 'inline_save' in request.form:
-            did = int(request.form.get('did'))
-            d = Doctor.query.get(did)
+            did, row = _inline_row(request.form, 'did', ('full_name', 'sort_order'))
+            d = Doctor.query.get(did) if did else None
             if d:
-                d.full_name = request.form.get('full_name').strip()
-                d.sort_order = int(request.form.get('sort_order') or 0)
+                d.full_name = row['full_name'].strip()
+                d.sort_order = int(row['sort_order'] or 0)
                 db.session.commit()
 
     doctors = Doctor.query.order_by(Doctor.sort_order).all()
-    return render_template('settings_doctors.html', t=t, doctors=doctors)
+    return render_template('settings_doctors.html', doctors=doctors, ref_counts=_doctor_reference_counts())
+
+CLEANUP_PAGE_SIZE = 200
+DELETE_CHUNK_SIZE = 500
+
+def _delete_patients_chunked(criteria, chunk_size=DELETE_CHUNK_SIZE, progress=None):
+    """Delete patients matching criteria in id batches, committing each batch
+    so a large purge never holds the SQLite write lock for long. Returns the count.
+    progress(n) is called after each committed batch."""
+    total = 0
+    while True:
+        ids = [pid for (pid,) in db.session.query(Patient.id).filter(*criteria)
+                                          .order_by(Patient.id).limit(chunk_size)]
+        if not ids:
+            return total
+        audit_patients('delete', audit_snapshot(ids), {})
+        person_ids = [pid for (pid,) in db.session.query(Patient.person_id).filter(Patient.id.in_(ids))]
+        total += Patient.query.filter(Patient.id.in_(ids)).delete(synchronize_session=False)
+        _patients_changed(ids)
+        _drop_orphan_persons(person_ids)
+        db.session.commit()
+        if progress:
+            progress(len(ids))
 
 @app.route('/settings/cleanup-invalid', methods=['GET', 'POST'])
 @superadmin_required
 def settings_cleanup_invalid():
-    # Build query of invalid patients
-    conds = _invalid_required_conditions()
-    base_q = Patient.query.filter(or_(*conds))
+    checks = _missing_field_checks()
+    invalid = or_(*[cond for _, cond in checks])
 
     if request.method == 'POST':
         # Delete ONLY selected
         if 'delete_selected' in request.form:
-            raw_ids = request.form.getlist('sel')
-            ids = []
-            for s in raw_ids:
-                try:
-                    ids.append(int(s))
-                except Exception:
-                    pass
-
+            ids = _selected_ids(request.form)
             if not ids:
-                # Fallback message if i18n key not present
-                msg = t('no_selection') if t('no_selection') != 'no_selection' else 'No rows selected.'
-                flash(msg, 'warning')
+                flash(t('no_selection'), 'warning')
                 return redirect(url_for('settings_cleanup_invalid'))
 
-            count = Patient.query.filter(
-                Patient.id.in_(ids),
-                or_(*conds)  # keep it safe: only delete if still invalid
-            ).delete(synchronize_session=False)
-            db.session.commit()
-
-            # Localized flash
-            try:
-                flash(t('deleted_n_patients').format(count), 'success')
-            except Exception:
-                flash(f'Deleted {count} patients', 'success')
-
+            # keep it safe: only delete if still invalid
+            count = _delete_patients_chunked([Patient.id.in_(ids), invalid])
+            flash(t('deleted_n_patients').format(count), 'success')
             return redirect(url_for('settings_cleanup_invalid'))
 
-        # Delete ALL listed (same as before)
+        # Delete ALL listed
         if 'delete_all' in request.form:
-            count = base_q.delete(synchronize_session=False)
-            db.session.commit()
-            try:
-                flash(t('deleted_n_patients').format(count), 'success')
-            except Exception:
-                flash(f'Deleted {count} patients', 'success')
+            count = _delete_patients_chunked([invalid])
+            flash(t('deleted_n_patients').format(count), 'success')
             return redirect(url_for('settings_cleanup_invalid'))
 
-    # ----- GET: preview list with "missing fields" -----
-    invalids = base_q.all()
-
-    def missing_list(p):
-        m = []
-        if not p.hist_number or not p.hist_number.strip(): m.append(t('hist_number'))
-        if not p.last_name or not p.last_name.strip(): m.append(t('last_name'))
-        if not p.first_name or not p.first_name.strip(): m.append(t('first_name'))
-        if not p.patronymic or not p.patronymic.strip(): m.append(t('patronymic'))
-        if not p.birth_date or not p.birth_date.strip(): m.append(t('birth_date'))
-        if not p.phone or not p.phone.strip(): m.append(t('phone'))
-        if not p.address or not p.address.strip(): m.append(t('address'))
-        if not p.occupation or not p.occupation.strip(): m.append(t('occupation'))
-        if not p.arrival_date or not p.arrival_date.strip(): m.append(t('arrival_date'))
-        if not p.arrival_time or not p.arrival_time.strip(): m.append(t('arrival_time'))
-        if not p.ward_id: m.append(t('ward'))
-        if not p.doctor_id: m.append(t('doctor'))
-        return m
-
-    rows = [{'p': p, 'missing': missing_list(p)} for p in invalids]
-    return render_template('settings_cleanup_invalid.html', t=t, rows=rows)
-
-@app.route('/settings/import', methods=['GET', 'POST'])
-@superadmin_required
-def settings_import():
-    import re
-    from datetime import datetime
-    from openpyxl import load_workbook
-
-    def flash_back(msg, cat='danger'):
-        flash(msg, cat)
-        return redirect(url_for('settings_import'))
-
-    # --- helpers -------------------------------------------------------------
-    def norm(s):
-        s = (s or '').strip().lower()
-        return ''.join(ch for ch in s if ch.isalnum())
-
-    # dd.mm.yyyy, dd.mm.yy, dd/mm, yyyy-mm-dd, Excel date -> 'dd.mm.yyyy'
-    def parse_date(val):
-        if val is None or str(val).strip() == '':
-            return ''
-        if isinstance(val, datetime):
-            return val.strftime('%d.%m.%Y')
-        s = str(val).strip()
-        # dd.mm or dd/mm -> assume current year
-        m = re.match(r'^(\d{1,2})[./-](\d{1,2})$', s)
-        if m:
-            d, mo = int(m.group(1)), int(m.group(2))
-            y = datetime.now().year
-            try:
-                return datetime(y, mo, d).strftime('%d.%m.%Y')
-            except ValueError:
-                return s
-        # dd.mm.yy / dd.mm.yyyy (or with / or -)
-        m = re.match(r'^(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})', s)
-        if m:
-            d, mo, y = int(m.group(1)), int(m.group(2)), int(m.group(3))
-            if y < 100: y += 2000
-            try:
-                return datetime(y, mo, d).strftime('%d.%m.%Y')
-            except ValueError:
-                return s
-        # yyyy-mm-dd
-        m = re.match(r'^(\d{4})-(\d{2})-(\d{2})', s)
-        if m:
-            try:
-                return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3))).strftime('%d.%m.%Y')
-            except ValueError:
-                return s
-        return s
-
-    # -> 'HH:MM'
-    def parse_time(val):
-        if val is None or str(val).strip() == '':
-            return ''
-        if isinstance(val, datetime):
-            return val.strftime('%H:%M')
-        s = str(val).strip()
-        m = re.search(r'(\d{1,2}):(\d{2})', s)
-        if m:
-            hh = int(m.group(1)); mm = int(m.group(2))
-            return f'{hh:02d}:{mm:02d}'
-        m = re.match(r'^(\d{2})(\d{2})$', s)
-        if m:
-            return f'{m.group(1)}:{m.group(2)}'
-        return s
-
-    # split "Бемор Ф.И.О" -> (last, first, patronymic)
-    def parse_fio(val):
-        if not val:
-            return '', '', ''
-        s = str(val).replace(',', ' ').strip()
-        parts = [p for p in s.split() if p]
-        if len(parts) >= 3:
-            return parts[0], parts[1], ' '.join(parts[2:])
-        if len(parts) == 2:
-            return parts[0], parts[1], ''
-        if len(parts) == 1:
-            return parts[0], '', ''
+    # ----- GET: one page of invalid patients with the missing-field bitmask computed in SQL -----
+    mask = sum(case((cond, 1 << i), else_=0) for i, (_, cond) in enumerate(checks))
+    after = request.args.get('after', type=int) or 0
+    page = (db.session.query(Patient.id, Patient.hist_number, Patient.last_name,
+                             Patient.first_name, Patient.patronymic, mask.label('mask'))
+            .filter(invalid, Patient.id > after)
+            .order_by(Patient.id)
+            .limit(CLEANUP_PAGE_SIZE + 1)
+            .all())
+    has_more = len(page) > CLEANUP_PAGE_SIZE
+    page = page[:CLEANUP_PAGE_SIZE]
+
+    # Totals per missing field, one aggregate pass
+    counts = db.session.query(func.count(Patient.id),
+                              *[func.sum(case((cond, 1), else_=0)) for _, cond in checks]) \
+                       .filter(invalid).one()
+    labels = [t(key) for key, _ in checks]
+    field_counts = [(labels[i], n) for i, n in enumerate(counts[1:]) if n]
+
+    rows = [{'p': r, 'missing': [labels[i] for i in range(len(labels)) if r.mask & (1 << i)]} for r in page]
+    return render_template('settings_cleanup_invalid.html', rows=rows,
+                           total=counts[0], field_counts=field_counts,
+                           next_after=page[-1].id if has_more else None)
+
+# -------------------- Excel import --------------------
+
+def _imp_norm(s):
+    s = (s or '').strip().lower()
+    return ''.join(ch for ch in s if ch.isalnum())
+
+_DATE_DM = re.compile(r'^(\d{1,2})[./-](\d{1,2})$')
+_DATE_DMY = re.compile(r'^(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})')
+_DATE_ISO = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+_TIME_HM = re.compile(r'(\d{1,2}):(\d{2})')
+_TIME_HHMM = re.compile(r'^(\d{2})(\d{2})$')
+
+# dd.mm.yyyy, dd.mm.yy, dd/mm, yyyy-mm-dd, Excel date -> 'dd.mm.yyyy'
+def parse_date(val):
+    if val is None or str(val).strip() == '':
+        return ''
+    if isinstance(val, datetime):
+        return val.strftime('%d.%m.%Y')
+    s = str(val).strip()
+    # dd.mm or dd/mm -> assume current year
+    m = _DATE_DM.match(s)
+    if m:
+        d, mo = int(m.group(1)), int(m.group(2))
+        y = datetime.now().year
+        try:
+            return datetime(y, mo, d).strftime('%d.%m.%Y')
+        except ValueError:
+            return s
+    # dd.mm.yy / dd.mm.yyyy (or with / or -)
+    m = _DATE_DMY.match(s)
+    if m:
+        d, mo, y = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        if y < 100: y += 2000
+        try:
+            return datetime(y, mo, d).strftime('%d.%m.%Y')
+        except ValueError:
+            return s
+    # yyyy-mm-dd
+    m = _DATE_ISO.match(s)
+    if m:
+        try:
+            return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3))).strftime('%d.%m.%Y')
+        except ValueError:
+            return s
+    return s
+
+# -> 'HH:MM'
+def parse_time(val):
+    if val is None or str(val).strip() == '':
+        return ''
+    if isinstance(val, datetime):
+        return val.strftime('%H:%M')
+    s = str(val).strip()
+    m = _TIME_HM.search(s)
+    if m:
+        hh = int(m.group(1)); mm = int(m.group(2))
+        return f'{hh:02d}:{mm:02d}'
+    m = _TIME_HHMM.match(s)
+    if m:
+        return f'{m.group(1)}:{m.group(2)}'
+    return s
+
+# split "Бемор Ф.И.О" -> (last, first, patronymic)
+def parse_fio(val):
+    if not val:
         return '', '', ''
+    s = str(val).replace(',', ' ').strip()
+    parts = [p for p in s.split() if p]
+    if len(parts) >= 3:
+        return parts[0], parts[1], ' '.join(parts[2:])
+    if len(parts) == 2:
+        return parts[0], parts[1], ''
+    if len(parts) == 1:
+        return parts[0], '', ''
+    return '', '', ''
+
+# Map exact headers from the clinic file (Cyrillic Uzbek/Russian) and fallbacks
+IMPORT_COLMAP = {
+    'hist':      ['тартибраками', 'истномер', 'hist_number', 'historyno', 'номер'],
+    'fio':       ['беморфио', 'фио', 'фипациента', 'full_name', 'fio', 'фиопасиента'],
+    'dob':       ['тугилгансана', 'датарождения', 'birthdate', 'dateofbirth'],
+    'address':   ['доимийяшашжойиёкикариндошякинларинингманзилителефон', 'адрес', 'address'],
+    'phone':     ['телефонраками', 'телномер', 'phone', 'телефон'],
+    'occ':       ['ишжойи', 'касби', 'occupation', 'profession'],
+    'arr_date':  ['келгансана', 'датапоступления', 'arrivaldate'],
+    'arr_time':  ['келганвакти', 'времявступления', 'arrivaltime'],
+    'disc_date': ['чикарилгансана', 'датавыписки', 'dischargedate'],
+    'disc_time': ['чикарилганвакт', 'времявыписки', 'dischargetime'],
+    'ward':      ['палата', 'ward', 'palata'],
+    'doctor':    ['шифокор', 'врач', 'doctor'],
+    'caregiver': ['каровчи', 'сиделка', 'caregiver'],
+    # extra (ignored if not in your DB): diagnosis/referrer/reject reason
+    'diagnosis': ['кабулхонаташхиси'],
+    'referrer':  ['кайсимуассасайуллаганьокикимолибкелган'],
+    'reject':    ['раdetишнингсабабиташхис', 'радэтишнингсабабиташхис'],
+}
+IMPORT_REQUIRED = {'hist': 'Тартиб Раками', 'dob': 'Тугилган Сана', 'fio': 'Бемор Ф.И.О'}
+
+def import_sheets(wb):
+    """Every "PalataQabul..." sheet (PalataQabul, PalataQabul (2), PalataQabul_B, ...), else the active sheet."""
+    sheets = [wb[name] for name in wb.sheetnames if _imp_norm(name).startswith('palataqabul')]
+    return sheets or [wb.active]
+
+IMPORT_BATCH = 1000      # rows converted column-wise at a time
+IMPORT_SAMPLE = 50       # non-empty values per column used to pick its converter
+IMPORT_DATE_KEYS = ('dob', 'arr_date', 'disc_date')
+IMPORT_TIME_KEYS = ('arr_time', 'disc_time')
+IMPORT_TEXT_KEYS = ('hist', 'fio', 'phone', 'address', 'occ', 'ward', 'doctor', 'caregiver')
+
+def compile_colmap(colmap):
+    """Normalize a {key: [header aliases]} map once, for match_columns()."""
+    return {key: tuple(_imp_norm(a) for a in aliases) for key, aliases in colmap.items()}
+
+IMPORT_ALIASES = compile_colmap(IMPORT_COLMAP)
+
+def find_header_row(ws, min_filled=6, scan_rows=10):
+    """(row number, header cells): first of the top scan_rows rows with >= min_filled non-empty cells, else row 1."""
+    for i, row in enumerate(ws.iter_rows(min_row=1, max_row=scan_rows, values_only=True), start=1):
+        vals = [v for v in row if v not in (None, '')]
+        if len(vals) >= min_filled:
+            return i, [str(x).strip() if x is not None else '' for x in row]
+    first = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    return 1, [str(x).strip() if x is not None else '' for x in first]
+
+def match_columns(headers, aliases):
+    """key -> column index for a compiled colmap (exact alias match first, then prefix), None if absent."""
+    headers_norm = [_imp_norm(h) for h in headers]
+
+    def find_col(cands):
+        for i, h in enumerate(headers_norm):
+            if h in cands:
+                return i
+        for i, h in enumerate(headers_norm):
+            if h.startswith(cands):
+                return i
+        return None
 
-    def cell(row, i):
-        if i is None: return ''
-        return '' if i >= len(row) or row[i] is None else str(row[i]).strip()
-
-    # --- main ---------------------------------------------------------------
-    if request.method == 'POST':
-        f = request.files.get('file')
-        if not f or f.filename.strip() == '':
-            return flash_back('No file selected')
-        if not f.filename.lower().endswith('.xlsx'):
-            return flash_back('Please upload an .xlsx file (Excel 2007+).')
-
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
-        path = os.path.join(app.config['UPLOAD_FOLDER'], f"import_{ts}.xlsx")
-        f.save(path)
-
-        try:
-            wb = load_workbook(path, data_only=True)
-        except Exception as e:
-            return flash_back(f'Could not read Excel: {e}')
-
-        # Prefer "PalataQabul" if present, else active sheet
-        ws = wb['PalataQabul'] if 'PalataQabul' in wb.sheetnames else wb.active
-
-        # find header row (first row with >= 6 non-empty cells)
-        header_row_idx = 1
-        headers = None
-        for i, row in enumerate(ws.iter_rows(min_row=1, max_row=10, values_only=True), start=1):
-            vals = [v for v in row if v not in (None, '')]
-            if len(vals) >= 6:
-                header_row_idx = i
-                headers = [str(x).strip() if x is not None else '' for x in row]
+    return {k: find_col(v) for k, v in aliases.items()}
+
+# Column converters: each returns exactly what the generic parser would, with a fast path for the
+# value type sampled from the column and the generic parser for anything else.
+
+_DMY_TEXT = re.compile(r'(\d{1,2})[./-](\d{1,2})[./-](\d{4})')
+_ISO_TEXT = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+def _text_cell(v):
+    return '' if v is None else str(v).strip()
+
+def _excel_date(v):
+    if type(v) is datetime and v.year >= 1000:
+        return f"{v.day:02d}.{v.month:02d}.{v.year}"
+    return parse_date(v)
+
+def _text_date_converter(pattern, order):
+    """Converter for text dates matching pattern in full; order = group numbers of day, month, year."""
+    fullmatch = pattern.fullmatch
+    di, mi, yi = (i - 1 for i in order)
+
+    def convert(v):
+        if type(v) is str:
+            s = v.strip()
+            m = fullmatch(s)
+            if m:
+                g = m.groups()
+                d, mo, y = int(g[di]), int(g[mi]), int(g[yi])
+                if y >= 1000:
+                    try:
+                        date(y, mo, d)
+                    except ValueError:
+                        return s
+                    return f"{d:02d}.{mo:02d}.{y}"
+        return parse_date(v)
+    return convert
+
+def _excel_time(v):
+    if type(v) is datetime or type(v) is time:
+        return f"{v.hour:02d}:{v.minute:02d}"
+    return parse_time(v)
+
+def _sample(batch, i):
+    values = []
+    for row in batch:
+        v = row[i] if i < len(row) else None
+        if v not in (None, ''):
+            values.append(v)
+            if len(values) == IMPORT_SAMPLE:
                 break
-        if headers is None:
-            header_row_idx = 1
-            headers = [str(x).strip() if x is not None else '' for x in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
-
-        headers_norm = [norm(h) for h in headers]
-
-        # Map exact headers from your file (Cyrillic Uzbek/Russian) and fallbacks
-        colmap = {
-            'hist':      ['тартибраками', 'истномер', 'hist_number', 'historyno', 'номер'],
-            'fio':       ['беморфио', 'фио', 'фипациента', 'full_name', 'fio', 'фиопасиента'],
-            'dob':       ['тугилгансана', 'датарождения', 'birthdate', 'dateofbirth'],
-            'address':   ['доимийяшашжойиёкикариндошякинларинингманзилителефон', 'адрес', 'address'],
-            'phone':     ['телефонраками', 'телномер', 'phone', 'телефон'],
-            'occ':       ['ишжойи', 'касби', 'occupation', 'profession'],
-            'arr_date':  ['келгансана', 'датапоступления', 'arrivaldate'],
-            'arr_time':  ['келганвакти', 'времявступления', 'arrivaltime'],
-            'disc_date': ['чикарилгансана', 'датавыписки', 'dischargedate'],
-            'disc_time': ['чикарилганвакт', 'времявыписки', 'dischargetime'],
-            'ward':      ['палата', 'ward', 'palata'],
-            'doctor':    ['шифокор', 'врач', 'doctor'],
-            'caregiver': ['каровчи', 'сиделка', 'caregiver'],
-            # extra (ignored if not in your DB): diagnosis/referrer/reject reason
-            'diagnosis': ['кабулхонаташхиси'],
-            'referrer':  ['кайсимуассасайуллаганьокикимолибкелган'],
-            'reject':    ['раdetишнингсабабиташхис', 'радэтишнингсабабиташхис'],
-        }
-
-        def find_col(candidates):
-            cands = [norm(c) for c in candidates]
-            for i, h in enumerate(headers_norm):
-                if h in cands:
-                    return i
-            for i, h in enumerate(headers_norm):
-                if any(h.startswith(c) for c in cands):
-                    return i
-            return None
-
-        idx = {k: find_col(v) for k, v in colmap.items()}
-
-        # Required: history no (we map "Тартиб Раками") + DOB + FIO
-        if idx.get('hist') is None or idx.get('dob') is None or idx.get('fio') is None:
-            missing = []
-            if idx.get('hist') is None: missing.append('Тартиб Раками')
-            if idx.get('dob') is None:  missing.append('Тугилган Сана')
-            if idx.get('fio') is None:  missing.append('Бемор Ф.И.О')
-            return flash_back('Missing required columns: ' + ', '.join(missing))
-
-        # lookups for ward / doctor names already in DB
-        ward_by_name   = {w.name.strip(): w for w in Ward.query.all()}
-        doctor_by_name = {d.full_name.strip(): d for d in Doctor.query.all()}
-
-        imported = 0
-        for row in ws.iter_rows(min_row=header_row_idx+1, values_only=True):
-            row = list(row) if row else []
-            hist = cell(row, idx['hist'])
-            fio_val = cell(row, idx['fio'])
-            dob_raw = row[idx['dob']] if idx['dob'] is not None and idx['dob'] < len(row) else ''
-            dob = parse_date(dob_raw)
-
-            if not (hist and fio_val and dob):
+    return values
+
+def _date_converter(sample):
+    if sample and all(type(v) is datetime for v in sample):
+        return _excel_date
+    texts = [v.strip() for v in sample if type(v) is str]
+    if texts and len(texts) == len(sample):
+        if all(_DMY_TEXT.fullmatch(s) for s in texts):
+            return _text_date_converter(_DMY_TEXT, (1, 2, 3))
+        if all(_ISO_TEXT.fullmatch(s) for s in texts):
+            return _text_date_converter(_ISO_TEXT, (3, 2, 1))
+    return parse_date
+
+def compile_import_converters(idx, batch):
+    """key -> converter for every detected column, chosen by header (text / date / time) and, for dates
+    and times, by sampling the column in the first batch: Excel datetimes, dd.mm.yyyy or yyyy-mm-dd text."""
+    converters = {}
+    for key in IMPORT_TEXT_KEYS + IMPORT_DATE_KEYS + IMPORT_TIME_KEYS:
+        i = idx.get(key)
+        if i is None:
+            continue
+        if key in IMPORT_DATE_KEYS:
+            converters[key] = _date_converter(_sample(batch, i))
+        elif key in IMPORT_TIME_KEYS:
+            converters[key] = _excel_time
+        else:
+            converters[key] = _text_cell
+    return converters
+
+def _memo_valid(parse):
+    """parse(value) is not None, remembered per value: dates repeat across the rows of one import."""
+    cache = {}
+
+    def valid(value):
+        try:
+            return cache[value]
+        except KeyError:
+            ok = cache[value] = parse(value) is not None
+            return ok
+    return valid
+
+def _convert_columns(batch, idx, converters):
+    """key -> converted values of that column for every row of the batch ('' for absent columns)."""
+    columns = {key: [''] * len(batch) for key in IMPORT_TEXT_KEYS + IMPORT_DATE_KEYS + IMPORT_TIME_KEYS}
+    for key, convert in converters.items():
+        i = idx[key]
+        columns[key] = list(map(convert, [row[i] if i < len(row) else None for row in batch]))
+    return columns
+
+def iter_import_rows(ws, header_row_idx, idx, ward_by_name, doctor_by_name):
+    """Convert sheet rows to Patient field dicts without touching the DB.
+
+    Rows are read IMPORT_BATCH at a time and converted column by column with the converters
+    compiled for the sheet. Yields (row number, fields or None if the row is skipped, problems)
+    where problems are short messages; a skipped row has at least one.
+    """
+    fallback_ward = next(iter(ward_by_name.values()), None)
+    fallback_doctor = next(iter(doctor_by_name.values()), None)
+    arrival_ok, discharge_ok = _memo_valid(_parse_dt), _memo_valid(_parse_discharge_dt)
+    rows = ws.iter_rows(min_row=header_row_idx+1, values_only=True)
+    converters = None
+    row_no = header_row_idx
+
+    while True:
+        batch = [tuple(row) if row else () for row in islice(rows, IMPORT_BATCH)]
+        if not batch:
+            return
+        if converters is None:
+            converters = compile_import_converters(idx, batch)
+        cols = _convert_columns(batch, idx, converters)
+
+        for j, row in enumerate(batch):
+            row_no += 1
+            if not any(v not in (None, '') for v in row):
+                continue  # blank line
+            problems = []
+            hist, fio_val, dob = cols['hist'][j], cols['fio'][j], cols['dob'][j]
+
+            if not hist: problems.append('missing history no.')
+            if not fio_val: problems.append('missing full name')
+            if not dob: problems.append('missing birth date')
+            if problems:
+                yield row_no, None, problems
                 continue
 
             last, first, pat = parse_fio(fio_val)
             if not (last and first):
-                continue  # need at least lastname + firstname
-
-            addr  = cell(row, idx['address'])
-            phone = cell(row, idx['phone'])
-            occ   = cell(row, idx['occ'])
-
-            ad = parse_date(row[idx['arr_date']]) if idx.get('arr_date') is not None and idx['arr_date'] < len(row) else ''
-            at = parse_time(row[idx['arr_time']]) if idx.get('arr_time') is not None and idx['arr_time'] < len(row) else ''
+                yield row_no, None, ['full name needs at least last and first name']
+                continue
 
-            dd = parse_date(row[idx['disc_date']]) if idx.get('disc_date') is not None and idx['disc_date'] < len(row) else ''
-            dt = parse_time(row[idx['disc_time']]) if idx.get('disc_time') is not None and idx['disc_time'] < len(row) else ''
+            ad, at = cols['arr_date'][j], cols['arr_time'][j]
+            dd, dt = cols['disc_date'][j], cols['disc_time'][j]
             discharge_dt = f"{dd} {dt}".strip() if (dd or dt) else ''
 
-            ward_name = cell(row, idx['ward'])
-            doc_name  = cell(row, idx['doctor'])
-            care_val  = cell(row, idx['caregiver'])
-            cg_norm = norm(care_val)
-            caregiver_exists = cg_norm in ('да','ha','yes','1','true','bor')
-
-            # resolve ward / doctor
-            ward_id = ward_by_name.get(ward_name).id if ward_name in ward_by_name else (Ward.query.first().id if Ward.query.first() else None)
-            doctor_id = doctor_by_name.get(doc_name).id if doc_name in doctor_by_name else (Doctor.query.first().id if Doctor.query.first() else None)
-
-            p = Patient(
+            if not _parse_ddmmyyyy(dob): problems.append(f'birth date not dd.mm.yyyy: {dob}')
+            if not ad: problems.append('missing arrival date')
+            elif not arrival_ok(ad): problems.append(f'arrival date not dd.mm.yyyy: {ad}')
+            if discharge_dt and not discharge_ok(discharge_dt):
+                problems.append(f'discharge not dd.mm.yyyy HH:MM: {discharge_dt}')
+
+            ward_name, doc_name = cols['ward'][j], cols['doctor'][j]
+            # resolve ward / doctor (unknown names fall back to the first one)
+            ward = ward_by_name.get(ward_name)
+            if not ward:
+                ward = fallback_ward
+                problems.append(f'ward "{ward_name}" not found, using {ward.name if ward else "none"}')
+            doctor = doctor_by_name.get(doc_name)
+            if not doctor:
+                doctor = fallback_doctor
+                problems.append(f'doctor "{doc_name}" not found, using {doctor.full_name if doctor else "none"}')
+
+            caregiver_exists = _imp_norm(cols['caregiver'][j]) in ('да','ha','yes','1','true','bor')
+
+            yield row_no, dict(
                 hist_number=hist,
                 last_name=last,
                 first_name=first,
                 patronymic=pat,
                 birth_date=dob,
-                phone=phone,
-                address=addr,
-                occupation=occ,
+                phone=cols['phone'][j],
+                address=cols['address'][j],
+                occupation=cols['occ'][j],
                 arrival_date=ad,
                 arrival_time=at,
-                ward_id=ward_id,
-                doctor_id=doctor_id,
+                ward_id=ward.id if ward else None,
+                doctor_id=doctor.id if doctor else None,
                 caregiver_exists=caregiver_exists,
                 discharge_datetime=discharge_dt or None
-            )
-            db.session.add(p)
-            imported += 1
+            ), problems
+
+def read_import_header(ws):
+    """(header row number, column index) of an import sheet; ValueError if required columns are missing."""
+    header_row_idx, headers = find_header_row(ws)
+    idx = match_columns(headers, IMPORT_ALIASES)
+    # Required: history no (we map "Тартиб Раками") + DOB + FIO
+    missing = [label for key, label in IMPORT_REQUIRED.items() if idx.get(key) is None]
+    if missing:
+        raise ValueError('Missing required columns: ' + ', '.join(missing))
+    return header_row_idx, idx
+
+def import_lookups():
+    """Ward / doctor names already in the DB -> plain (picklable) id/name records; the first by id is
+    the fallback for unknown names."""
+    ward_by_name = {name.strip(): SimpleNamespace(id=id_, name=name)
+                    for id_, name in db.session.query(Ward.id, Ward.name).order_by(Ward.id)}
+    doctor_by_name = {name.strip(): SimpleNamespace(id=id_, full_name=name)
+                      for id_, name in db.session.query(Doctor.id, Doctor.full_name).order_by(Doctor.id)}
+    return ward_by_name, doctor_by_name
+
+def _stage_import_file(stream, folder, stamp, n, name):
+    path = os.path.join(folder, f"import_{stamp}_{n}_{secure_filename(name) or 'file.xlsx'}")
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(stream, out, 1 << 20)
+    return path
+
+def stage_import_files(uploads, folder, stamp):
+    """Save uploaded .xlsx files, and the .xlsx members of uploaded .zip files, into folder.
+
+    uploads: (file name, binary stream) pairs. Returns [(path, label)] in upload order;
+    ValueError for any other file type or a broken zip.
+    """
+    staged = []
+    for name, stream in uploads:
+        lower = name.lower()
+        if lower.endswith('.xlsx'):
+            staged.append((_stage_import_file(stream, folder, stamp, len(staged), name), name))
+        elif lower.endswith('.zip'):
+            try:
+                with zipfile.ZipFile(stream) as zf:
+                    for member in zf.infolist():
+                        base = posixpath.basename(member.filename)
+                        if member.is_dir() or not base.lower().endswith('.xlsx') or base.startswith(('~$', '._')):
+                            continue  # folders, other files, Excel lock files, macOS resource forks
+                        with zf.open(member) as src:
+                            staged.append((_stage_import_file(src, folder, stamp, len(staged), base),
+                                           f"{name}/{member.filename}"))
+            except zipfile.BadZipFile:
+                raise ValueError(f'{name}: not a valid .zip file') from None
+        else:
+            raise ValueError(f'{name}: please upload .xlsx files (Excel 2007+) or a .zip of them.')
+    return staged
+
+def parse_import_file(path, label, ward_by_name, doctor_by_name):
+    """Parse every import sheet of one .xlsx; runs in a worker process (no DB access).
+
+    Returns [(source, rows, error)] per sheet: rows as yielded by iter_import_rows(),
+    error a message when the file or sheet could not be read (rows is then empty).
+    """
+    try:
+        wb = load_workbook(path, data_only=True, read_only=True)
+    except Exception as e:
+        return [(label, [], f'Could not read Excel: {e}')]
+    results = []
+    try:
+        sheets = import_sheets(wb)
+        for ws in sheets:
+            source = f"{label} [{ws.title}]" if len(sheets) > 1 else label
+            try:
+                header_row_idx, idx = read_import_header(ws)
+            except ValueError as e:
+                results.append((source, [], str(e)))
+                continue
+            results.append((source, list(iter_import_rows(ws, header_row_idx, idx, ward_by_name, doctor_by_name)), None))
+    finally:
+        wb.close()
+    return results
+
+def parse_import_files(staged):
+    """Yield, per staged [(path, label)] file in order, its [(source, rows, error)] as returned by
+    parse_import_file().
+
+    Files are parsed in a process pool (IMPORT_WORKERS processes) so several workbooks use several
+    cores; the caller stays the single writer. A single file is parsed in-process.
+    """
+    ward_by_name, doctor_by_name = import_lookups()
+    workers = min(len(staged), app.config['IMPORT_WORKERS'])
+    if workers <= 1:
+        for path, label in staged:
+            yield parse_import_file(path, label, ward_by_name, doctor_by_name)
+        return
+    # spawn: workers start clean instead of forking the DB connections and background threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(parse_import_file, path, label, ward_by_name, doctor_by_name)
+                   for path, label in staged]
+        for future in futures:
+            yield future.result()
+
+def save_imported_patients(rows):
+    """Insert Patient field dicts in one transaction, with audit entries and the occupancy index / stats
+    kept in step. Returns (inserted count, how many look like already known persons)."""
+    new_rows = [Patient(**fields) for fields in rows]
+    duplicates = count_duplicate_candidates(
+        [(p.last_name, p.first_name, p.patronymic, p.birth_date) for p in new_rows])
+    db.session.add_all(new_rows)
+    db.session.flush()
+    ids = [p.id for p in new_rows]
+    audit_patients('create', {}, audit_snapshot(ids))
+    _patients_changed(ids)
+    db.session.commit()
+    return len(ids), duplicates
+
+def import_dry_run_report(results):
+    """Report on parsed sheets without writing; returns (summary dict, report Workbook).
+
+    results: (source, rows, error) per sheet, as returned by parse_import_file().
+    """
+    wb = Workbook(write_only=True)
+    rows_ws = wb.create_sheet('Rows')
+    rows_ws.append(['Source', 'Row', 'History No.', 'Full name', 'Status', 'Problems'])
+    summary = {'sheets': 0, 'rows': 0, 'would_import': 0, 'skipped': 0, 'with_warnings': 0}
+    kinds = {}
+    for source, row_no, fields, problems in ((src, *row) for src, rows, _ in results for row in rows):
+        summary['rows'] += 1
+        if fields is None:
+            summary['skipped'] += 1
+        else:
+            summary['would_import'] += 1
+            if problems:
+                summary['with_warnings'] += 1
+        for p in problems:
+            kind = re.sub(r'"[^"]*"\s*', '', p.split(':')[0].split(',')[0]).strip()
+            kinds[kind] = kinds.get(kind, 0) + 1
+        if problems:
+            name = ' '.join(filter(None, [fields['last_name'], fields['first_name'], fields['patronymic']])) \
+                if fields else ''
+            rows_ws.append([source, row_no, fields['hist_number'] if fields else '', name,
+                            'skipped' if fields is None else 'warning', '; '.join(problems)])
+
+    summary_ws = wb.create_sheet('Summary', 0)
+    summary['sheets'] = len(results)
+    for key in ('sheets', 'rows', 'would_import', 'skipped', 'with_warnings'):
+        summary_ws.append([key, summary[key]])
+    summary_ws.append([])
+    for kind, n in sorted(kinds.items(), key=lambda kv: -kv[1]):
+        summary_ws.append([kind, n])
+    return summary, wb
 
-        db.session.commit()
-        flash(f'Imported {imported} patients', 'success')
+@app.route('/settings/import', methods=['GET', 'POST'])
+@superadmin_required
+def settings_import():
+    def flash_back(msg, cat='danger'):
+        flash(msg, cat)
         return redirect(url_for('settings_import'))
 
-    # GET
-    return render_template('settings_import.html', t=t)
+    # --- main ---------------------------------------------------------------
+    if request.method == 'POST':
+        files = [f for f in request.files.getlist('file') if f and f.filename.strip()]
+        if not files:
+            return flash_back('No file selected')
 
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        ts = datetime.now().strftime('%Y%m%d_%H%M%S')
+        try:
+            staged = stage_import_files([(f.filename, f.stream) for f in files], app.config['UPLOAD_FOLDER'], ts)
+        except ValueError as e:
+            return flash_back(str(e))
+        if not staged:
+            return flash_back('No .xlsx files found in the upload.')
+
+        results, skipped, errors = [], [], []
+        for sheets in parse_import_files(staged):
+            readable = [r for r in sheets if not r[2]]
+            problems = [f'{source}: {error}' for source, _, error in sheets if error]
+            # a sheet without the import columns (e.g. a summary) is skipped; a file without any fails the upload
+            (skipped if readable else errors).extend(problems)
+            results += readable
+        if errors:
+            for message in errors[:-1]:
+                flash(message, 'danger')
+            return flash_back(errors[-1])
+        for message in skipped:
+            flash(f'Skipped {message}', 'warning')
+
+        if request.form.get('dry_run'):
+            summary, report = import_dry_run_report(results)
+            out_path = os.path.join(app.config['UPLOAD_FOLDER'], f"import_check_{ts}.xlsx")
+            report.save(out_path)
+            return send_file(out_path, as_attachment=True, download_name='import_check.xlsx')
+
+        # one writer, one transaction for everything that was uploaded together
+        rows = [fields for _, sheet_rows, _ in results for _, fields, _ in sheet_rows if fields]
+        imported, duplicates = save_imported_patients(rows)
+        flash(f'Imported {imported} patients from {len(results)} sheet(s)', 'success')
+        if duplicates:
+            flash(t('n_possible_duplicates').format(duplicates), 'warning')
+        return redirect(url_for('settings_import'))
 
+    # GET
+    return render_template('settings_import.html')
 
 
 # ----------------- Import template (Sample) ----------------
@@ -1246,20 +2750,531 @@ def settings_import_template():
     return send_file(out_path, as_attachment=True, download_name='import_template.xlsx')
 
 
+# -------------------- JSON API (v1) --------------------
+
+API_PAGE_LIMIT = 500
+API_MAX_LIMIT = 2000
+API_STREAM_BATCH = 500
+API_BULK_MAX = 5000
+
+def api_login_required(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify(error='unauthorized'), 401
+        return f(*args, **kwargs)
+    return wrapper
+
+def _patient_json(p):
+    return {
+        'id': p.id,
+        'hist_number': p.hist_number,
+        'last_name': p.last_name,
+        'first_name': p.first_name,
+        'patronymic': p.patronymic,
+        'birth_date': p.birth_date,
+        'phone': p.phone,
+        'address': p.address,
+        'occupation': p.occupation,
+        'arrival_date': p.arrival_date,
+        'arrival_time': p.arrival_time,
+        'ward_id': p.ward_id,
+        'doctor_id': p.doctor_id,
+        'caregiver_exists': bool(p.caregiver_exists),
+        'caregiver_fullname': p.caregiver_fullname,
+        'caregiver_ward_id': p.caregiver_ward_id,
+        'caregiver_arrival_date': p.caregiver_arrival_date,
+        'caregiver_departure_date': p.caregiver_departure_date,
+        'discharge_datetime': p.discharge_datetime,
+    }
+
+@app.route('/api/v1/patients')
+@api_login_required
+def api_patients():
+    """Patients newest first, same filters as /patients.
+
+    Keyset pagination: pass ?after=<id> (the previous page's next_after).
+    ?format=ndjson streams every matching row, one JSON object per line.
+    """
+    query = _filter_patients(_scope_patients(Patient.query), _patient_search_args(request.args)) \
+        .order_by(Patient.id.desc())
+    try:
+        after = int(request.args.get('after') or 0)
+        limit = int(request.args.get('limit') or API_PAGE_LIMIT)
+    except ValueError:
+        return jsonify(error='after and limit must be integers'), 400
+    if after:
+        query = query.filter(Patient.id < after)
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for p in query.yield_per(API_STREAM_BATCH):
+                yield json.dumps(_patient_json(p), ensure_ascii=False) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = max(1, min(limit, API_MAX_LIMIT))
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify(items=[_patient_json(p) for p in rows],
+                   next_after=rows[-1].id if has_more else None)
+
+@app.route('/api/v1/occupancy')
+@api_login_required
+def api_occupancy():
+    """Ward occupancy snapshot, the same data as /inpatient (?at=dd.mm.yyyy HH:MM)."""
+    at_str = (request.args.get('at') or '').strip()
+    at_dt = _parse_at(at_str) if at_str else datetime.now()
+    if not at_dt:
+        return jsonify(error='at must be dd.mm.yyyy HH:MM'), 400
+
+    wards = _scope_wards(Ward.query).order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
+    ward_patients = _ward_occupancy(at_dt, wards)
+    blocks = _group_wards_by_block(wards)
+    return jsonify(
+        at=at_dt.strftime("%d.%m.%Y %H:%M"),
+        blocks={b: [{'ward_id': w.id, 'name': w.name, 'occupants': ward_patients.get(w.id, [])}
+                    for w in blocks[b]]
+                for b in BLOCKS_ORDER},
+    )
+
+@app.route('/api/v1/patients/bulk', methods=['POST'])
+@api_login_required
+def api_patients_bulk():
+    """Create many patients in one transaction: all rows are valid and saved, or none are."""
+    payload = request.get_json(silent=True)
+    items = payload.get('patients') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify(error='expected a non-empty JSON list of patients'), 400
+    if len(items) > API_BULK_MAX:
+        return jsonify(error=f'at most {API_BULK_MAX} patients per request'), 413
+
+    ward_ids = {wid for (wid,) in _scope_wards(db.session.query(Ward.id))}
+    doctor_ids = {did for (did,) in db.session.query(Doctor.id)}
+
+    errors = []
+    new_rows = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': i, 'error': 'not an object'})
+            continue
+        missing = [f for f in PATIENT_REQUIRED_FIELDS if item.get(f) in (None, '')]
+        if missing:
+            errors.append({'index': i, 'error': 'missing fields', 'fields': missing})
+            continue
+        try:
+            p = _patient_from_data(item)
+        except (TypeError, ValueError):
+            errors.append({'index': i, 'error': 'ward_id, doctor_id and caregiver_ward_id must be integers'})
+            continue
+        if p.ward_id not in ward_ids or p.doctor_id not in doctor_ids or \
+                (p.caregiver_ward_id is not None and p.caregiver_ward_id not in ward_ids):
+            errors.append({'index': i, 'error': 'unknown ward or doctor'})
+            continue
+        new_rows.append(p)
+
+    if errors:
+        return jsonify(error='validation failed', errors=errors), 400
+
+    db.session.add_all(new_rows)
+    db.session.flush()
+    ids = [p.id for p in new_rows]
+    audit_patients('create', {}, audit_snapshot(ids))
+    _patients_changed(ids)
+    db.session.commit()
+    return jsonify(created=len(ids), ids=ids), 201
+
+
+# -------------------- Maintenance CLI (flask data ...) --------------------
+
+data_cli = AppGroup('data', help='Bulk data maintenance, run outside the web workers.')
+app.cli.add_command(data_cli)
+
+SEED_BATCH = 1000
+SEED_LAST_NAMES = ['Karimov', 'Rahimov', 'Tursunov', 'Aliyev', 'Saidov', 'Yusupov', 'Ergashev', 'Nazarov',
+                   'Qodirov', 'Ismoilov', 'Xolmatov', 'Abdullayev', 'Ivanov', 'Petrov', 'Sobirov', 'Jurayev']
+SEED_FIRST_NAMES = ['Javohir', 'Dilshod', 'Aziz', 'Sardor', 'Bekzod', 'Shahzod', 'Otabek', 'Jasur',
+                    'Malika', 'Dilnoza', 'Gulnora', 'Nodira', 'Zarina', 'Madina', 'Sevara', 'Kamola']
+SEED_PATRONYMICS = ['Alisherovich', 'Rustamovich', 'Bahodirovich', 'Karimovich', 'Anvarovich',
+                    'Alisherovna', 'Rustamovna', 'Bahodirovna', 'Karimovna', 'Anvarovna']
+SEED_OCCUPATIONS = ['Teacher', 'Driver', 'Farmer', 'Engineer', 'Pensioner', 'Student', 'Builder', 'Nurse']
+
+def _seed_patient(rnd, n, wards, doctors, now, days):
+    arrival = now - timedelta(minutes=rnd.randrange(days * 24 * 60))
+    stay = timedelta(days=rnd.randint(1, 20), minutes=rnd.randrange(24 * 60))
+    discharge = arrival + stay if arrival + stay < now else None
+    ward = rnd.choice(wards)
+    caregiver = rnd.random() < 0.3
+    birth = date(rnd.randint(1940, 2020), rnd.randint(1, 12), rnd.randint(1, 28))
+    return dict(
+        hist_number=f"S{n}",
+        last_name=rnd.choice(SEED_LAST_NAMES),
+        first_name=rnd.choice(SEED_FIRST_NAMES),
+        patronymic=rnd.choice(SEED_PATRONYMICS),
+        birth_date=birth.strftime('%d.%m.%Y'),
+        phone=f"+99890{rnd.randrange(10**7):07d}",
+        address='Qarshi',
+        occupation=rnd.choice(SEED_OCCUPATIONS),
+        arrival_date=arrival.strftime('%d.%m.%Y'),
+        arrival_time=arrival.strftime('%H:%M'),
+        ward_id=ward.id,
+        doctor_id=rnd.choice(doctors).id,
+        caregiver_exists=caregiver,
+        caregiver_fullname=f"{rnd.choice(SEED_LAST_NAMES)} {rnd.choice(SEED_FIRST_NAMES)}" if caregiver else None,
+        caregiver_ward_id=ward.id if caregiver else None,
+        caregiver_arrival_date=arrival.strftime('%d.%m.%Y') if caregiver else None,
+        caregiver_departure_date=discharge.strftime('%d.%m.%Y') if caregiver and discharge else None,
+        discharge_datetime=discharge.strftime('%d.%m.%Y %H:%M') if discharge else None,
+    )
+
+@data_cli.command('seed')
+@click.option('--patients', 'count', type=int, default=1000, show_default=True, help='How many patients to add.')
+@click.option('--days', type=int, default=365, show_default=True, help='Spread arrivals over the last N days.')
+@click.option('--seed', type=int, default=None, help='Random seed, for repeatable data sets.')
+@click.option('--batch', type=int, default=SEED_BATCH, show_default=True, help='Patients per transaction.')
+def seed_command(count, days, seed, batch):
+    """Add synthetic patients (load testing, demos) through the same write path as an import."""
+    init_db()
+    rnd = random.Random(seed)
+    wards = Ward.query.order_by(Ward.id).all()
+    doctors = Doctor.query.order_by(Doctor.id).all()
+    start = (db.session.query(func.max(Patient.id)).scalar() or 0) + 1
+    now = datetime.now().replace(second=0, microsecond=0)
+    with click.progressbar(length=count, label='Seeding patients') as bar:
+        for offset in range(0, count, batch):
+            size = min(batch, count - offset)
+            save_imported_patients([_seed_patient(rnd, start + offset + i, wards, doctors, now, days)
+                                    for i in range(size)])
+            bar.update(size)
+    flush_audit()
+    click.echo(f"Added {count} patients.")
+
+@data_cli.command('import')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Only validate; write a report workbook instead.')
+@click.option('--report', type=click.Path(dir_okay=False), default=None,
+              help='Dry-run report path (default: <first file>.check.xlsx).')
+@click.option('--batch', type=int, default=SEED_BATCH, show_default=True, help='Rows per transaction.')
+def import_command(paths, dry_run, report, batch):
+    """Import patients from .xlsx files (or .zip files of them), with the same parsing as Settings -> Import.
+
+    Files are parsed in parallel (IMPORT_WORKERS); rows are written here, in file order.
+    """
+    init_db()
+    with tempfile.TemporaryDirectory(prefix='import-') as tmp:
+        staged = []
+        for path in paths:
+            if path.lower().endswith('.zip'):
+                try:
+                    with open(path, 'rb') as fh:
+                        staged += stage_import_files([(os.path.basename(path), fh)], tmp, len(staged))
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+            elif path.lower().endswith('.xlsx'):
+                staged.append((path, path))
+            else:
+                raise click.ClickException(f'{path}: expected an .xlsx or .zip file')
+        if not staged:
+            raise click.ClickException('No .xlsx files to import.')
+
+        results = (sheet for sheets in parse_import_files(staged) for sheet in sheets)
+        if dry_run:
+            summary, report_wb = import_dry_run_report(list(results))
+            report = report or os.path.splitext(paths[0])[0] + '.check.xlsx'
+            report_wb.save(report)
+            click.echo(' '.join(f"{k}={v}" for k, v in summary.items()) + f" (report: {report})")
+            return
+        imported = skipped = duplicates = sheets = 0
+        failed = []
+        pending = []
+
+        def save():
+            nonlocal imported, duplicates
+            n, d = save_imported_patients(pending)
+            imported, duplicates = imported + n, duplicates + d
+            pending.clear()
+
+        with click.progressbar(results, label='Importing sheets', item_show_func=lambda r: r and r[0]) as bar:
+            for source, rows, error in bar:
+                if error:
+                    failed.append(f'{source}: {error}')
+                    continue
+                sheets += 1
+                for row_no, fields, problems in rows:
+                    if fields is None:
+                        skipped += 1
+                        continue
+                    pending.append(fields)
+                    if len(pending) >= batch:
+                        save()
+            if pending:
+                save()
+    flush_audit()
+    for message in failed:
+        click.echo(f'Skipped {message}', err=True)
+    click.echo(f"Imported {imported} patients from {sheets} sheet(s), skipped {skipped} rows, "
+               f"{duplicates} possible duplicates.")
+
+@data_cli.command('export')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--archive', is_flag=True, help='Export the archive instead of current patients.')
+@click.option('--lang', type=click.Choice(list(CATALOGS)), default=DEFAULT_LANG, show_default=True, help='Header language.')
+@click.option('--q-hist', default='', help='History number starts with.')
+@click.option('--q-last', default='', help='Last name starts with.')
+@click.option('--q-first', default='', help='First name starts with.')
+@click.option('--q-pat', default='', help='Patronymic starts with.')
+def export_command(path, archive, lang, **filters):
+    """Export patients to .xlsx with the same columns and filters as the Patients page (all wards)."""
+    init_db()
+    model = PatientArchive if archive else Patient
+    query = _filter_patients(model.query, filters, model)
+    with app.test_request_context():
+        session['lang'] = lang  # t() reads the language from the session
+        with click.progressbar(length=query.count(), label='Exporting rows') as bar:
+            wb = patients_export_workbook(query, model, progress=bar.update)
+            bar.update(bar.length - bar.pos)
+        wb.save(path)
+    click.echo(f"Wrote {path}.")
+
+@data_cli.command('delete')
+@click.option('--all', 'delete_all', is_flag=True, help='Delete every patient (not combined with filters).')
+@click.option('--arrived-before', default=None, help='Arrival before dd.mm.yyyy.')
+@click.option('--discharged-before', default=None, help='Discharged before dd.mm.yyyy.')
+@click.option('--ward', 'wards', multiple=True, help='Ward name (repeatable).')
+@click.option('--doctor', 'doctors', multiple=True, help='Doctor full name (repeatable).')
+@click.option('--hist', default=None, help='History number starts with.')
+@click.option('--invalid', is_flag=True, help='Only patients with missing required fields.')
+@click.option('--chunk', type=int, default=DELETE_CHUNK_SIZE, show_default=True, help='Patients per transaction.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def delete_command(delete_all, arrived_before, discharged_before, wards, doctors, hist, invalid, chunk, yes):
+    """Delete patients matching all given filters, in committed chunks (audited like the web delete)."""
+    init_db()
+    criteria = []
+    for value, column in ((arrived_before, Stay.start_at), (discharged_before, Stay.end_at)):
+        if value:
+            parsed = _parse_ddmmyyyy(value)
+            if not parsed:
+                raise click.BadParameter(f'{value} is not dd.mm.yyyy')
+            criteria.append(Patient.id.in_(db.select(Stay.patient_id)
+                                           .where(Stay.kind == 'P', column < datetime(*parsed))))
+    if wards:
+        criteria.append(Patient.ward_id.in_(db.select(Ward.id).where(Ward.name.in_(wards))))
+    if doctors:
+        criteria.append(Patient.doctor_id.in_(db.select(Doctor.id).where(Doctor.full_name.in_(doctors))))
+    if hist:
+        criteria.append(Patient.hist_number.like(f"{hist}%"))
+    if invalid:
+        criteria.append(or_(*[cond for _, cond in _missing_field_checks()]))
+    if not criteria and not delete_all:
+        raise click.UsageError('Give at least one filter, or --all.')
+    if criteria and delete_all:
+        raise click.UsageError('--all deletes every patient; it cannot be combined with filters.')
+    total = Patient.query.filter(*criteria).count()
+    if not total:
+        click.echo('No matching patients.')
+        return
+    if not yes:
+        click.confirm(f'Delete {total} patients?', abort=True)
+    with click.progressbar(length=total, label='Deleting patients') as bar:
+        # occupancy index, rollups and persons are kept in step per chunk
+        deleted = _delete_patients_chunked(criteria, chunk, progress=bar.update)
+    flush_audit()
+    click.echo(f"Deleted {deleted} patients.")
+
+@data_cli.command('vacuum')
+@click.option('--reindex/--no-reindex', default=True, show_default=True, help='Rebuild every index first.')
+@click.option('--vacuum/--no-vacuum', 'full', default=True, show_default=True,
+              help='Rewrite the file to reclaim free pages (needs free disk about the size of the database).')
+def vacuum_command(reindex, full):
+    """REINDEX, ANALYZE and VACUUM the database, with timings."""
+    init_db()
+    path = _database_path()
+    size = os.path.getsize(path)
+    steps = (['REINDEX'] if reindex else []) + ['ANALYZE'] + (['VACUUM'] if full else []) + ['PRAGMA optimize']
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for sql in steps:
+            started = perf_counter()
+            conn.exec_driver_sql(sql)
+            click.echo(f"{sql}: {perf_counter() - started:.2f}s")
+    click.echo(f"Database size {size} -> {os.path.getsize(path)} bytes.")
+
+@data_cli.command('purge-uploads')
+@click.option('--days', type=int, default=None, help='Delete files older than N days (UPLOAD_RETENTION_DAYS).')
+@click.option('--dry-run', is_flag=True, help='Only list the files.')
+def purge_uploads_command(days, dry_run):
+    """Delete old uploaded imports, exports and reports from the uploads folder."""
+    days = app.config['UPLOAD_RETENTION_DAYS'] if days is None else days
+    cutoff = datetime.now().timestamp() - days * 86400
+    folder = app.config['UPLOAD_FOLDER']
+    count = size = 0
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            count += 1
+            size += entry.stat().st_size
+            if dry_run:
+                click.echo(entry.name)
+            else:
+                os.remove(entry.path)
+    click.echo(f"{'Would delete' if dry_run else 'Deleted'} {count} files ({size} bytes) older than {days} days.")
+
+# -------------------- Response compression & fragment cache --------------------
+
+COMPRESS_MIMETYPES = {'text/html', 'application/json', 'text/css', 'application/javascript', 'text/plain'}
+COMPRESS_MIN_SIZE = 500
+FRAGMENT_CACHE_SIZE = 20000
+
+_fragments = OrderedDict()
+_fragments_version = None
+_fragments_lock = threading.Lock()
+
+def bump_data_version():
+    """Invalidate cached fragments; call in the transaction that changes patients, wards or doctors."""
+    db.session.execute(update(AppState).where(AppState.key == 'data_version').values(value=AppState.value + 1))
+
+def data_version():
+    if 'data_version' not in g:
+        g.data_version = db.session.query(AppState.value).filter(AppState.key == 'data_version').scalar() or 0
+    return g.data_version
+
+def cached_fragment(*key, caller):
+    """{% call cached_fragment(name, ...) %}markup{% endcall %}: render the markup once per data version
+    and language, LRU-bounded. The key must name everything else the markup depends on."""
+    return cached_render(key, caller)
+
+def cached_render(key, render):
+    """render() once per key, data version and language (see cached_fragment)."""
+    global _fragments_version
+    version = data_version()
+    full_key = (key, get_lang())
+    with _fragments_lock:
+        if _fragments_version != version:
+            _fragments.clear()
+            _fragments_version = version
+        html = _fragments.get(full_key)
+        if html is not None:
+            _fragments.move_to_end(full_key)
+            return html
+    html = Markup(render())
+    with _fragments_lock:
+        if _fragments_version == version:
+            _fragments[full_key] = html
+            while len(_fragments) > FRAGMENT_CACHE_SIZE:
+                _fragments.popitem(last=False)
+    return html
+
+@app.after_request
+def compress_response(response):
+    """Brotli (if installed) or gzip for buffered text responses; files and streams pass through."""
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# -------------------- Static assets (bundled, fingerprinted) --------------------
+
+# Vendored libraries (static/vendor) and our own files, concatenated in this order
+ASSET_BUNDLES = {
+    'app.css': ('text/css', ['vendor/bootstrap/bootstrap.min.css', 'vendor/bootstrap-icons/bootstrap-icons.min.css',
+                             'vendor/flatpickr/flatpickr.min.css', 'css/style.css']),
+    'app.js': ('application/javascript', ['vendor/bootstrap/popper.min.js', 'vendor/bootstrap/bootstrap.min.js',
+                                          'vendor/flatpickr/flatpickr.min.js', 'js/app.js']),
+}
+ASSET_MAX_AGE = 365 * 24 * 3600  # names change with the content, so browsers may keep them for a year
+_CSS_URL = re.compile(r'url\((["\']?)([^"\')]+)\1\)')
+_SOURCE_MAP = re.compile(r'^[ \t]*(//|/\*)# sourceMappingURL=.*$', re.M)
+
+_assets = None
+
+def _fingerprint(name, body):
+    stem, _, ext = name.rpartition('.')
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}.{ext}"
+
+def _register_static_asset(assets, path):
+    """Fingerprinted name of one file under static/, served from disk."""
+    if path not in assets['names']:
+        with open(os.path.join(app.static_folder, path), 'rb') as fh:
+            hashed = _fingerprint(path, fh.read())
+        assets['names'][path] = hashed
+        assets['files'][hashed] = {'path': path}
+    return assets['names'][path]
+
+def _build_assets():
+    """Concatenate ASSET_BUNDLES in memory; url(...) references in CSS are rewritten to
+    fingerprinted files so fonts are cached for good as well."""
+    assets = {'names': {}, 'files': {}}
+    for bundle, (mimetype, sources) in ASSET_BUNDLES.items():
+        parts = []
+        for src in sources:
+            with open(os.path.join(app.static_folder, src), encoding='utf-8') as fh:
+                text = _SOURCE_MAP.sub('', fh.read())
+            if mimetype == 'text/css':
+                base = posixpath.dirname(src)
+
+                def fix_url(m):
+                    url = m.group(2)
+                    if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+                        return m.group(0)
+                    target = posixpath.normpath(posixpath.join(base, url.split('?')[0].split('#')[0]))
+                    return f'url("{_register_static_asset(assets, target)}")'
+
+                text = _CSS_URL.sub(fix_url, text)
+            parts.append(text)
+        body = ('\n;\n' if mimetype == 'application/javascript' else '\n').join(parts).encode('utf-8')
+        hashed = _fingerprint(bundle, body)
+        assets['names'][bundle] = hashed
+        assets['files'][hashed] = {'mimetype': mimetype, 'body': body, 'gzip': gzip.compress(body, 9)}
+    return assets
+
+def _get_assets():
+    global _assets
+    if _assets is None or app.debug:  # rebuilt on every request while developing
+        _assets = _build_assets()
+    return _assets
+
+def asset_url(name):
+    """URL of a bundle ('app.css', 'app.js') or of any file under static/, with a content hash in the name."""
+    assets = _get_assets()
+    hashed = assets['names'].get(name) or _register_static_asset(assets, name)
+    return url_for('asset', filename=hashed)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    entry = _get_assets()['files'].get(filename)
+    if entry is None:
+        abort(404)
+    if 'path' in entry:
+        response = send_from_directory(app.static_folder, entry['path'], max_age=ASSET_MAX_AGE)
+    elif request.accept_encodings['gzip']:
+        response = Response(entry['gzip'], mimetype=entry['mimetype'])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(entry['body'], mimetype=entry['mimetype'])
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
 # -------------------- Utilities in templates --------------------
 
 @app.context_processor
 def inject_utilities():
     # Provide t(), lang, and role flag globally to templates
-    user_id = session.get('user_id')
-    is_superadmin = False
-    if user_id is not None:
-        try:
-            u = User.query.get(user_id)
-            is_superadmin = bool(u and u.role == 'superadmin')
-        except Exception:
-            is_superadmin = False
-    return dict(t=t, lang=get_lang(), is_superadmin=is_superadmin)
+    try:
+        u = current_user()
+        is_superadmin = bool(u and u.role == 'superadmin')
+    except Exception:
+        is_superadmin = False
+    return dict(t=translator(), lang=get_lang(), is_superadmin=is_superadmin, cached_fragment=cached_fragment,
+                asset_url=asset_url)
 
 # -------------------- Run --------------------
 if __name__ == '__main__':
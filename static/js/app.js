@@ -75,8 +75,224 @@
     }
   }
 
+  // Patients list: rows come from the server page by page (keyset cursor) and only the
+  // rows around the visible part of the scroll box are kept in the DOM.
+  function initPatientsList(box) {
+    const BUFFER = 15;        // extra rows rendered above and below the viewport
+    const DEBOUNCE_MS = 300;  // wait for typing to pause before searching
+    const form = document.getElementById("patients-search");
+    const bulkForm = document.getElementById("bulk-form");
+    const status = document.getElementById("patients-status");
+    const exportLink = document.getElementById("patients-export");
+    const selAll = document.getElementById("sel-all");
+    const [padTop, padBottom] = box.querySelectorAll("tbody.vlist-pad");
+
+    let items = [];             // [{id, html}] in list order
+    let nodes = new Map();      // item index -> rendered <tbody>
+    const selected = new Set(); // ids of ticked rows, rendered or not
+    let nextAfter = null;
+    let done = false;
+    let controller = null;      // in-flight request, aborted by a new search
+    let rowHeight = 40;
+    let frame = 0;
+    let debounce = 0;
+
+    function params() {
+      const p = new URLSearchParams(new FormData(form));
+      for (const [k, v] of [...p]) if (!v) p.delete(k);
+      return p;
+    }
+
+    function updateStatus() {
+      if (done && !items.length) status.textContent = status.dataset.empty;
+      else status.textContent = status.dataset.loaded.replace("{}", items.length);
+    }
+
+    function reset() {
+      if (controller) controller.abort();
+      controller = null;
+      items = [];
+      nextAfter = null;
+      done = false;
+      selected.clear();
+      if (selAll) selAll.checked = false;
+      nodes.forEach((el) => el.remove());
+      nodes = new Map();
+      box.scrollTop = 0;
+    }
+
+    function load() {
+      if (controller || done) return;
+      const p = params();
+      p.set("limit", box.dataset.limit);
+      if (nextAfter) p.set("after", nextAfter);
+      const mine = (controller = new AbortController());
+      status.textContent = status.dataset.loading;
+      fetch(box.dataset.url + "?" + p, { signal: mine.signal, headers: { Accept: "application/json" } })
+        .then((r) => r.json())
+        .then(function (data) {
+          if (mine !== controller) return;  // superseded by a newer search
+          const tpl = document.createElement("template");
+          tpl.innerHTML = data.html;
+          tpl.content.querySelectorAll("tbody[data-id]").forEach(function (el) {
+            items.push({ id: el.dataset.id, html: el.outerHTML });
+            if (selAll && selAll.checked) selected.add(el.dataset.id);
+          });
+          nextAfter = data.next_after;
+          done = data.next_after === null;
+          controller = null;
+          updateStatus();
+          render();
+        })
+        .catch(function (err) {
+          if (err.name === "AbortError" || mine !== controller) return;
+          controller = null;
+          status.textContent = String(err);
+        });
+    }
+
+    function build(item) {
+      const tpl = document.createElement("template");
+      tpl.innerHTML = item.html;
+      const el = tpl.content.firstElementChild;
+      const cb = el.querySelector(".sel-row");
+      if (cb) cb.checked = selected.has(item.id);
+      return el;
+    }
+
+    function render() {
+      frame = 0;
+      const n = items.length;
+      const first = Math.max(0, Math.floor(box.scrollTop / rowHeight) - BUFFER);
+      const last = Math.min(n, first + Math.ceil(box.clientHeight / rowHeight) + 2 * BUFFER);
+      nodes.forEach(function (el, i) {
+        if (i < first || i >= last) { el.remove(); nodes.delete(i); }
+      });
+      let prev = padTop;
+      for (let i = first; i < last; i++) {
+        let el = nodes.get(i);
+        if (!el) { el = build(items[i]); nodes.set(i, el); }
+        if (prev.nextElementSibling !== el) prev.after(el);
+        prev = el;
+      }
+      if (nodes.size) {
+        let total = 0;
+        nodes.forEach((el) => { total += el.offsetHeight; });
+        rowHeight = Math.max(20, total / nodes.size);
+      }
+      padTop.querySelector("td").style.height = first * rowHeight + "px";
+      padBottom.querySelector("td").style.height = (n - last) * rowHeight + "px";
+      if (!done && last >= n - BUFFER) load();
+    }
+
+    function search() {
+      const p = params();
+      history.replaceState(null, "", location.pathname + (p.toString() ? "?" + p : ""));
+      if (exportLink) exportLink.href = exportLink.href.split("?")[0] + (p.toString() ? "?" + p : "");
+      if (bulkForm && bulkForm.elements.next) bulkForm.elements.next.value = location.pathname + location.search;
+      reset();
+      render();
+    }
+
+    box.addEventListener("scroll", function () {
+      if (!frame) frame = requestAnimationFrame(render);
+    });
+    window.addEventListener("resize", function () {
+      if (!frame) frame = requestAnimationFrame(render);
+    });
+    form.addEventListener("input", function (e) {
+      if (e.target.type === "checkbox") return;
+      clearTimeout(debounce);
+      debounce = setTimeout(search, DEBOUNCE_MS);
+    });
+    form.addEventListener("submit", function (e) {
+      e.preventDefault();
+      clearTimeout(debounce);
+      search();
+    });
+    // The archive has no bulk actions: reload the page so the server renders the right toolbar
+    form.addEventListener("change", function (e) {
+      if (e.target.name === "archive") form.submit();
+    });
+
+    box.addEventListener("change", function (e) {
+      if (!e.target.classList.contains("sel-row")) return;
+      if (e.target.checked) selected.add(e.target.value);
+      else selected.delete(e.target.value);
+    });
+    if (selAll) {
+      selAll.addEventListener("change", function () {
+        selected.clear();
+        if (selAll.checked) items.forEach((item) => selected.add(item.id));
+        box.querySelectorAll(".sel-row").forEach((cb) => { cb.checked = selAll.checked; });
+      });
+    }
+    // Ticked rows that are scrolled out of the DOM still have to be submitted
+    if (bulkForm) {
+      bulkForm.addEventListener("submit", function () {
+        bulkForm.querySelectorAll("input.vlist-sel").forEach((el) => el.remove());
+        selected.forEach(function (id) {
+          if (box.querySelector(`.sel-row[value="${id}"]`)) return;
+          const input = document.createElement("input");
+          input.type = "hidden";
+          input.name = "sel";
+          input.value = id;
+          input.className = "vlist-sel";
+          bulkForm.appendChild(input);
+        });
+      });
+    }
+
+    render();
+  }
+
+  // Suggestions for inputs with data-autocomplete="<url>", shown through a <datalist>
+  function initAutocomplete(input, n) {
+    const list = document.createElement("datalist");
+    list.id = "autocomplete-" + n;
+    input.setAttribute("list", list.id);
+    input.after(list);
+    let timer = 0;
+    let controller = null;
+    input.addEventListener("input", function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        if (controller) controller.abort();
+        const q = input.value.trim();
+        if (!q) { list.innerHTML = ""; return; }
+        controller = new AbortController();
+        fetch(input.dataset.autocomplete + "?q=" + encodeURIComponent(q), { signal: controller.signal })
+          .then((r) => r.json())
+          .then(function (data) {
+            list.innerHTML = "";
+            data.items.forEach(function (value) {
+              const opt = document.createElement("option");
+              opt.value = value;
+              list.appendChild(opt);
+            });
+          })
+          .catch(() => {});
+      }, 150);
+    });
+  }
+
+  // Inpatient board: each block card fills itself from its own endpoint
+  function loadBlocks() {
+    document.querySelectorAll("[data-block-url]").forEach(function (card) {
+      fetch(card.dataset.blockUrl, { headers: { Accept: "text/html" } })
+        .then((r) => (r.ok ? r.text() : Promise.reject(new Error(r.status))))
+        .then((html) => { card.innerHTML = html; })
+        .catch((err) => { card.textContent = String(err); });
+    });
+  }
+
   document.addEventListener("DOMContentLoaded", function () {
     initPickers();
+    loadBlocks();
+    document.querySelectorAll("input[data-autocomplete]").forEach(initAutocomplete);
+
+    const patientsList = document.getElementById("patients-list");
+    if (patientsList) initPatientsList(patientsList);
 
     // If caregiver fields show/hide dynamically, re-init when toggled
     document.addEventListener("change", function (e) {
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from flask import g, request_started
+
+# app.py reads its configuration at import time: point it at a throwaway database first
+_TMP = tempfile.mkdtemp(prefix='clinic-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_TMP, 'test.db')
+os.environ['BACKUP_FOLDER'] = os.path.join(_TMP, 'backups')
+os.environ['BACKUP_INTERVAL_HOURS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as clinic  # noqa: E402
+
+
+@request_started.connect_via(clinic.app)
+def _fresh_g(sender, **extra):
+    # requests reuse the fixture's app context, and with it g (current user, ward scope, translator)
+    for name in list(g):
+        g.pop(name)
+
+
+@pytest.fixture
+def app():
+    clinic.app.config['TESTING'] = True
+    clinic.app.config['UPLOAD_FOLDER'] = os.path.join(_TMP, 'uploads')
+    with clinic.app.app_context():
+        clinic.db.drop_all()
+        clinic.init_db()
+        clinic._db_ready = True
+        yield clinic.app
+        clinic.flush_audit()
+        clinic.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username='superadmin', password='5358287'):
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+def patient_form(**overrides):
+    """A complete /register form for a patient discharged long ago, in the first ward and doctor."""
+    data = dict(hist_number='1', last_name='Karimov', first_name='Aziz', patronymic='Anvarovich',
+                birth_date='01.02.1980', phone='901234567', address='Tashkent', occupation='Driver',
+                arrival_date='01.01.2020', arrival_time='10:00', discharge_datetime='10.01.2020 12:00',
+                ward_id=str(clinic.Ward.query.order_by(clinic.Ward.sort_order).first().id),
+                doctor_id=str(clinic.Doctor.query.order_by(clinic.Doctor.sort_order).first().id),
+                caregiver_exists='no', confirm_duplicate='1')
+    data.update(overrides)
+    return data
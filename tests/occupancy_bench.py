@@ -0,0 +1,92 @@
+"""Time the occupancy index queries against the reference rules as the number of stays grows.
+
+    DATABASE_URL=sqlite:////path/copy.db python tests/occupancy_bench.py [--sizes 1000,5000,20000] [--seed N]
+
+Adds random stays (see test_occupancy.occupancy_case()) in one transaction that is always rolled back,
+so nothing is kept; it holds the write lock while it runs, so point DATABASE_URL at a copy. Prints median
+timings per size and exits non-zero, with the seed, if the index and the reference ever disagree.
+"""
+import os
+import random
+import sys
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+import click
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), HERE]  # app.py and test_occupancy.py
+
+from app import app, db, init_db, _free_beds, _ward_occupancy, Doctor, Patient, Ward  # noqa: E402
+from sqlalchemy import func  # noqa: E402
+from test_occupancy import REFERENCE_COLUMNS, add_cases, boundary_moments, occupancy_diff, reference_occupancy  # noqa: E402
+
+
+@click.command()
+@click.option('--sizes', default='1000,5000,20000', show_default=True,
+              help='Comma-separated totals of synthetic patients to check and time at.')
+@click.option('--moments', type=int, default=40, show_default=True, help='Boundary timestamps checked per size.')
+@click.option('--seed', type=int, default=None, help='Random seed, to repeat a failing run.')
+def main(sizes, moments, seed):
+    try:
+        sizes = sorted({int(x) for x in sizes.split(',') if x.strip()})
+    except ValueError:
+        raise click.BadParameter('expected comma-separated numbers', param_hint='--sizes')
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    rnd = random.Random(seed)
+    with app.app_context():
+        init_db()
+        wards = Ward.query.order_by(Ward.block.asc(), Ward.sort_order.asc()).all()
+        doctors = Doctor.query.order_by(Doctor.id).all()
+        if not wards or not doctors:
+            raise click.ClickException('Needs at least one ward and one doctor.')
+        base = datetime.now().replace(second=0, microsecond=0)
+        first_id = (db.session.query(func.max(Patient.id)).scalar() or 0) + 1
+        click.echo(f"seed={seed}")
+        click.echo(f"{'patients':>9} {'moments':>8} {'index ms':>9} {'board ms':>9} {'free ms':>8} "
+                   f"{'reference ms':>13} {'mismatches':>11}")
+        failures = []
+        with app.test_request_context():  # _free_beds() reads the ward scope of the (absent) user
+            try:
+                boundaries = []
+                added = 0
+                for size in sizes:
+                    ids = [first_id + n for n in range(added, size)]
+                    started = perf_counter()
+                    add_cases(rnd, ids, wards, doctors, base)
+                    index_ms = (perf_counter() - started) * 1000
+                    added = size
+
+                    rows = db.session.query(*REFERENCE_COLUMNS).all()
+                    new_ids = set(ids)
+                    boundaries += boundary_moments(r for r in rows if r.id in new_ids)
+                    times = {'board': [], 'free': [], 'reference': []}
+                    mismatches = 0
+                    for at_dt in rnd.sample(boundaries, min(moments, len(boundaries))):
+                        started = perf_counter()
+                        index = _ward_occupancy(at_dt, wards)
+                        times['board'].append(perf_counter() - started)
+                        started = perf_counter()
+                        free = {w['id']: w['occupied'] for items in _free_beds(at_dt).values() for w in items}
+                        times['free'].append(perf_counter() - started)
+                        started = perf_counter()
+                        reference = reference_occupancy(rows, at_dt, wards)
+                        times['reference'].append(perf_counter() - started)
+                        problems = occupancy_diff(at_dt, index, reference, free)
+                        mismatches += bool(problems)
+                        failures += problems
+                    ms = {k: median(v) * 1000 if v else 0 for k, v in times.items()}
+                    click.echo(f"{size:>9} {len(times['board']):>8} {index_ms:>9.1f} {ms['board']:>9.2f} "
+                               f"{ms['free']:>8.2f} {ms['reference']:>13.2f} {mismatches:>11}")
+            finally:
+                db.session.rollback()
+    if failures:
+        for message in failures[:20]:
+            click.echo(message, err=True)
+        raise click.ClickException(f"{len(failures)} occupancy mismatches (rerun with --seed {seed})")
+    click.echo("Index queries match the reference at every checked moment.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import json
+
+from conftest import clinic, login, patient_form
+
+
+def _api_patient(n, **overrides):
+    item = patient_form(hist_number=f'H{n}', last_name=f'Name{n}', discharge_datetime='')
+    del item['confirm_duplicate']
+    item.update(overrides)
+    return item
+
+
+def test_requires_login(client):
+    assert client.get('/api/v1/patients').status_code == 401
+
+
+def test_bulk_create_is_all_or_nothing(client):
+    login(client)
+    items = [_api_patient(n) for n in range(5)]
+    bad = items + [_api_patient(5, ward_id='99999'), _api_patient(6, last_name='')]
+    response = client.post('/api/v1/patients/bulk', json=bad)
+    assert response.status_code == 400
+    assert [e['index'] for e in response.get_json()['errors']] == [5, 6]
+    assert clinic.Patient.query.count() == 0
+
+    response = client.post('/api/v1/patients/bulk', json={'patients': items})
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 5
+    assert clinic.Patient.query.count() == 5
+    assert clinic.Stay.query.count() == 5  # occupancy index kept in step
+
+
+def test_keyset_paging_and_ndjson(client):
+    login(client)
+    client.post('/api/v1/patients/bulk', json=[_api_patient(n) for n in range(7)])
+    all_ids = [pid for (pid,) in clinic.db.session.query(clinic.Patient.id).order_by(clinic.Patient.id.desc())]
+
+    seen, after = [], None
+    while True:
+        page = client.get('/api/v1/patients', query_string={'limit': 3, 'after': after or ''}).get_json()
+        seen += [p['id'] for p in page['items']]
+        after = page['next_after']
+        if after is None:
+            break
+    assert seen == all_ids
+
+    filtered = client.get('/api/v1/patients', query_string={'q_last': 'Name1'}).get_json()
+    assert [p['hist_number'] for p in filtered['items']] == ['H1']
+    assert client.get('/api/v1/patients', query_string={'after': 'x'}).status_code == 400
+
+    response = client.get('/api/v1/patients', query_string={'format': 'ndjson', 'after': all_ids[1]})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == all_ids[2:]
+
+
+def test_occupancy_snapshot(client):
+    login(client)
+    client.post('/api/v1/patients/bulk', json=[_api_patient(1, arrival_date='01.03.2025', arrival_time='10:00')])
+    ward_id = int(_api_patient(1)['ward_id'])
+    data = client.get('/api/v1/occupancy', query_string={'at': '02.03.2025 10:00'}).get_json()
+    ward = next(w for w in data['blocks']['A'] if w['ward_id'] == ward_id)
+    assert [o['type'] for o in ward['occupants']] == ['patient']
+    before = client.get('/api/v1/occupancy', query_string={'at': '28.02.2025 10:00'}).get_json()
+    assert all(not w['occupants'] for b in before['blocks'].values() for w in b)
+    assert client.get('/api/v1/occupancy', query_string={'at': 'soon'}).status_code == 400
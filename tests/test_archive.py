@@ -0,0 +1,35 @@
+from conftest import clinic, login, patient_form
+
+
+def test_archived_ids_are_not_reused(client):
+    login(client)
+    client.post('/register', data=patient_form(hist_number='1'))
+    (first,) = [pid for (pid,) in clinic.db.session.query(clinic.Patient.id)]
+    assert clinic.archive_discharged(days=30) == 1
+
+    client.post('/register', data=patient_form(hist_number='2', last_name='Rahimov'))
+    (second,) = [pid for (pid,) in clinic.db.session.query(clinic.Patient.id)]
+    assert second > first
+    assert clinic.archive_discharged(days=30) == 1
+    assert sorted(pid for (pid,) in clinic.db.session.query(clinic.PatientArchive.id)) == [first, second]
+
+
+def test_existing_table_is_rebuilt_above_archived_ids(app):
+    engine = clinic.db.engine
+    with engine.begin() as conn:
+        # the table as created before it had AUTOINCREMENT
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'patient'").scalar()
+        conn.exec_driver_sql('DROP TABLE patient')
+        conn.exec_driver_sql(ddl.replace('AUTOINCREMENT', ''))
+        conn.exec_driver_sql("INSERT INTO patient_archive (id, hist_number, last_name, first_name, patronymic, "
+                             "birth_date, phone, address, occupation, arrival_date, arrival_time, ward_id, "
+                             "doctor_id, caregiver_exists, archived_at) VALUES "
+                             "(7, '7', 'a', 'b', 'c', '01.01.1990', '', '', '', '01.01.2020', '10:00', 1, 1, 0, "
+                             "'2024-01-01 00:00:00')")
+    clinic.db.session.remove()
+    clinic.init_db()
+    with engine.connect() as conn:
+        sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'patient'").scalar()
+        seq = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'patient'").scalar()
+    assert 'AUTOINCREMENT' in sql.upper()
+    assert seq == 7
@@ -0,0 +1,47 @@
+import json
+
+from conftest import clinic, login, patient_form
+
+AuditLog, Patient = clinic.AuditLog, clinic.Patient
+
+
+def test_entries_are_written_after_commit_only(client):
+    login(client)
+    client.post('/register', data=patient_form(discharge_datetime=''))
+    p = Patient.query.one()
+    clinic.flush_audit()
+    (created,) = AuditLog.query.all()
+    assert (created.patient_id, created.action, created.username) == (p.id, 'create', 'superadmin')
+
+    before = clinic.audit_snapshot([p.id])
+    p.phone = '999'
+    clinic.db.session.flush()
+    clinic.audit_patients('update', before, clinic.audit_snapshot([p.id]))
+    assert AuditLog.query.count() == 1          # pending until the transaction commits
+    clinic.db.session.rollback()
+    clinic.flush_audit()
+    assert AuditLog.query.count() == 1
+    assert 'audit' not in clinic.db.session.info
+
+    before = clinic.audit_snapshot([p.id])
+    p.phone = '888'
+    clinic.db.session.flush()
+    clinic.audit_patients('update', before, clinic.audit_snapshot([p.id]))
+    clinic.audit_patients('update', before, before)  # nothing changed: no entry
+    clinic.db.session.commit()
+    clinic.flush_audit()
+    last = AuditLog.query.order_by(AuditLog.id.desc()).first()
+    assert AuditLog.query.count() == 2
+    assert json.loads(last.changes) == {'phone': [patient_form()['phone'], '888']}
+    assert last.username is None                # no request: CLI / system
+
+
+def test_history_page_lists_changes(client):
+    login(client)
+    client.post('/register', data=patient_form(discharge_datetime=''))
+    p = Patient.query.one()
+    client.post('/patients/bulk', data={'sel': [p.id], 'action': 'discharge',
+                                        'discharge_datetime': '05.03.2025 10:00'})
+    page = client.get(f'/patients/{p.id}/history').get_data(as_text=True)
+    assert '05.03.2025 10:00' in page
+    assert [a.action for a in AuditLog.query.order_by(AuditLog.id)] == ['create', 'discharge']
@@ -0,0 +1,45 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import clinic, login, patient_form
+
+
+def stored_version():
+    """The data_version counter as stored; data_version() keeps the first read for the app context."""
+    return clinic.db.session.get(clinic.AppState, 'data_version').value
+
+
+@pytest.fixture
+def backups(app):
+    shutil.rmtree(app.config['BACKUP_FOLDER'], ignore_errors=True)
+    yield app.config['BACKUP_FOLDER']
+    shutil.rmtree(app.config['BACKUP_FOLDER'], ignore_errors=True)
+
+
+def test_backup_and_restore_round_trip(client, backups):
+    login(client)
+    client.post('/register', data=patient_form(hist_number='kept'))
+    info = clinic.create_backup()
+    assert os.path.exists(info['path']) and info['pages'] > 0
+    assert [b['name'] for b in clinic.list_backups()] == [info['name']]
+
+    client.post('/register', data=patient_form(hist_number='lost', last_name='Rahimov'))
+    version = stored_version()
+    clinic.restore_backup(info['name'])
+
+    assert [p.hist_number for p in clinic.Patient.query] == ['kept']
+    assert clinic.Stay.query.count() == 1
+    assert stored_version() > version  # fragments cached before the restore are not served
+
+
+def test_rotation_and_names(app, backups):
+    app.config['BACKUP_KEEP'], keep = 2, app.config['BACKUP_KEEP']
+    try:
+        names = [clinic.create_backup()['name'] for _ in range(3)]
+    finally:
+        app.config['BACKUP_KEEP'] = keep
+    assert [b['name'] for b in clinic.list_backups()] == names[:0:-1]
+    with pytest.raises(FileNotFoundError):
+        clinic.restore_backup('../database.db')
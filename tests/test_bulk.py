@@ -0,0 +1,75 @@
+from conftest import clinic, login, patient_form
+
+
+def _registered(client, **overrides):
+    client.post('/register', data=patient_form(**overrides))
+    return clinic.Patient.query.order_by(clinic.Patient.id.desc()).first()
+
+
+def test_transfer_to_unknown_ward_is_rejected(client):
+    login(client)
+    p = _registered(client, discharge_datetime='')
+    ward_id = p.ward_id
+    client.post('/patients/bulk', data={'sel': [p.id], 'action': 'transfer', 'ward_id': '99999'})
+    client.post('/patients/bulk', data={'sel': [p.id], 'action': 'transfer', 'ward_id': str(ward_id),
+                                        'caregiver_ward_id': '99999'})
+    clinic.db.session.expire_all()
+    assert clinic.db.session.get(clinic.Patient, p.id).ward_id == ward_id
+    assert clinic.db.session.get(clinic.Patient, p.id).version == 1
+
+
+def test_transfer_to_known_ward(client):
+    login(client)
+    p = _registered(client, discharge_datetime='')
+    target = clinic.Ward.query.filter(clinic.Ward.id != p.ward_id).first().id
+    client.post('/patients/bulk', data={'sel': [p.id], 'action': 'transfer', 'ward_id': str(target)})
+    clinic.db.session.expire_all()
+    assert clinic.db.session.get(clinic.Patient, p.id).ward_id == target
+
+
+def test_palata_user_cannot_move_patients_out_of_scope(client):
+    login(client)
+    p = _registered(client, discharge_datetime='')                     # first ward, block A
+    other_block = clinic.Ward.query.filter(clinic.Ward.block == 'B').first().id
+    client.get('/logout')
+    login(client, 'palata1', '7825065')
+
+    client.post('/patients/bulk', data={'sel': [p.id], 'action': 'transfer', 'ward_id': str(other_block)})
+    client.post('/register', data=patient_form(hist_number='2', ward_id=str(other_block)))
+    clinic.db.session.expire_all()
+    assert clinic.db.session.get(clinic.Patient, p.id).ward_id == p.ward_id
+    assert clinic.Patient.query.count() == 1
+
+    page = client.get('/register').get_data(as_text=True)
+    assert f'<option value="{other_block}"' not in page
+    assert f'<option value="{other_block}"' not in client.get(f'/patients/{p.id}/edit').get_data(as_text=True)
+
+
+def test_persons_outside_the_scope_are_hidden(client):
+    login(client)
+    b_ward = clinic.Ward.query.filter(clinic.Ward.block == 'B').first().id
+    p = _registered(client, ward_id=str(b_ward), discharge_datetime='')   # block B only
+    client.get('/logout')
+    login(client, 'palata1', '7825065')                                    # block A
+
+    assert client.get(f'/persons/{p.person_id}').status_code == 404
+    assert 'Karimov' not in client.get(f'/register?person_id={p.person_id}').get_data(as_text=True)
+    found = client.get('/persons/duplicates', query_string=dict(
+        last_name='Karimov', first_name='Aziz', patronymic='Anvarovich', birth_date='01.02.1980')).get_json()
+    assert found['items'] == []
+
+    client.get('/logout')
+    login(client, 'palata2', '6037809')                                    # block B
+    assert client.get(f'/persons/{p.person_id}').status_code == 200
+
+
+def test_transfer_skips_discharged_patients(client):
+    login(client)
+    gone = _registered(client)                                       # discharged in 2020
+    here = _registered(client, hist_number='2', last_name='Rahimov', discharge_datetime='')
+    target = clinic.Ward.query.filter(clinic.Ward.id != gone.ward_id).first().id
+    client.post('/patients/bulk', data={'sel': [gone.id, here.id], 'action': 'transfer', 'ward_id': str(target)})
+    clinic.db.session.expire_all()
+    assert clinic.db.session.get(clinic.Patient, gone.id).ward_id != target
+    assert clinic.db.session.get(clinic.Patient, here.id).ward_id == target
+    assert {s.ward_id for s in clinic.Stay.query.filter_by(patient_id=gone.id)} == {gone.ward_id}
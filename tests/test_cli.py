@@ -0,0 +1,66 @@
+from conftest import clinic
+
+Patient, Person, Stay, Ward = clinic.Patient, clinic.Person, clinic.Stay, clinic.Ward
+
+
+def _seed(app, count=60):
+    result = app.test_cli_runner().invoke(args=['data', 'seed', '--patients', str(count), '--seed', '1'])
+    assert result.exit_code == 0, result.output
+    clinic.db.session.expire_all()
+
+
+def _delete(app, *args):
+    return app.test_cli_runner().invoke(args=['data', 'delete', '--yes', *args])
+
+
+def test_delete_by_ward_keeps_other_patients_indexed(app):
+    _seed(app)
+    ward = Ward.query.order_by(Ward.sort_order).first()
+    kept = Patient.query.filter(Patient.ward_id != ward.id).count()
+    stays = Stay.query.join(Patient, Patient.id == Stay.patient_id).filter(Patient.ward_id != ward.id).count()
+
+    result = _delete(app, '--ward', ward.name)
+    assert result.exit_code == 0, result.output
+    clinic.db.session.expire_all()
+    assert Patient.query.filter(Patient.ward_id == ward.id).count() == 0
+    assert Patient.query.count() == kept
+    assert Stay.query.count() == stays
+    assert Patient.query.filter(~Patient.person_id.in_(clinic.db.select(Person.id))).count() == 0
+    assert Person.query.filter(~Person.id.in_(clinic.db.select(Patient.person_id))).count() == 0
+
+
+def test_delete_filters(app):
+    _seed(app)
+    Patient.query.filter(Patient.id <= 3).update({Patient.hist_number: 'X1'})
+    Patient.query.filter(Patient.id == 4).update({Patient.phone: ''})
+    clinic.db.session.commit()
+    total = Patient.query.count()
+
+    assert _delete(app, '--hist', 'X').exit_code == 0
+    assert _delete(app, '--invalid').exit_code == 0
+    clinic.db.session.expire_all()
+    assert Patient.query.count() == total - 4
+
+    arrived = Stay.query.filter(Stay.kind == 'P').order_by(Stay.start_at).all()
+    cutoff = arrived[len(arrived) // 2].start_at
+    before = Stay.query.filter(Stay.kind == 'P', Stay.start_at < cutoff.replace(hour=0, minute=0)).count()
+    assert _delete(app, '--arrived-before', cutoff.strftime('%d.%m.%Y')).exit_code == 0
+    clinic.db.session.expire_all()
+    assert Patient.query.count() == total - 4 - before
+    assert Stay.query.filter(Stay.kind == 'P', Stay.start_at < cutoff.replace(hour=0, minute=0)).count() == 0
+
+
+def test_delete_all_cannot_be_combined_with_filters(app):
+    _seed(app, 10)
+    result = _delete(app, '--all', '--hist', 'S1')
+    assert result.exit_code != 0
+    assert 'cannot be combined' in result.output
+    assert Patient.query.count() == 10
+
+    assert _delete(app, '--all').exit_code == 0
+    clinic.db.session.expire_all()
+    assert (Patient.query.count(), Stay.query.count(), Person.query.count()) == (0, 0, 0)
+
+
+def test_delete_needs_a_filter(app):
+    assert _delete(app).exit_code != 0
@@ -0,0 +1,29 @@
+from conftest import clinic, login, patient_form
+
+
+def _form(p, **changes):
+    form = {f: getattr(p, f) or '' for f in clinic.AUDIT_FIELDS if not f.startswith('caregiver')}
+    form.update(ward_id=str(p.ward_id), doctor_id=str(p.doctor_id), caregiver_exists='no', version=str(p.version))
+    form.update(changes)
+    return form
+
+
+def test_edit_without_valid_version_is_rejected(client):
+    login(client)
+    client.post('/register', data=patient_form())
+    p = clinic.Patient.query.one()
+    form = _form(p, phone='555')
+    del form['version']
+    assert client.post(f'/patients/{p.id}/edit', data=form).status_code == 400
+    assert client.post(f'/patients/{p.id}/edit', data=_form(p, phone='555', version='x')).status_code == 400
+    clinic.db.session.expire_all()
+    assert clinic.db.session.get(clinic.Patient, p.id).phone == patient_form()['phone']
+
+
+def test_stale_version_shows_conflict(client):
+    login(client)
+    client.post('/register', data=patient_form())
+    p = clinic.Patient.query.one()
+    stale = _form(p, phone='555')
+    assert client.post(f'/patients/{p.id}/edit', data=_form(p, phone='444')).status_code == 302
+    assert client.post(f'/patients/{p.id}/edit', data=stale).status_code == 409
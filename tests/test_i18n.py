@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from conftest import clinic
+
+
+def test_catalogs_match_reference_language():
+    assert clinic.translation_problems(clinic.I18N) == []
+
+
+def test_every_used_key_is_translated():
+    assert clinic.untranslated_keys(clinic.I18N, clinic.used_translation_keys()) == []
+
+
+def test_unknown_key_in_template_is_reported(tmp_path):
+    (tmp_path / 'page.html').write_text("{{ t('hist_number') }} {{ t(\"no_such_key\") }}", encoding='utf-8')
+    used = clinic.used_translation_keys([str(tmp_path)])
+    assert set(used) == {'hist_number', 'no_such_key'}
+    (problem,) = clinic.untranslated_keys(clinic.I18N, used)
+    assert 'no_such_key' in problem
+
+
+def test_duplicate_keys_are_rejected(tmp_path):
+    (tmp_path / 'uz.json').write_text('{"a": "1", "a": "2"}', encoding='utf-8')
+    with pytest.raises(ValueError, match='duplicate keys: a'):
+        clinic.load_translations(str(tmp_path))
+
+
+def test_missing_and_placeholder_problems(tmp_path):
+    (tmp_path / 'uz.json').write_text(json.dumps({'a': '{} x', 'b': 'y'}), encoding='utf-8')
+    (tmp_path / 'en.json').write_text(json.dumps({'a': 'x', 'c': 'z'}), encoding='utf-8')
+    problems = clinic.translation_problems(clinic.load_translations(str(tmp_path)))
+    assert sorted(problems) == ['en: missing b', 'en: placeholders differ in a', 'en: unknown c']
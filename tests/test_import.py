@@ -0,0 +1,40 @@
+import io
+import os
+
+from openpyxl import load_workbook
+
+from conftest import clinic, login
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_sheets_without_header_are_skipped(client):
+    login(client)
+    with open(os.path.join(REPO, 'uploads', 'Palata Qabul.xlsx'), 'rb') as fh:
+        response = client.post('/settings/import', data={'file': (fh, 'Palata Qabul.xlsx')},
+                               content_type='multipart/form-data', follow_redirects=True)
+    page = response.get_data(as_text=True)
+    assert 'Skipped Palata Qabul.xlsx [PalataQabul 3]' in page
+    assert clinic.Patient.query.count() == 908
+
+
+def test_dry_run_report_counts(client):
+    login(client)
+    with open(os.path.join(REPO, 'uploads', 'Palata Qabul.xlsx'), 'rb') as fh:
+        response = client.post('/settings/import', data={'file': (fh, 'Palata Qabul.xlsx'), 'dry_run': '1'},
+                               content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert clinic.Patient.query.count() == 0
+
+    wb = load_workbook(io.BytesIO(response.data))
+    summary = {row[0]: row[1] for row in wb['Summary'].iter_rows(values_only=True) if row and row[0]}
+    statuses = [row[4] for row in wb['Rows'].iter_rows(min_row=2, values_only=True)]
+    assert summary['sheets'] == 1
+    assert summary['would_import'] == 908
+    assert summary['rows'] == summary['would_import'] + summary['skipped']
+    assert statuses.count('skipped') == summary['skipped']
+    assert statuses.count('warning') == summary['with_warnings']
+    # problem kinds below the totals add up to at least one per listed row
+    kinds = sum(n for key, n in summary.items()
+                if key not in ('sheets', 'rows', 'would_import', 'skipped', 'with_warnings'))
+    assert kinds >= len(statuses)
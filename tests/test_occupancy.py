@@ -0,0 +1,163 @@
+"""Occupancy index (Stay) queries against a plain per-patient evaluation of the board's rules.
+
+Who is on the inpatient board: a patient from arrival until discharge, both inclusive; a caregiver
+from the later of the patient's and the caregiver's arrival until the departure date, inclusive.
+The helpers here are shared with tests/occupancy_bench.py.
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, update
+
+import app as clinic
+from app import Patient
+
+REFERENCE_COLUMNS = clinic.STAY_SOURCE_COLUMNS + (
+    Patient.hist_number, Patient.last_name, Patient.first_name, Patient.patronymic, Patient.caregiver_fullname,
+)
+EDIT_SHARE = 0.05   # share of each new batch edited afterwards, through the incremental index update
+
+
+def is_active_at(patient, ref_dt):
+    """True if the patient is on the board at ref_dt: arrival <= ref_dt <= discharge, or no discharge."""
+    arr = clinic._parse_dt(patient.arrival_date, patient.arrival_time)
+    if not arr or arr > ref_dt:
+        return False
+    dis = clinic._parse_discharge_dt(patient.discharge_datetime)
+    return dis is None or dis >= ref_dt
+
+
+def caregiver_active_at(patient, ref_dt):
+    """True if the patient's caregiver holds a bed at ref_dt: from the later of the patient's arrival
+    and the caregiver's arrival date until the departure date, or no departure."""
+    if not patient.caregiver_exists:
+        return False
+    arr = clinic._parse_dt(patient.arrival_date, patient.arrival_time)
+    if not arr:
+        return False
+    cg_arr = clinic._parse_dt(patient.caregiver_arrival_date)
+    if max(arr, cg_arr or arr) > ref_dt:
+        return False
+    dep = clinic._parse_dt(patient.caregiver_departure_date)
+    return dep is None or dep >= ref_dt
+
+
+def reference_occupancy(rows, at_dt, wards):
+    """_ward_occupancy() the slow, obvious way: every REFERENCE_COLUMNS row through
+    is_active_at() / caregiver_active_at(), without the occupancy index."""
+    ward_patients = {w.id: [] for w in wards}
+    for r in sorted(rows, key=lambda r: r.id):
+        if r.ward_id in ward_patients and is_active_at(r, at_dt):
+            ward_patients[r.ward_id].append({
+                "id": r.id,
+                "name": f"{r.last_name} {r.first_name} {r.patronymic}".strip(),
+                "hist": r.hist_number,
+                "type": "patient"
+            })
+        cg_ward = r.caregiver_ward_id or r.ward_id
+        if cg_ward in ward_patients and caregiver_active_at(r, at_dt):
+            ward_patients[cg_ward].append({
+                "id": r.id,
+                "name": (r.caregiver_fullname or "").strip(),
+                "hist": "",
+                "type": "caregiver"
+            })
+    return ward_patients
+
+
+def occupancy_case(rnd, n, wards, doctors, base):
+    """A synthetic admission around base, biased towards the edge cases of the occupancy rules:
+    zero-length and date-only stays, caregivers arriving before/after the patient or leaving
+    before them, blank and unparseable dates."""
+    fields = clinic._seed_patient(rnd, n, wards, doctors, base, 1)
+    arrival = base + timedelta(hours=rnd.randint(-72, 72), minutes=rnd.choice([0, 0, 30, rnd.randrange(60)]))
+    fields.update(hist_number=f"OC{n}", arrival_date=arrival.strftime('%d.%m.%Y'),
+                  arrival_time=rnd.choice([arrival.strftime('%H:%M')] * 8 + ['', '24:00']))
+    stay = rnd.choice([None, None, timedelta(0), timedelta(minutes=1), timedelta(hours=rnd.randint(1, 48)),
+                       timedelta(days=rnd.randint(1, 5))])
+    if stay is None:
+        fields['discharge_datetime'] = rnd.choice([None, '', 'soon'])
+    else:
+        discharge = arrival + stay
+        fields['discharge_datetime'] = discharge.strftime(rnd.choice(['%d.%m.%Y %H:%M'] * 4 + ['%d.%m.%Y']))
+    if rnd.random() < 0.05:
+        fields['arrival_date'] = rnd.choice(['', '31.02.2025', arrival.strftime('%Y-%m-%d')])
+    if fields['caregiver_exists'] or rnd.random() < 0.2:
+        day = lambda days: (arrival + timedelta(days=days)).strftime('%d.%m.%Y')
+        fields.update(caregiver_exists=True,
+                      caregiver_fullname=rnd.choice([fields['caregiver_fullname'], None, ' ']),
+                      caregiver_ward_id=rnd.choice([None, fields['ward_id'], rnd.choice(wards).id]),
+                      caregiver_arrival_date=rnd.choice([None, '', day(-1), day(0), day(1)]),
+                      caregiver_departure_date=rnd.choice([None, '', day(0), day(1), day(3), 'n/a']))
+    return fields
+
+
+def add_cases(rnd, ids, wards, doctors, base):
+    """Insert occupancy_case() patients with the given ids, then edit a few of them through the
+    incremental index path, as edit / bulk discharge do. Call inside a transaction."""
+    if ids:
+        clinic.db.session.execute(insert(Patient), [dict(occupancy_case(rnd, pid, wards, doctors, base), id=pid)
+                                                    for pid in ids])
+        clinic._patients_changed(ids)
+    edited = rnd.sample(ids, int(len(ids) * EDIT_SHARE))
+    for pid in edited:
+        changes = occupancy_case(rnd, pid, wards, doctors, base)
+        clinic.db.session.execute(update(Patient).where(Patient.id == pid).values(
+            discharge_datetime=changes['discharge_datetime'],
+            caregiver_departure_date=changes['caregiver_departure_date']))
+    if edited:
+        clinic._patients_changed(edited)
+
+
+def boundary_moments(rows):
+    """Every start and end of the rows' stays, with the minute before and after and a moment with
+    seconds (the export's datetime.now() is not rounded)."""
+    moments = set()
+    for stay in clinic._stays_for(rows):
+        for edge in (stay['start_at'], stay['end_at']):
+            if edge:
+                moments.update((edge - timedelta(minutes=1), edge, edge + timedelta(minutes=1),
+                                edge + timedelta(seconds=30, microseconds=5)))
+    return sorted(moments)
+
+
+def occupancy_diff(at_dt, index, reference, free):
+    """Messages for every ward where the index queries disagree with the reference at at_dt."""
+    at = at_dt.strftime('%d.%m.%Y %H:%M:%S')
+    out = []
+    for ward_id, want in reference.items():
+        got = index[ward_id]
+        if got != want:
+            key = lambda o: (o['id'], o['type'])
+            extra = [key(o) for o in got if o not in want]
+            missing = [key(o) for o in want if o not in got]
+            out.append(f"{at} ward {ward_id}: index extra {extra}, missing {missing}" if extra or missing
+                       else f"{at} ward {ward_id}: same occupants in a different order")
+        if ward_id in free and free[ward_id] != len(want):
+            out.append(f"{at} ward {ward_id}: free-bed finder counts {free[ward_id]}, reference {len(want)}")
+    return out
+
+
+def check_moment(at_dt, rows, wards):
+    """occupancy_diff() of the board query and the free-bed finder at at_dt."""
+    free = {w['id']: w['occupied'] for items in clinic._free_beds(at_dt).values() for w in items}
+    return occupancy_diff(at_dt, clinic._ward_occupancy(at_dt, wards), reference_occupancy(rows, at_dt, wards), free)
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_index_matches_reference(app, seed):
+    rnd = random.Random(seed)
+    wards = clinic.Ward.query.order_by(clinic.Ward.block, clinic.Ward.sort_order).all()
+    for w in wards:
+        w.capacity = 50  # the free-bed finder only lists wards with a capacity
+    doctors = clinic.Doctor.query.all()
+    base = datetime(2025, 3, 1, 12, 0)
+    add_cases(rnd, list(range(1, 301)), wards, doctors, base)
+    clinic.db.session.commit()
+
+    rows = clinic.db.session.query(*REFERENCE_COLUMNS).all()
+    moments = boundary_moments(rows)
+    with app.test_request_context():  # _free_beds() reads the ward scope of the (absent) user
+        problems = [p for at_dt in rnd.sample(moments, 100) for p in check_moment(at_dt, rows, wards)]
+    assert problems == []
@@ -0,0 +1,68 @@
+from conftest import clinic, login, patient_form
+
+
+def _register(client, **overrides):
+    client.post('/register', data=patient_form(**overrides))
+    return clinic.Patient.query.order_by(clinic.Patient.id.desc()).first()
+
+
+def _edit(client, p, **changes):
+    form = {f: getattr(p, f) or '' for f in clinic.AUDIT_FIELDS if not f.startswith('caregiver')}
+    form.update(ward_id=str(p.ward_id), doctor_id=str(p.doctor_id), caregiver_exists='no',
+                version=str(p.version), **changes)
+    client.post(f'/patients/{p.id}/edit', data=form)
+    clinic.db.session.expire_all()
+
+
+def test_contacts_come_from_the_newest_admission(client):
+    login(client)
+    old = _register(client, phone='111', arrival_date='01.01.2020', discharge_datetime='10.01.2020 12:00')
+    _register(client, hist_number='2', phone='222', arrival_date='01.06.2021', discharge_datetime='')
+    _edit(client, old, phone='333')
+    person = clinic.db.session.get(clinic.Person, old.person_id)
+    assert clinic.db.session.get(clinic.Patient, old.id).phone == '333'
+    assert person.phone == '222'
+
+
+def test_renamed_or_deleted_admissions_leave_no_orphan_person(client):
+    login(client)
+    p = _register(client, last_name='Karimvo')
+    misspelled = p.person_id
+    _edit(client, p, last_name='Karimov')
+    assert clinic.db.session.get(clinic.Person, misspelled) is None
+    found = clinic.find_duplicate_candidates('Karimvo', 'Aziz', 'Anvarovich', '01.02.1980')
+    assert [d['person'].last_name for d in found] == ['Karimov']
+
+    person_id = clinic.db.session.get(clinic.Patient, p.id).person_id
+    clinic._delete_patients_chunked([clinic.Patient.id == p.id])
+    assert clinic.db.session.get(clinic.Person, person_id) is None
+
+
+def test_clearing_patients_keeps_archived_persons(client):
+    login(client)
+    alpha = _register(client, last_name='Alpha')
+    alpha_person = alpha.person_id
+    assert clinic.archive_discharged(days=30) == 1
+    client.post('/settings/clear_patients')
+    gamma = _register(client, hist_number='2', last_name='Gamma', discharge_datetime='')
+
+    assert clinic.db.session.get(clinic.Person, alpha_person).last_name == 'Alpha'
+    assert gamma.person_id != alpha_person
+    page = client.get(f'/persons/{gamma.person_id}').get_data(as_text=True)
+    assert 'Gamma' in page and 'Alpha' not in page
+
+
+def test_existing_person_table_is_rebuilt_above_archived_person_ids(client):
+    login(client)
+    _register(client)
+    assert clinic.archive_discharged(days=30) == 1
+    with clinic.db.engine.begin() as conn:
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'person'").scalar()
+        conn.exec_driver_sql('DROP TABLE person')
+        conn.exec_driver_sql(ddl.replace('AUTOINCREMENT', ''))  # as created before, and emptied
+    clinic.db.session.remove()
+    clinic.init_db()
+    with clinic.db.engine.connect() as conn:
+        assert 'AUTOINCREMENT' in conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE name = 'person'").scalar().upper()
+        assert conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'person'").scalar() == 1
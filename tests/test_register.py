@@ -0,0 +1,18 @@
+from conftest import clinic, login, patient_form
+
+
+def test_duplicate_warning_keeps_caregiver(client):
+    login(client)
+    client.post('/register', data=patient_form(discharge_datetime=''))  # still admitted
+    ward_id = patient_form()['ward_id']
+    form = patient_form(hist_number='2', caregiver_exists='yes', caregiver_fullname='Karimova Nodira',
+                        caregiver_ward_id=ward_id, caregiver_arrival_date='01.01.2020',
+                        caregiver_departure_date='05.01.2020')
+    del form['confirm_duplicate']
+    page = client.post('/register', data=form).get_data(as_text=True)
+    assert 'name="confirm_duplicate"' in page
+    assert 'id="careYes" value="yes" checked' in page
+    assert 'value="Karimova Nodira"' in page
+    assert f'<option value="{ward_id}" selected>' in page
+    assert 'value="05.01.2020"' in page
+    assert 'id="caregiverFields" class="row g-2 mt-1 "' in page
@@ -0,0 +1,21 @@
+from conftest import clinic, login, patient_form
+
+
+def test_block_fragment_has_weak_etag_across_encodings(client):
+    login(client)
+    for n in range(20):  # enough rows for the fragment to be compressed
+        client.post('/register', data=patient_form(hist_number=str(n), discharge_datetime=''))
+    plain = client.get('/inpatient/block/A', headers={'Accept-Encoding': 'identity'})
+    zipped = client.get('/inpatient/block/A', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'].startswith('W/"')
+    assert zipped.headers['ETag'] == plain.headers['ETag']
+
+    again = client.get('/inpatient/block/A', headers={'Accept-Encoding': 'gzip',
+                                                      'If-None-Match': zipped.headers['ETag']})
+    assert again.status_code == 304
+
+    client.post('/register', data=patient_form(hist_number='new', last_name='Rahimov', discharge_datetime=''))
+    changed = client.get('/inpatient/block/A', headers={'If-None-Match': zipped.headers['ETag']})
+    assert changed.status_code == 200
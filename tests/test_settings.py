@@ -0,0 +1,36 @@
+from conftest import clinic, login, patient_form
+
+
+def test_wards_and_doctors_of_archived_patients_are_kept(client):
+    login(client)
+    client.post('/register', data=patient_form())
+    p = clinic.Patient.query.one()
+    ward_id, doctor_id = p.ward_id, p.doctor_id
+    assert clinic.archive_discharged(days=30) == 1
+
+    client.post('/settings/wards', data={'delete_selected': '1', 'delete_id': [str(ward_id)]})
+    client.post('/settings/doctors', data={'delete_selected': '1', 'delete_id': [str(doctor_id)]})
+    assert clinic.db.session.get(clinic.Ward, ward_id) is not None
+    assert clinic.db.session.get(clinic.Doctor, doctor_id) is not None
+    assert clinic._ward_reference_counts() == {ward_id: 1}
+    assert clinic._doctor_reference_counts() == {doctor_id: 1}
+
+
+def test_ward_numbers_are_validated(client):
+    login(client)
+    count = clinic.Ward.query.count()
+    for capacity in ('abc', '-1'):
+        response = client.post('/settings/wards', data={'add': '1', 'name': 'Z-1', 'sort_order': '1',
+                                                        'capacity': capacity}, follow_redirects=True)
+        assert response.status_code == 200
+        assert clinic.I18N['uz']['invalid_ward_numbers'] in response.get_data(as_text=True)
+    assert clinic.Ward.query.count() == count
+
+    w = clinic.Ward.query.first()
+    response = client.post('/settings/wards', data={'inline_save': str(w.id), 'wid': str(w.id), 'name': w.name,
+                                                    'sort_order': 'x', 'block': 'A', 'capacity': '4'})
+    assert response.status_code == 302
+    client.post('/settings/wards', data={'inline_save': str(w.id), 'wid': str(w.id), 'name': w.name,
+                                         'sort_order': '3', 'block': 'A', 'capacity': ' 4 '})
+    clinic.db.session.expire_all()
+    assert (w.sort_order, w.capacity) == (3, 4)
@@ -0,0 +1,53 @@
+from conftest import clinic, login
+
+DailyStat, Patient = clinic.DailyStat, clinic.Patient
+
+
+def _stats():
+    """daily_stat as {(day, ward, doctor): counts}, rows that net to zero left out."""
+    out = {}
+    for s in DailyStat.query:
+        values = tuple(getattr(s, f) for f in clinic.DAILY_STAT_FIELDS)
+        if any(values):
+            out[(s.day, s.ward_id, s.doctor_id)] = values
+    return out
+
+
+def _assert_matches_rebuild():
+    clinic.db.session.expire_all()
+    incremental = _stats()
+    clinic.rebuild_daily_stats()
+    clinic.db.session.commit()
+    assert incremental == _stats()
+
+
+def test_incremental_rollups_match_rebuild(app, client):
+    result = app.test_cli_runner().invoke(args=['data', 'seed', '--patients', '80', '--days', '60', '--seed', '3'])
+    assert result.exit_code == 0, result.output
+    _assert_matches_rebuild()
+    login(client)
+
+    # edit: move an admission to another day, ward and doctor
+    p = Patient.query.order_by(Patient.id).first()
+    other_ward = clinic.Ward.query.filter(clinic.Ward.id != p.ward_id, clinic.Ward.block == 'A').first()
+    other_doctor = clinic.Doctor.query.filter(clinic.Doctor.id != p.doctor_id).first()
+    form = {f: getattr(p, f) or '' for f in clinic.AUDIT_FIELDS if not f.startswith('caregiver')}
+    form.update(arrival_date='01.01.2024', ward_id=str(other_ward.id), doctor_id=str(other_doctor.id),
+                caregiver_exists='no', discharge_datetime='03.01.2024 09:30', version=str(p.version))
+    assert client.post(f'/patients/{p.id}/edit', data=form).status_code == 302
+    _assert_matches_rebuild()
+
+    # bulk discharge of everyone still admitted
+    admitted = [pid for (pid,) in clinic.db.session.query(Patient.id).filter(Patient.discharge_datetime.is_(None))]
+    assert admitted
+    client.post('/patients/bulk', data={'sel': admitted, 'action': 'discharge'})
+    _assert_matches_rebuild()
+
+    # delete some, archive the rest that qualify: archived stays keep counting
+    clinic._delete_patients_chunked([Patient.id.in_(admitted[:5])])
+    _assert_matches_rebuild()
+    assert clinic.archive_discharged(days=20) > 0
+    _assert_matches_rebuild()
+
+    # the statistics page reads the same rollups
+    assert client.get('/settings/stats').status_code == 200